@@ -5,57 +5,238 @@ Created on Tue Mar 18 16:57:52 2025
 @author: jveraz
 """
 
-from rdflib import Graph, URIRef, Literal, RDFS, RDF
+from rdflib import URIRef, Literal, RDFS, RDF
+import argparse
+import itertools
 import json
+import os
+import tempfile
+import time
+import zlib
+from functools import lru_cache
+from entity_store import write_store, EntityStore, STORE_PATH
+from feature_matrix import FeatureMatrix, MATRIX_PATH
+from context_builder import ContextBuilder, CONTEXT_PATH
+from lexical_index import LexicalIndex, LEXICAL_PATH
+from graph_adjacency import GraphAdjacency, ADJACENCY_PATH
+from graph_store import NT_LINE, read_graph, unescape as _unescape
 
-# Cargar el grafo RDF
-g = Graph()
-g.parse("grambank_sudamerica_actualizado.ttl", format="turtle")
+RDF_TYPE = str(RDF.type)
 
-def get_all_properties(entity_uri):
+def local_name(term):
+    # Convertir URIs a nombres legibles
+    term = str(term)
+    return term.split("#")[-1] if "#" in term else term
+
+def get_all_properties(g, entity_uri):
     """
     Obtiene todas las propiedades y sus valores para una entidad dada.
     """
     properties = {}
     for p, o in g.predicate_objects(entity_uri):
         # Convertir URIs a nombres legibles
-        p_name = str(p).split("#")[-1] if "#" in str(p) else str(p)
+        p_name = local_name(p)
         if isinstance(o, URIRef):
-            o_name = str(o).split("#")[-1] if "#" in str(o) else str(o)
+            o_name = local_name(o)
         elif isinstance(o, Literal):
             o_name = str(o)
         else:
             o_name = str(o)
-        
+
         # Agregar la propiedad y su valor al diccionario
         if p_name not in properties:
             properties[p_name] = []
         properties[p_name].append(o_name)
-    
+
     return properties
 
-def get_all_entities_properties():
+def get_all_entities_properties(g):
     """
     Obtiene todas las propiedades y sus valores para todas las entidades en el grafo.
     """
     entities_properties = {}
     for entity_uri in g.subjects(RDF.type, None):
-        entity_name = str(entity_uri).split("#")[-1] if "#" in str(entity_uri) else str(entity_uri)
-        entities_properties[entity_name] = get_all_properties(entity_uri)
-    
+        entity_name = local_name(entity_uri)
+        entities_properties[entity_name] = get_all_properties(g, entity_uri)
+
     return entities_properties
 
-# Obtener todas las propiedades para todas las entidades
-all_entities_properties = get_all_entities_properties()
+# ---------------------------------------------------------------------------
+# Exportador en streaming: una pasada sobre un flujo N-Triples, agrupando por
+# sujeto, sin construir el grafo rdflib ni el diccionario completo en memoria.
+# ---------------------------------------------------------------------------
+
+@lru_cache(maxsize=1 << 16)
+def _literal_value(term):
+    # Se pasa por rdflib.Literal para obtener exactamente la misma forma léxica
+    # normalizada que el exportador basado en Graph (p. ej. "NaN"^^xsd:double -> "nan")
+    body, _, suffix = term[1:].rpartition('"')
+    lexical = _unescape(body)
+    if suffix.startswith("@"):
+        return str(Literal(lexical, lang=suffix[1:]))
+    if suffix.startswith("^^"):
+        return str(Literal(lexical, datatype=URIRef(suffix[3:-1])))
+    return lexical
+
+@lru_cache(maxsize=1 << 16)
+def _term_name(term):
+    """
+    Nombre de un término N-Triples tal como aparece en el JSON exportado.
+    """
+    if term.startswith("<"):
+        return local_name(_unescape(term[1:-1]))
+    if term.startswith("_:"):
+        return term[2:]  # str(BNode) es el identificador sin prefijo
+    return _literal_value(term)
+
+def iter_ntriples(path):
+    """
+    Recorre un archivo N-Triples y produce (sujeto, predicado, objeto) en bruto.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            match = NT_LINE.match(line)
+            if match is None:
+                raise ValueError(f"Línea N-Triples no válida: {line[:200]!r}")
+            yield match.groups()
+
+def _group_presorted(triples):
+    for subject, group in itertools.groupby(triples, key=lambda t: t[0]):
+        yield subject, [(p, o) for _, p, o in group]
+
+def _group_external(triples, buckets, tmp_dir):
+    """
+    Agrupación por sujeto en memoria acotada y tiempo lineal: una pasada
+    reparte las líneas en `buckets` archivos por hash del sujeto y luego cada
+    archivo se agrupa por separado. El hash es estable (crc32, no hash(), que
+    cambia con PYTHONHASHSEED), así que el orden de salida (partición a
+    partición y, dentro de cada una, por primera aparición del sujeto) es el
+    mismo en cada ejecución.
+    """
+    paths = [os.path.join(tmp_dir, f"bucket_{i:04d}.nt") for i in range(buckets)]
+    files = [open(path, "w", encoding="utf-8") for path in paths]
+    try:
+        for s, p, o in triples:
+            files[zlib.crc32(s.encode("utf-8")) % buckets].write(f"{s} {p} {o} .\n")
+    finally:
+        for f in files:
+            f.close()
+    for path in paths:
+        grouped = {}
+        for s, p, o in iter_ntriples(path):
+            grouped.setdefault(s, []).append((p, o))
+        os.remove(path)
+        yield from grouped.items()
+
+def iter_entities(path, presorted=False, buckets=64):
+    """
+    Produce (nombre_entidad, propiedades) para cada sujeto con rdf:type,
+    con el mismo contenido que get_all_entities_properties().
+    """
+    with tempfile.TemporaryDirectory(prefix="entities_") as tmp_dir:
+        triples = iter_ntriples(path)
+        groups = _group_presorted(triples) if presorted else _group_external(triples, buckets, tmp_dir)
+        for subject, pairs in groups:
+            if not any(p[1:-1] == RDF_TYPE for p, _ in pairs):
+                continue
+            properties = {}
+            for p, o in pairs:
+                properties.setdefault(_term_name(p), []).append(_term_name(o))
+            yield _term_name(subject), properties
+
+def export_streaming(path, jsonl_path=None, json_path=None, presorted=False, buckets=64):
+    """
+    Escribe cada entidad a medida que se agrupa, en JSON Lines
+    ({"entity": ..., "properties": {...}}) y/o en el JSON original, y la
+    devuelve para los consumidores siguientes (p. ej. write_store).
+    """
+    jsonl = open(jsonl_path, "w", encoding="utf-8") if jsonl_path else None
+    out = open(json_path, "w", encoding="utf-8") if json_path else None
+    try:
+        if out:
+            out.write("{")
+        for i, (entity, properties) in enumerate(iter_entities(path, presorted, buckets)):
+            if jsonl:
+                jsonl.write(json.dumps({"entity": entity, "properties": properties}, ensure_ascii=False) + "\n")
+            if out:
+                # Mismo formato que json.dump(..., indent=4)
+                body = json.dumps(properties, indent=4, ensure_ascii=False).replace("\n", "\n    ")
+                out.write(f"{',' if i else ''}\n    {json.dumps(entity, ensure_ascii=False)}: {body}")
+            yield entity, properties
+        if out:
+            out.write("\n}")
+    finally:
+        if jsonl:
+            jsonl.close()
+        if out:
+            out.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta las propiedades de todas las entidades del KG")
+    parser.add_argument("--entrada", default="grambank_sudamerica_actualizado.ttl")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Exportador en una pasada; la entrada debe estar en N-Triples")
+    parser.add_argument("--ordenado", action="store_true",
+                        help="La entrada N-Triples ya está ordenada/agrupada por sujeto")
+    parser.add_argument("--jsonl", help="Escribir también las entidades en JSON Lines")
+    parser.add_argument("--buckets", type=int, default=64,
+                        help="Particiones temporales para agrupar una entrada no ordenada")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.streaming:
+        records = export_streaming(args.entrada, args.jsonl, "all_entities_properties.json",
+                                   args.ordenado, args.buckets)
+        # El almacén compacto se alimenta del mismo flujo de entidades
+        write_store(records, STORE_PATH)
+        print("✅ Propiedades guardadas en 'all_entities_properties.json'")
+        print(f"✅ Almacén compacto guardado en '{STORE_PATH}'")
+        all_entities_properties = EntityStore(STORE_PATH)
+    else:
+        # Cargar el grafo RDF (desde su almacén binario .gstore si está al día)
+        g = read_graph(args.entrada)
+
+        # Obtener todas las propiedades para todas las entidades
+        all_entities_properties = get_all_entities_properties(g)
+
+        # Imprimir las propiedades de la primera entidad
+        first_entity = list(all_entities_properties.keys())[0]
+        print(f"Propiedades de la entidad '{first_entity}':")
+        for prop, values in all_entities_properties[first_entity].items():
+            print(f"- {prop}: {', '.join(values)}")
+
+        # Guardar en un archivo JSON
+        with open("all_entities_properties.json", "w", encoding="utf-8") as f:
+            json.dump(all_entities_properties, f, indent=4, ensure_ascii=False)
+        print("✅ Propiedades guardadas en 'all_entities_properties.json'")
+
+        if args.jsonl:
+            with open(args.jsonl, "w", encoding="utf-8") as f:
+                for entity, properties in all_entities_properties.items():
+                    f.write(json.dumps({"entity": entity, "properties": properties}, ensure_ascii=False) + "\n")
+
+        # Guardar también el almacén binario compacto que usa inference.py
+        write_store(all_entities_properties, STORE_PATH)
+        print(f"✅ Almacén compacto guardado en '{STORE_PATH}'")
+
+    # Precalcular la matriz lengua × rasgo para las consultas estructuradas
+    FeatureMatrix.build(all_entities_properties).save(MATRIX_PATH)
+    print(f"✅ Matriz de rasgos guardada en '{MATRIX_PATH}'")
+
+    # Precalcular los fragmentos de contexto compactos de cada entidad
+    ContextBuilder(all_entities_properties).precompute().save(CONTEXT_PATH)
+    print(f"✅ Fragmentos de contexto guardados en '{CONTEXT_PATH}'")
+
+    # Índice léxico para la recuperación híbrida y los nombres exactos
+    LexicalIndex.build(all_entities_properties).save(LEXICAL_PATH)
+    print(f"✅ Índice léxico guardado en '{LEXICAL_PATH}'")
 
-# Imprimir las propiedades de la primera entidad
-first_entity = list(all_entities_properties.keys())[0]
-print(f"Propiedades de la entidad '{first_entity}':")
-for prop, values in all_entities_properties[first_entity].items():
-    print(f"- {prop}: {', '.join(values)}")
-    
-# Guardar en un archivo JSON
-with open("all_entities_properties.json", "w", encoding="utf-8") as f:
-    json.dump(all_entities_properties, f, indent=4, ensure_ascii=False)
+    # Adyacencia tipada (CSR) para expandir vecindarios en la recuperación
+    GraphAdjacency.build(all_entities_properties).save(ADJACENCY_PATH)
+    print(f"✅ Adyacencia del grafo guardada en '{ADJACENCY_PATH}'")
+    print(f"⏱️ {time.perf_counter() - start:.2f} s")
 
-print("✅ Propiedades guardadas en 'all_entities_properties.json'")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Caché semántica de respuestas del generador.
+
+Una respuesta se reutiliza si la nueva pregunta recuperó exactamente el
+mismo conjunto de entidades y su embedding tiene similitud coseno >= threshold
+con el de una pregunta ya respondida ("Describe el mapudungun" /
+"describe la lengua mapudungun").
+
+- Entradas en memoria con desalojo LRU y caducidad por TTL, persistidas
+  opcionalmente en SQLite. Varios procesos pueden compartir el archivo: el
+  id de cada fila lo asigna SQLite, y un fallo al escribir en disco (p. ej.
+  base bloqueada) deja la respuesta solo en memoria.
+- Cada entrada lleva la versión de los datos (almacén de entidades, índice,
+  modelo generador); al cambiar la versión se descartan todas.
+- El embedding de la pregunta solo se calcula si ya hay respuestas para ese
+  conjunto de entidades (o al guardar una nueva).
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+def entity_set_key(entities, namespace=""):
+    """
+    Clave del conjunto de entidades recuperadas (sin orden ni repeticiones).
+    """
+    digest = hashlib.sha1(namespace.encode("utf-8"))
+    for uri in sorted(set(entities)):
+        digest.update(b"\0" + uri.encode("utf-8"))
+    return digest.hexdigest()
+
+def _unit(embedding):
+    embedding = np.asarray(embedding, dtype="float32").ravel()
+    norm = np.linalg.norm(embedding)
+    return embedding / norm if norm else embedding
+
+class SemanticAnswerCache:
+    """
+    - threshold: similitud coseno mínima para servir una respuesta en caché.
+    - max_size: número máximo de respuestas (en memoria y en disco).
+    - ttl: segundos de vida de una respuesta; None para no caducar.
+    - path: archivo SQLite opcional.
+    - version: versión de los datos; las entradas de otra versión se descartan.
+    """
+
+    def __init__(self, threshold=0.95, max_size=1024, ttl=None, path=None, version=""):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self.disk_errors = 0
+        self._entries = OrderedDict()  # id -> (clave de entidades, pregunta, embedding, respuesta, creación)
+        self._by_key = {}              # clave de entidades -> {id, ...}
+        self._next_id = 0              # ids negativos para las entradas que solo están en memoria
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "id INTEGER PRIMARY KEY, version TEXT, entity_key TEXT, question TEXT, "
+                "embedding BLOB, answer TEXT, created REAL, last_used REAL)"
+            )
+            self._db.commit()
+            self._load_from_disk()
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def _load_from_disk(self):
+        # Invalidación: las respuestas de otra versión de los datos ya no valen
+        self._db.execute("DELETE FROM answers WHERE version != ?", (self.version,))
+        now = time.time()
+        rows = self._db.execute(
+            "SELECT id, entity_key, question, embedding, answer, created FROM answers "
+            "ORDER BY last_used DESC LIMIT ?", (self.max_size,),
+        ).fetchall()
+        for entry_id, key, question, embedding, answer, created in reversed(rows):
+            if not self._expired(created, now):
+                self._add(entry_id, key, question, np.frombuffer(embedding, dtype="float32"), answer, created)
+        self._db.execute("DELETE FROM answers WHERE id NOT IN (SELECT id FROM answers "
+                         "ORDER BY last_used DESC LIMIT ?)", (self.max_size,))
+        self._db.commit()
+
+    def _write(self, sql, params=()):
+        try:
+            cursor = self._db.execute(sql, params)
+            self._db.commit()
+            return cursor
+        except sqlite3.Error:
+            self.disk_errors += 1
+            try:
+                self._db.rollback()
+            except sqlite3.Error:
+                pass
+            return None
+
+    def _add(self, entry_id, key, question, embedding, answer, created):
+        self._entries[entry_id] = (key, question, embedding, answer, created)
+        self._by_key.setdefault(key, set()).add(entry_id)
+
+    def _evict(self, entry_id):
+        key = self._entries.pop(entry_id)[0]
+        ids = self._by_key[key]
+        ids.discard(entry_id)
+        if not ids:
+            del self._by_key[key]
+        if self._db is not None and entry_id > 0:
+            self._write("DELETE FROM answers WHERE id = ?", (entry_id,))
+
+    def lookup(self, entities, embed, namespace=""):
+        """
+        Devuelve (respuesta, similitud) de la pregunta en caché más parecida
+        con el mismo conjunto de entidades, o (None, similitud) si no supera
+        el umbral. `embed()` calcula el embedding de la pregunta bajo demanda.
+        """
+        key = entity_set_key(entities, namespace)
+        with self._lock:
+            now = time.time()
+            for entry_id in [i for i in self._by_key.get(key, ()) if self._expired(self._entries[i][4], now)]:
+                self._evict(entry_id)
+            candidates = list(self._by_key.get(key, ()))
+            if not candidates:
+                self.misses += 1
+                return None, 0.0
+            matrix = np.stack([self._entries[i][2] for i in candidates])
+        similarities = matrix @ _unit(embed())
+        best = int(np.argmax(similarities))
+        similarity = float(similarities[best])
+        with self._lock:
+            entry = self._entries.get(candidates[best])
+            if similarity < self.threshold or entry is None:
+                self.misses += 1
+                return None, similarity
+            self._entries.move_to_end(candidates[best])
+            self.hits += 1
+            if self._db is not None and candidates[best] > 0:
+                self._write("UPDATE answers SET last_used = ? WHERE id = ?", (time.time(), candidates[best]))
+            return entry[3], similarity
+
+    def store(self, entities, question, embed, answer, namespace=""):
+        key = entity_set_key(entities, namespace)
+        embedding = _unit(embed())
+        created = time.time()
+        with self._lock:
+            cursor = None
+            if self._db is not None:
+                cursor = self._write(
+                    "INSERT INTO answers (version, entity_key, question, embedding, answer, created, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (self.version, key, question, embedding.tobytes(), answer, created, created),
+                )
+            if cursor is not None:
+                entry_id = cursor.lastrowid
+            else:
+                self._next_id -= 1
+                entry_id = self._next_id
+            self._add(entry_id, key, question, embedding, answer, created)
+            while len(self._entries) > self.max_size:
+                self._evict(next(iter(self._entries)))
+
+    def set_version(self, version):
+        """
+        Cambia la versión de los datos y descarta todas las respuestas.
+        """
+        with self._lock:
+            self.version = version
+            self._entries.clear()
+            self._by_key.clear()
+            if self._db is not None:
+                self._write("DELETE FROM answers")
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+            "disk_errors": self.disk_errors,
+        }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
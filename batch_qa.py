@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Respuesta por lotes, sin servidor, a un archivo de preguntas.
+
+Las preguntas se procesan en lotes de --lote: una sola codificación y una sola
+búsqueda FAISS por lote (inference.dense_search_batch), los contextos y
+prompts se construyen en paralelo (--hilos) y las llamadas al generador se
+hacen con --concurrencia llamadas simultáneas y como máximo --rps por segundo,
+con reintentos y espera exponencial. Mientras se genera un lote se prepara el
+siguiente.
+
+Entrada: una pregunta por línea, como texto o como {"question": ..., "id": ...}
+(el id es opcional; por defecto, el número de línea).
+Salida: una línea JSON por pregunta, escrita en cuanto termina, con la
+respuesta, el camino (feature_query, answer_cache, generate), las entidades,
+los tiempos de cada etapa y los del lote. Si la ejecución se interrumpe,
+relanzarla con la misma salida continúa donde se quedó: se omiten los ids ya
+respondidos y se reintentan los que terminaron con error.
+
+Uso:
+    python batch_qa.py preguntas.jsonl respuestas.jsonl
+    python batch_qa.py preguntas.jsonl respuestas.jsonl --lote 512 --concurrencia 16 --rps 8
+    python batch_qa.py benchmark_questions.jsonl /tmp/respuestas.jsonl --generator stub
+"""
+
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import inference
+from benchmark_pipeline import summarize
+from generators import StubGenerator
+from metrics import instrumentation
+
+# Entidades por pregunta de prepare_prompt; la búsqueda densa híbrida pide el doble
+TOP_K = 5
+
+def read_questions(path):
+    # Como query_encoder._load_questions: JSON si la línea empieza por "{", si no, el texto de la pregunta
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line) if line.startswith("{") else {"question": line}
+            yield {"id": item.get("id", line_number), "question": item["question"]}
+
+def completed_ids(path):
+    """
+    IDs ya respondidos en `path` (sin error). Una última línea a medio
+    escribir (ejecución interrumpida) se descarta.
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r+b") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+    done = set()
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if "error" not in record:
+            done.add(record["id"])
+    return done
+
+class RateLimiter:
+    """
+    Cubeta de fichas compartida entre hilos: como máximo `rate` llamadas por
+    segundo, con ráfagas de hasta `burst`. Con rate=0 no limita.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class BatchAnswerer:
+    def __init__(self, generator, output, batch_size=256, workers=8, concurrency=8, rate=0.0,
+                 retries=2, max_new_tokens=200):
+        self.generator = generator
+        self.output = output
+        self.batch_size = batch_size
+        self.workers = workers
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.max_new_tokens = max_new_tokens
+        self.latencies = []
+        self.paths = {}
+        self.errors = 0
+        self._lock = threading.Lock()
+        # Un lote generándose y el siguiente ya preparado, como mucho
+        self._slots = threading.Semaphore(batch_size + concurrency)
+
+    # -- Parte local (CPU) ------------------------------------------------------
+
+    def _needs_dense(self, question, features):
+        mode = inference.RETRIEVAL_MODE
+        if mode == "lexical" or inference.feature_query(question) is not None:
+            return False
+        return mode == "dense" or not inference.runtime.lexical_index.exact_matches(features.folded)
+
+    def dense_rankings(self, items):
+        """
+        Rankings FAISS del lote (None para las preguntas que no los usan) y
+        tiempos de la codificación y la búsqueda conjuntas.
+        """
+        batch_stats = {}
+        with instrumentation.record(batch_stats):
+            features = [inference.analyze_question(item["question"]) for item in items]
+            dense = [i for i, (item, f) in enumerate(zip(items, features)) if self._needs_dense(item["question"], f)]
+            rankings = [None] * len(items)
+            found = inference.dense_search_batch([features[i] for i in dense], TOP_K * 2)
+            for i, ranking in zip(dense, found):
+                rankings[i] = ranking
+        timings = {name: round(seconds, 6) for name, seconds in batch_stats.get("stages", {}).items()}
+        return rankings, dict(timings, size=len(items), dense=len(dense))
+
+    def prepare(self, item, dense_ranking):
+        stats = {}
+        prompt, response = inference.prepare_prompt(item["question"], stats, dense_ranking)
+        if prompt is not None:
+            response = inference.cached_answer(item["question"], stats, self.generator, self.max_new_tokens)
+        return stats, prompt, response
+
+    # -- Generación -------------------------------------------------------------
+
+    def generate(self, item, stats, prompt, submitted):
+        with instrumentation.record(stats):
+            for attempt in range(self.retries + 1):
+                self.limiter.acquire()
+                if attempt == 0:
+                    instrumentation.add_span("queue", time.perf_counter() - submitted)
+                try:
+                    with instrumentation.span("generate"):
+                        response = self.generator.generate(prompt, max_new_tokens=self.max_new_tokens)
+                    break
+                except Exception:
+                    if attempt == self.retries:
+                        raise
+                    instrumentation.count("generate_retries")
+                    time.sleep(min(2 ** attempt, 30))
+        inference.store_answer(item["question"], stats, self.generator, response, self.max_new_tokens)
+        return response
+
+    # -- Salida -----------------------------------------------------------------
+
+    def write(self, out, item, stats, response, batch, start, error=None):
+        total = time.perf_counter() - start
+        if error is not None:
+            record = {"id": item["id"], "question": item["question"], "error": repr(error)}
+        else:
+            with instrumentation.record(stats):
+                instrumentation.count(f"requests_{stats['path']}")
+            record = {
+                "id": item["id"],
+                "question": item["question"],
+                "answer": response,
+                "path": stats["path"],
+                "entities": stats.get("entities", []),
+                "prompt_tokens": stats.get("prompt_tokens", 0),
+                "stages": {name: round(seconds, 6) for name, seconds in stats.get("stages", {}).items()},
+                "batch": batch,
+                "total_s": round(total, 6),
+            }
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            out.write(line)
+            out.flush()
+            if error is not None:
+                self.errors += 1
+            else:
+                self.latencies.append(total)
+                self.paths[stats["path"]] = self.paths.get(stats["path"], 0) + 1
+        if error is None:
+            inference.runtime.record_answer()
+            instrumentation.emit(stats)
+
+    def _on_generated(self, out, item, stats, batch, start):
+        def done(future):
+            try:
+                if future.cancelled():
+                    return
+                error = future.exception()
+                response = None if error is not None else future.result()
+                self.write(out, item, stats, response, batch, start, error)
+            finally:
+                self._slots.release()
+        return done
+
+    def run(self, items):
+        """
+        Responde `items` añadiendo cada resultado a la salida en cuanto termina.
+        """
+        with open(self.output, "a", encoding="utf-8") as out, \
+                ThreadPoolExecutor(self.workers, thread_name_prefix="contexto") as cpu, \
+                ThreadPoolExecutor(self.concurrency, thread_name_prefix="generador") as gen:
+            try:
+                self._run(items, out, cpu, gen)
+            except KeyboardInterrupt:
+                # Las generaciones en curso terminan y se guardan; las encoladas se descartan
+                cpu.shutdown(cancel_futures=True)
+                gen.shutdown(cancel_futures=True)
+                raise
+
+    def _run(self, items, out, cpu, gen):
+        items = iter(items)
+        for batch_number in itertools.count():
+            batch_items = list(itertools.islice(items, self.batch_size))
+            if not batch_items:
+                break
+            start = time.perf_counter()
+            rankings, batch = self.dense_rankings(batch_items)
+            batch["index"] = batch_number
+            prepared = [cpu.submit(self.prepare, item, ranking) for item, ranking in zip(batch_items, rankings)]
+            for item, future in zip(batch_items, prepared):
+                try:
+                    stats, prompt, response = future.result()
+                except Exception as error:
+                    self.write(out, item, {}, None, batch, start, error)
+                    continue
+                if response is not None:
+                    self.write(out, item, stats, response, batch, start)
+                    continue
+                self._slots.acquire()
+                generated = gen.submit(self.generate, item, stats, prompt, time.perf_counter())
+                generated.add_done_callback(self._on_generated(out, item, stats, batch, start))
+
+def make_generator(name, token_delay=0.0):
+    if name == "stub":
+        return StubGenerator(token_delay=token_delay)
+    return inference.default_generator
+
+def main():
+    parser = argparse.ArgumentParser(description="Responde por lotes las preguntas de un archivo JSONL")
+    parser.add_argument("entrada", help="Preguntas, una por línea: texto o {\"id\": ..., \"question\": ...}")
+    parser.add_argument("salida", help="Respuestas en JSONL (se reanuda si ya existe)")
+    parser.add_argument("--lote", type=int, default=256, help="Preguntas por codificación y búsqueda FAISS")
+    parser.add_argument("--hilos", type=int, default=os.cpu_count() or 4,
+                        help="Hilos para construir contextos y prompts")
+    parser.add_argument("--concurrencia", type=int, default=8, help="Llamadas simultáneas al generador")
+    parser.add_argument("--rps", type=float, default=0.0, help="Máximo de llamadas al generador por segundo (0: sin límite)")
+    parser.add_argument("--reintentos", type=int, default=2, help="Reintentos por llamada fallida al generador")
+    parser.add_argument("--max-tokens", type=int, default=200)
+    parser.add_argument("--generator", choices=["hf", "stub"], default="hf")
+    parser.add_argument("--token-delay", type=float, default=0.0,
+                        help="Segundos por token del generador de prueba")
+    args = parser.parse_args()
+
+    done = completed_ids(args.salida)
+    seen, pending, skipped = set(done), [], 0
+    for item in read_questions(args.entrada):
+        if item["id"] in seen:
+            skipped += 1
+            continue
+        seen.add(item["id"])
+        pending.append(item)
+    print(f"{len(pending)} preguntas pendientes ({skipped} ya respondidas en '{args.salida}')")
+    if not pending:
+        return
+
+    load_times = inference.warmup()
+    print("Recursos cargados: " + ", ".join(f"{k}={v:.2f}s" for k, v in load_times.items()))
+    answerer = BatchAnswerer(make_generator(args.generator, args.token_delay), args.salida,
+                             batch_size=args.lote, workers=args.hilos, concurrency=args.concurrencia,
+                             rate=args.rps, retries=args.reintentos, max_new_tokens=args.max_tokens)
+    start = time.perf_counter()
+    try:
+        answerer.run(pending)
+    except KeyboardInterrupt:
+        raise SystemExit(f"\nInterrumpido: {len(answerer.latencies)} respuestas guardadas; "
+                         "relanzar con la misma salida para continuar")
+    elapsed = time.perf_counter() - start
+
+    answered = len(answerer.latencies)
+    print(f"✅ {answered} respuestas en {elapsed:.1f} s ({answered / elapsed:.1f} preguntas/s), "
+          f"{answerer.errors} errores, {skipped} omitidas")
+    print("Caminos: " + ", ".join(f"{path}={n}" for path, n in sorted(answerer.paths.items())))
+    if answerer.latencies:
+        latency = summarize(answerer.latencies)
+        print(f"Latencia por pregunta (desde el inicio de su lote): p50 {latency['p50_ms']:.1f} ms, "
+              f"p95 {latency['p95_ms']:.1f} ms, p99 {latency['p99_ms']:.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de backends de índice FAISS frente al índice plano exacto.
+
+Reporta recall@k respecto de IndexFlatIP, latencia de búsqueda p50/p99 y
+tamaño serializado de cada backend, usando los vectores del índice actual.
+Las consultas son vectores de entidades perturbados con ruido gaussiano
+(o embeddings de preguntas reales con --preguntas, si el modelo está instalado).
+"""
+
+import argparse
+import json
+import time
+import faiss
+import numpy as np
+
+from index_backends import BACKENDS, build_index, index_vectors
+
+def make_queries(vectors, n_queries, noise, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    queries = vectors[rows].copy()
+    scale = noise * np.linalg.norm(queries, axis=1, keepdims=True) / np.sqrt(vectors.shape[1])
+    queries += rng.standard_normal(queries.shape).astype("float32") * scale
+    return np.ascontiguousarray(queries, dtype="float32")
+
+def encode_questions(path):
+    from sentence_transformers import SentenceTransformer
+    from generate_embeddings import MODEL_NAME
+    with open(path, "r", encoding="utf-8") as f:
+        questions = [line.strip() for line in f if line.strip()]
+    model = SentenceTransformer(MODEL_NAME)
+    return np.ascontiguousarray(model.encode(questions), dtype="float32")
+
+def recall_at_k(found, truth, k):
+    hits = 0
+    for row_found, row_truth in zip(found[:, :k], truth[:, :k]):
+        hits += len(set(row_found.tolist()) & set(row_truth.tolist()))
+    return hits / (len(truth) * k)
+
+def time_searches(index, queries, k):
+    # Una consulta por llamada, como en retrieve_entities
+    latencies = []
+    results = np.empty((len(queries), k), dtype="int64")
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        latencies.append(time.perf_counter() - start)
+        results[i] = ids[0]
+    return results, np.asarray(latencies) * 1e3
+
+def run(index_path, k, n_queries, noise, backends, questions_path=None):
+    reference = faiss.read_index(index_path)
+    _, vectors = index_vectors(reference)
+    queries = encode_questions(questions_path) if questions_path else make_queries(vectors, n_queries, noise)
+
+    report = []
+    truth = None
+    for backend in backends:
+        start = time.perf_counter()
+        index = build_index(vectors, backend)
+        build_s = time.perf_counter() - start
+        found, latencies = time_searches(index, queries, k)
+        if backend == "flat":
+            truth = found
+        report.append({
+            "backend": backend,
+            "build_s": round(build_s, 3),
+            "recall_at_k": None if truth is None else round(recall_at_k(found, truth, k), 4),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 4),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 4),
+            "size_bytes": int(faiss.serialize_index(index).size),
+        })
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara backends de índice FAISS")
+    parser.add_argument("--index", default="grambank_entity_index.faiss")
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.1,
+                        help="Desviación relativa del ruido añadido a las consultas sintéticas")
+    parser.add_argument("--preguntas", help="Archivo con una pregunta por línea (requiere el modelo)")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--json", help="Guardar el reporte en este archivo")
+    args = parser.parse_args()
+
+    # El índice plano va primero: es la referencia del recall
+    backends = ["flat"] + [b for b in args.backends if b != "flat"]
+    report = run(args.index, args.k, args.queries, args.noise, backends, args.preguntas)
+
+    print(f"{'backend':<10} {'recall@' + str(args.k):>9} {'p50 ms':>8} {'p99 ms':>8} {'tamaño KB':>10}")
+    for row in report:
+        print(f"{row['backend']:<10} {row['recall_at_k']:>9.4f} {row['p50_ms']:>8.3f} "
+              f"{row['p99_ms']:>8.3f} {row['size_bytes'] / 1024:>10.1f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de extremo a extremo del pipeline RAG con un generador local.
+
+Recorre un conjunto fijo de preguntas con entidades esperadas
+(benchmark_questions.jsonl) por el camino completo de generate_response
+(camino rápido de rasgos → análisis → recuperación → contexto → prompt →
+generación) usando StubGenerator, y reporta:
+
+- latencia p50/p95/p99 por etapa y total;
+- recall@k de la recuperación frente a las URIs esperadas;
+- preguntas que no siguieron el camino esperado (campo "path" opcional, p. ej.
+  un filtro de rasgos acotado a un país no debe responderse con el camino rápido);
+- rendimiento (preguntas/s) con N clientes concurrentes;
+- pico de memoria residente (RSS) del proceso.
+
+El resultado se guarda en JSON; con --baseline se compara con una ejecución
+anterior y se marcan las regresiones.
+
+Uso:
+    python benchmark_pipeline.py --json bench.json
+    python benchmark_pipeline.py --clientes 1 4 16 --baseline bench.json
+"""
+
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import inference
+from generators import StubGenerator
+
+QUESTIONS_PATH = "benchmark_questions.jsonl"
+PERCENTILES = (50, 95, 99)
+
+def load_questions(path=QUESTIONS_PATH):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def summarize(seconds):
+    ms = np.asarray(seconds) * 1e3
+    summary = {f"p{p}_ms": round(float(np.percentile(ms, p)), 4) for p in PERCENTILES}
+    summary.update(mean_ms=round(float(ms.mean()), 4), n=len(ms))
+    return summary
+
+def peak_rss_mb():
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def run_question(item, generator, k):
+    stats = {}
+    inference.generate_response(item["question"], generator=generator, stats=stats)
+    if item.get("path") and stats["path"] != item["path"]:
+        stats["unexpected_path"] = True
+    found = stats.get("entities", [])[:k]
+    gold = item.get("gold") or []
+    recall = len(set(found) & set(gold)) / min(k, len(gold)) if gold else None
+    return stats, recall
+
+def run_latency(questions, generator, k, repeats):
+    # Un solo cliente: latencias por etapa sin contención
+    stages, recalls, tokens, unexpected = {}, [], [], set()
+    for _ in range(repeats):
+        for item in questions:
+            stats, recall = run_question(item, generator, k)
+            for stage, seconds in stats["stages"].items():
+                stages.setdefault(stage, []).append(seconds)
+            if recall is not None:
+                recalls.append(recall)
+            if "prompt_tokens" in stats:
+                tokens.append(stats["prompt_tokens"])
+            if stats.get("unexpected_path"):
+                unexpected.add((item["question"], item["path"], stats["path"]))
+    return {
+        "stages": {stage: summarize(values) for stage, values in stages.items()},
+        "recall_at_k": round(float(np.mean(recalls)), 4) if recalls else None,
+        "questions_with_gold": len(recalls) // repeats,
+        "prompt_tokens_mean": round(float(np.mean(tokens)), 1) if tokens else None,
+        "unexpected_paths": [{"question": q, "expected": e, "path": p} for q, e, p in sorted(unexpected)],
+    }
+
+def run_throughput(questions, generator, k, clients, repeats):
+    # N clientes concurrentes que reparten todas las preguntas
+    work = questions * repeats
+    latencies = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        for stats, _ in executor.map(lambda item: run_question(item, generator, k), work):
+            latencies.append(stats["stages"]["total"])
+    elapsed = time.perf_counter() - start
+    return {"clients": clients, "questions_per_s": round(len(work) / elapsed, 2), **summarize(latencies)}
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(report, baseline, tolerance):
+    """
+    Diferencias relativas de p50/p95/p99 por etapa y de rendimiento frente a
+    una ejecución anterior; se marcan las que empeoran más que `tolerance`.
+    """
+    rows = []
+    for stage, summary in report["latency"]["stages"].items():
+        before = baseline.get("latency", {}).get("stages", {}).get(stage)
+        for key in (f"p{p}_ms" for p in PERCENTILES):
+            if before and before.get(key):
+                change = summary[key] / before[key] - 1
+                rows.append((f"{stage} {key}", before[key], summary[key], change, change > tolerance))
+    previous = {row["clients"]: row for row in baseline.get("throughput", [])}
+    for row in report["throughput"]:
+        before = previous.get(row["clients"])
+        if before and before["questions_per_s"]:
+            change = row["questions_per_s"] / before["questions_per_s"] - 1
+            rows.append((f"{row['clients']} clientes q/s", before["questions_per_s"], row["questions_per_s"],
+                         change, change < -tolerance))
+    before, now = baseline.get("latency", {}).get("recall_at_k"), report["latency"]["recall_at_k"]
+    if before is not None and now is not None:
+        rows.append(("recall@k", before, now, now - before, now < before))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de extremo a extremo del RAG de Grambank")
+    parser.add_argument("--preguntas", default=QUESTIONS_PATH)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--clientes", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--token-delay", type=float, default=0.0,
+                        help="Latencia simulada por token del generador stub (segundos)")
+    parser.add_argument("--cache-respuestas", action="store_true",
+                        help="Medir con la caché semántica de respuestas activada (por defecto se desactiva)")
+    parser.add_argument("--json", help="Guardar el reporte en este archivo")
+    parser.add_argument("--baseline", help="Reporte JSON anterior con el que comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.10,
+                        help="Empeoramiento relativo a partir del cual se marca una regresión")
+    args = parser.parse_args()
+
+    questions = load_questions(args.preguntas)
+    generator = StubGenerator(token_delay=args.token_delay)
+    if not args.cache_respuestas:
+        # Las repeticiones serían aciertos de caché y no medirían el pipeline
+        inference.runtime.answer_cache = None
+
+    start = time.perf_counter()
+    load_times = inference.warmup()
+    warmup_s = time.perf_counter() - start
+
+    latency = run_latency(questions, generator, args.k, args.repeticiones)
+    throughput = [run_throughput(questions, generator, args.k, n, args.repeticiones) for n in args.clientes]
+
+    report = {
+        "meta": {"commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 "python": platform.python_version(), "questions": len(questions), "k": args.k,
+                 "repeats": args.repeticiones, "token_delay": args.token_delay,
+                 "retrieval_mode": inference.RETRIEVAL_MODE, "answer_cache": args.cache_respuestas},
+        "warmup_s": round(warmup_s, 3),
+        "load_times_s": {name: round(seconds, 3) for name, seconds in load_times.items()},
+        "latency": latency,
+        "throughput": throughput,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    print(f"{len(questions)} preguntas × {args.repeticiones}, recall@{args.k} = {latency['recall_at_k']}, "
+          f"pico RSS = {report['peak_rss_mb']} MB")
+    for row in latency["unexpected_paths"]:
+        print(f"⚠️ camino {row['path']} (se esperaba {row['expected']}): {row['question']}")
+    print(f"{'etapa':<14} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage, summary in latency["stages"].items():
+        print(f"{stage:<14} {summary['p50_ms']:>9.3f} {summary['p95_ms']:>9.3f} {summary['p99_ms']:>9.3f}")
+    for row in throughput:
+        print(f"{row['clients']:>3} clientes: {row['questions_per_s']:>8.1f} preguntas/s "
+              f"(p50 {row['p50_ms']:.2f} ms, p99 {row['p99_ms']:.2f} ms)")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            rows = compare(report, json.load(f), args.tolerancia)
+        report["comparison"] = [{"metric": m, "before": b, "after": a, "change": round(c, 4), "regression": r}
+                                for m, b, a, c, r in rows]
+        print(f"\nComparación con {args.baseline}:")
+        for metric, before, after, change, regression in rows:
+            print(f"{'⚠️ ' if regression else '   '}{metric:<24} {before:>10.3f} → {after:>10.3f} ({change:+.1%})")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de los recuperadores de retrieve_entities: denso (FAISS), léxico
+(nombres exactos + BM25) e híbrido (fusión RRF).
+
+Reporta recall@k y latencia p50/p99 de cada recuperador sobre un conjunto de
+preguntas con entidades esperadas. Por defecto las preguntas se generan a
+partir del grafo (nombres, glottocodes, códigos ISO, rasgos y familias); con
+--preguntas se usa un JSONL {"question": ..., "gold": [uri, ...]}.
+"""
+
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+import inference
+from entity_store import load_entities
+
+MODES = ("dense", "lexical", "hybrid")
+
+def generate_questions(all_entities_properties, n, seed=0):
+    """
+    Preguntas sintéticas con su respuesta conocida. Las de familia no nombran
+    ninguna lengua, así que ponen a prueba la fusión y no el camino exacto.
+    """
+    rng = random.Random(seed)
+    questions = []
+    for uri, properties in all_entities_properties.items():
+        kind = properties.get("type", [""])[0]
+        label = properties.get("label", [""])[0]
+        if not label or label == "nan":
+            continue
+        if kind == "Language":
+            questions.append({"question": f"Describe la lengua {label}", "gold": [uri]})
+            for code in properties.get("glottocode", []):
+                questions.append({"question": f"¿Qué lengua tiene el glottocode {code}?", "gold": [uri]})
+            for code in properties.get("isoCode", []):
+                questions.append({"question": f"¿Cuál es la lengua con código ISO {code}?", "gold": [uri]})
+        elif kind == "GrammaticalFeature":
+            questions.append({"question": f"¿Qué mide el rasgo {uri.rsplit('/', 1)[-1]}?", "gold": [uri]})
+            questions.append({"question": label, "gold": [uri]})
+        elif kind == "LanguageFamily":
+            questions.append({"question": f"¿Qué lenguas pertenecen a la familia {label}?",
+                              "gold": properties.get("hasLanguage", [])})
+    rng.shuffle(questions)
+    return questions[:n]
+
+def load_questions(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def recall(found, gold, k):
+    # Con varias respuestas válidas, basta con llenar los k puestos con ellas
+    return len(set(found[:k]) & set(gold)) / min(k, len(gold)) if gold else 0.0
+
+def run(questions, k, modes):
+    report = []
+    for mode in modes:
+        latencies, recalls, exact = [], [], 0
+        for item in questions:
+            timings = {}
+            start = time.perf_counter()
+            found = inference.retrieve_entities(item["question"], top_k=k, mode=mode, timings=timings)
+            latencies.append(time.perf_counter() - start)
+            recalls.append(recall(found, item["gold"], k))
+            exact += timings["retriever"] == "exact"
+        latencies = np.asarray(latencies) * 1e3
+        report.append({
+            "retriever": mode,
+            "recall_at_k": round(float(np.mean(recalls)), 4),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 4),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 4),
+            "exact_share": round(exact / len(questions), 4),
+        })
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara los recuperadores denso, léxico e híbrido")
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=300, help="Preguntas sintéticas a generar")
+    parser.add_argument("--preguntas", help='JSONL con {"question": ..., "gold": [uri, ...]}')
+    parser.add_argument("--modos", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--json", help="Guardar el reporte en este archivo")
+    args = parser.parse_args()
+
+    questions = load_questions(args.preguntas) if args.preguntas else generate_questions(load_entities(), args.queries)
+    # Carga de recursos fuera de la medición
+    inference.warmup()
+    report = run(questions, args.k, args.modos)
+
+    print(f"{len(questions)} preguntas")
+    print(f"{'recuperador':<12} {'recall@' + str(args.k):>9} {'p50 ms':>8} {'p99 ms':>8} {'exactas':>8}")
+    for row in report:
+        print(f"{row['retriever']:<12} {row['recall_at_k']:>9.4f} {row['p50_ms']:>8.3f} "
+              f"{row['p99_ms']:>8.3f} {row['exact_share']:>8.2%}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
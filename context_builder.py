@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Contexto compacto y con presupuesto de tokens para el generador.
+
+Cada entidad se renderiza una sola vez en fragmentos cortos:
+- una cabecera con su identidad (nombre, códigos, familia, países...);
+- un fragmento por dominio de Grambank (mainDomain) con los rasgos presentes
+  y ausentes como "GB020 definite or specific articles" en lugar de listas
+  de URIs.
+
+Los fragmentos se guardan en caché (en memoria y, opcionalmente, en
+context_snippets.json). Al responder, se ordenan por relevancia para la
+pregunta y se añaden hasta agotar el presupuesto de tokens.
+"""
+
+import json
+import os
+import re
+from dataclasses import dataclass
+
+from query_analysis import fold
+
+CONTEXT_PATH = "context_snippets.json"
+DEFAULT_TOKEN_BUDGET = 1500
+
+FEATURE_ID = re.compile(r"GB\d+[a-z]?$")
+TOKEN_PIECE = re.compile(r"\w+|[^\w\s]")
+WORD = re.compile(r"\w{4,}")
+QUESTION_PREFIX = re.compile(r"^(?:is|are|does|do|can|must|has|have)\s+(?:there\s+)?(?:an?\s+|the\s+)?", re.I)
+SHORT_LABEL_WORDS = 6
+
+def estimate_tokens(text):
+    """
+    Aproximación barata del número de tokens BPE: una pieza por palabra o
+    signo, más una por cada 6 caracteres de las palabras largas.
+    """
+    return sum(1 + len(piece) // 6 for piece in TOKEN_PIECE.findall(text))
+
+def feature_id(uri):
+    tail = uri.rstrip("/").rsplit("/", 1)[-1]
+    return tail if FEATURE_ID.match(tail) else None
+
+def short_label(question):
+    """
+    "Are there definite or specific articles?" -> "definite or specific articles"
+    """
+    words = QUESTION_PREFIX.sub("", question.strip().rstrip("?")).split()
+    return " ".join(words[:SHORT_LABEL_WORDS]) + ("…" if len(words) > SHORT_LABEL_WORDS else "")
+
+@dataclass(frozen=True)
+class Snippet:
+    entity: str
+    kind: str           # "header" o "domain:<mainDomain>"
+    text: str
+    tokens: int
+    properties: tuple   # propiedades de la entidad que cubre el fragmento
+    words: frozenset    # palabras normalizadas, para puntuar la relevancia
+
+class ContextBuilder:
+    """
+    Renderiza y cachea fragmentos por entidad, y los ensambla bajo un
+    presupuesto de tokens.
+    """
+
+    def __init__(self, all_entities_properties, token_budget=DEFAULT_TOKEN_BUDGET, count_tokens=estimate_tokens):
+        self.entities = all_entities_properties
+        self.token_budget = token_budget
+        self.count_tokens = count_tokens
+        self._snippets = {}
+        self._features = None
+
+    # -- Renderizado (una vez por entidad) ---------------------------------
+
+    def _value(self, prop_values):
+        # Las URIs que son entidades conocidas se muestran por su nombre
+        return ", ".join(self.entities.get(v, {}).get("label", [v])[0] for v in prop_values)
+
+    def _feature_table(self):
+        # GB id -> (etiqueta corta, dominio), a partir de las entidades GrammaticalFeature
+        if self._features is None:
+            self._features = {}
+            for uri, properties in self.entities.items():
+                fid = feature_id(uri)
+                if fid and "GrammaticalFeature" in properties.get("type", []):
+                    self._features[fid] = (short_label(properties.get("label", [fid])[0]),
+                                           properties.get("mainDomain", ["otros"])[0])
+        return self._features
+
+    def _snippet(self, entity, kind, text, properties):
+        return Snippet(entity, kind, text, self.count_tokens(text), tuple(properties),
+                       frozenset(WORD.findall(fold(text))))
+
+    def render(self, uri):
+        """
+        Fragmentos de una entidad (cacheados). Lista vacía si no se conoce.
+        """
+        if uri in self._snippets:
+            return self._snippets[uri]
+        properties = self.entities.get(uri)
+        if not properties:
+            self._snippets[uri] = []
+            return []
+
+        kind = properties.get("type", ["Entidad"])[0]
+        label = properties.get("label", ["Nombre no disponible"])[0]
+        header = [f"Entidad: {label} ({kind})"]
+        covered = ["label", "type"]
+        fields = (("glottocode", "Glottocode"), ("isoCode", "ISO 639-3"), ("languageFamily", "Familia"),
+                  ("spokenInCountry", "País"), ("numberOfSpeakers", "Hablantes"),
+                  ("unescoLanguageStatus", "Estado UNESCO"), ("linguisticTypology", "Tipología"),
+                  ("mainDomain", "Dominio"), ("finerGrouping", "Subdominio"), ("lineage", "Linaje"))
+        for prop, name in fields:
+            if prop in properties:
+                header.append(f"- {name}: {self._value(properties[prop])}")
+                covered.append(prop)
+        if "location" in properties:
+            point = self.entities.get(properties["location"][0], {})
+            if "lat" in point and "long" in point:
+                header.append(f"- Ubicación: {point['lat'][0]}, {point['long'][0]}")
+                covered.append("location")
+        if "hasLanguage" in properties:
+            languages = properties["hasLanguage"]
+            header.append(f"- Lenguas ({len(languages)}): {self._value(languages)}")
+            covered.append("hasLanguage")
+        snippets = [self._snippet(uri, "header", "\n".join(header), covered)]
+
+        # Rasgos agrupados por dominio: "GB020 definite or specific articles"
+        table = self._feature_table()
+        domains = {}
+        for prop, polarity in (("hasFeaturePresent", "presentes"), ("hasFeatureAbsent", "ausentes")):
+            for value in properties.get(prop, []):
+                fid = feature_id(value)
+                name, domain = table.get(fid, (None, "otros"))
+                entry = f"{fid} {name}" if name else (fid or value)
+                domains.setdefault(domain, {}).setdefault(polarity, []).append(entry)
+        for domain, groups in sorted(domains.items()):
+            lines = [f"Rasgos de {label} ({domain}):"]
+            lines += [f"- {polarity}: {'; '.join(entries)}" for polarity, entries in groups.items()]
+            snippets.append(self._snippet(uri, f"domain:{domain}", "\n".join(lines),
+                                          ("hasFeaturePresent", "hasFeatureAbsent")))
+
+        self._snippets[uri] = snippets
+        return snippets
+
+    def precompute(self):
+        for uri in self.entities:
+            self.render(uri)
+        return self
+
+    def save(self, path=CONTEXT_PATH):
+        data = {uri: [[s.kind, s.text, list(s.properties)] for s in snippets]
+                for uri, snippets in self._snippets.items() if snippets}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def load(self, path=CONTEXT_PATH):
+        """
+        Carga fragmentos precalculados (los tokens se recuentan con count_tokens).
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for uri, snippets in data.items():
+            self._snippets[uri] = [self._snippet(uri, kind, text, props) for kind, text, props in snippets]
+        return self
+
+    # -- Ensamblado (por pregunta) ------------------------------------------
+
+    def build(self, features, entities, token_budget=None):
+        """
+        Ensambla el contexto para una pregunta ya analizada (QueryFeatures) y
+        las entidades recuperadas (en orden de relevancia). Devuelve
+        (contexto, estadísticas).
+        """
+        budget = self.token_budget if token_budget is None else token_budget
+        words = set(WORD.findall(features.folded))
+        wanted = {prop.split(":")[-1] for prop in features.properties}
+        order = list(dict.fromkeys(entities))
+
+        scored = []
+        for rank, uri in enumerate(order):
+            for snippet in self.render(uri):
+                score = 1.0 / (1 + rank)
+                if snippet.kind == "header":
+                    score += 10.0  # identificar la entidad va antes que sus detalles
+                if wanted.intersection(snippet.properties):
+                    score += 2.0
+                score += len(words & snippet.words) * 0.5
+                scored.append((score, snippet))
+        scored.sort(key=lambda item: -item[0])
+
+        chosen, used = set(), 0
+        for _, snippet in scored:
+            if used + snippet.tokens <= budget:
+                chosen.add(id(snippet))
+                used += snippet.tokens
+
+        # Se presentan agrupados por entidad, en el orden de recuperación
+        blocks = []
+        for uri in order:
+            parts = [s.text for s in self.render(uri) if id(s) in chosen]
+            if parts:
+                blocks.append("\n".join(parts))
+        stats = {"context_tokens": used, "candidate_tokens": sum(s.tokens for _, s in scored),
+                 "snippets_used": len(chosen), "snippets_total": len(scored), "token_budget": budget}
+        return "\n\n".join(blocks), stats
@@ -1,7 +1,13 @@
+import argparse
+import time
+
+import numpy as np
 import pandas as pd
 from rdflib import Graph, Namespace, Literal, URIRef, BNode
 from rdflib.namespace import RDF, RDFS, XSD, GEO, DC, DCTERMS, SKOS
 
+from graph_store import TripleTable, file_hash, store_path, write_graph
+
 # Configurar namespaces
 LING = Namespace("http://purl.org/linguistics#")
 GLOTTO = Namespace("https://glottolog.org/resource/languoid/id/")
@@ -94,14 +100,181 @@ def procesar_valores():
         if pd.notna(row['Description_Value']):
             g.add((lang_uri, LING.featureValueDescription, Literal(row['Description_Value'])))
 
+# ---------------------------------------------------------------------------
+# Modo vectorizado: una pasada groupby/merge por tipo de entidad y escritura
+# directa de triples en N-Triples (sintaxis válida también como Turtle), sin
+# acumular el grafo en memoria.
+# ---------------------------------------------------------------------------
+
+def _escapar_literal(texto):
+    """
+    Escapa un literal según las reglas de N-Triples.
+    """
+    return (texto.replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"').replace("\r", "\\r"))
+
+def _termino_nt(termino):
+    """
+    Convierte un término RDF (URIRef, BNode o Literal) a su forma N-Triples.
+    """
+    if isinstance(termino, Literal):
+        texto = f'"{_escapar_literal(str(termino))}"'
+        if termino.language:
+            return f"{texto}@{termino.language}"
+        if termino.datatype:
+            return f"{texto}^^<{termino.datatype}>"
+        return texto
+    return termino.n3()
+
+def _columna_nt(serie, constructor):
+    """
+    Construye en bloque los términos N-Triples de una columna: el constructor
+    RDF se aplica una sola vez por valor distinto (incluido NaN) y el resultado
+    se expande con los códigos de factorización.
+    """
+    codigos, unicos = pd.factorize(serie, use_na_sentinel=False)
+    terminos = np.array([_termino_nt(constructor(v)) for v in unicos], dtype=object)
+    return pd.Series(terminos[codigos], index=serie.index)
+
+def _constante_nt(termino, n):
+    return np.full(n, _termino_nt(termino), dtype=object)
+
+class EscritorNTriples:
+    """
+    Escribe bloques de triples (columnas ya convertidas a N-Triples) en un
+    archivo, eliminando duplicados dentro de cada bloque como lo haría
+    rdflib.Graph.
+    """
+
+    def __init__(self, ruta):
+        self.archivo = open(ruta, "w", encoding="utf-8")
+        self.triples = 0
+
+    def escribir(self, sujetos, predicado, objetos):
+        if len(sujetos) == 0:
+            return
+        if isinstance(predicado, str):
+            predicado = _constante_nt(URIRef(predicado), len(sujetos))
+        lineas = pd.Series(np.asarray(sujetos, dtype=object) + " " + predicado + " "
+                           + np.asarray(objetos, dtype=object) + " .\n")
+        lineas = lineas.drop_duplicates()
+        self.archivo.writelines(lineas.tolist())
+        self.triples += len(lineas)
+
+    def cerrar(self):
+        self.archivo.close()
+
+def _familias_vectorizado(escritor):
+    familias = datos[['Family_level_ID', 'Family_name', 'lineage']].drop_duplicates().dropna()
+    fam = _columna_nt(familias['Family_level_ID'], lambda v: URIRef(GLOTTO[v]))
+    escritor.escribir(fam, RDF.type, _constante_nt(LING.LanguageFamily, len(fam)))
+    escritor.escribir(fam, RDFS.label, _columna_nt(familias['Family_name'], Literal))
+    con_linaje = familias['lineage'].notna()
+    escritor.escribir(fam[con_linaje], LING.lineage,
+                      _columna_nt(familias.loc[con_linaje, 'lineage'], Literal))
+
+    # Lenguas de cada familia: un único merge en lugar de un filtro por familia
+    miembros = (datos[['Family_level_ID', 'Glottocode']].dropna().drop_duplicates()
+                .merge(familias[['Family_level_ID']].drop_duplicates(), on='Family_level_ID'))
+    escritor.escribir(_columna_nt(miembros['Family_level_ID'], lambda v: URIRef(GLOTTO[v])),
+                      LING.hasLanguage,
+                      _columna_nt(miembros['Glottocode'], lambda v: URIRef(GLOTTO[v])))
+
+def _lenguas_vectorizado(escritor):
+    lenguas = datos.drop_duplicates(subset=['Glottocode'])
+    lang = _columna_nt(lenguas['Glottocode'], lambda v: URIRef(GLOTTO[v]))
+    escritor.escribir(lang, RDF.type, _constante_nt(LING.Language, len(lang)))
+    escritor.escribir(lang, RDFS.label, _columna_nt(lenguas['Name'], Literal))
+    escritor.escribir(lang, LING.glottocode, _columna_nt(lenguas['Glottocode'], Literal))
+
+    con_iso = lenguas['Isocode'].notna()
+    escritor.escribir(lang[con_iso], LING.isoCode,
+                      _columna_nt(lenguas.loc[con_iso, 'Isocode'], Literal))
+
+    con_familia = lenguas['Family_level_ID'].notna()
+    escritor.escribir(lang[con_familia], LING.languageFamily,
+                      _columna_nt(lenguas.loc[con_familia, 'Family_level_ID'],
+                                  lambda v: URIRef(GLOTTO[v])))
+
+    # Los puntos geográficos reciben nodos en blanco deterministas
+    con_geo = lenguas['Latitude'].notna() & lenguas['Longitude'].notna()
+    geo = lenguas[con_geo]
+    lang_geo = lang[con_geo]
+    nodos = pd.Series([f"_:geo{i}" for i in range(len(geo))], index=geo.index, dtype=object)
+    escritor.escribir(nodos, RDF.type, _constante_nt(GEO.Point, len(geo)))
+    escritor.escribir(nodos, GEO.lat, _columna_nt(
+        geo['Latitude'], lambda v: Literal(float(v), datatype=XSD.float)))
+    escritor.escribir(nodos, GEO.long, _columna_nt(
+        geo['Longitude'], lambda v: Literal(float(v), datatype=XSD.float)))
+    escritor.escribir(lang_geo, GEO.location, nodos)
+
+def _rasgos_vectorizado(escritor):
+    rasgos = datos[['Parameter_ID', 'Name_Parameter', 'Description', 'Main_domain', 'Finer_grouping']].drop_duplicates().dropna()
+    feat = _columna_nt(rasgos['Parameter_ID'], lambda v: URIRef(GRAMBANK[v]))
+    escritor.escribir(feat, RDF.type, _constante_nt(LING.GrammaticalFeature, len(feat)))
+    escritor.escribir(feat, RDFS.label, _columna_nt(rasgos['Name_Parameter'], Literal))
+    escritor.escribir(feat, RDFS.comment, _columna_nt(rasgos['Description'], Literal))
+    escritor.escribir(feat, LING.mainDomain, _columna_nt(rasgos['Main_domain'], Literal))
+    escritor.escribir(feat, LING.finerGrouping, _columna_nt(rasgos['Finer_grouping'], Literal))
+
+def _valores_vectorizado(escritor):
+    valores = datos[['Glottocode', 'Parameter_ID', 'Value']]
+    for valor, predicado in (('1', LING.hasFeaturePresent), ('0', LING.hasFeatureAbsent)):
+        filas = valores[valores['Value'] == valor].drop_duplicates(subset=['Glottocode', 'Parameter_ID'])
+        escritor.escribir(_columna_nt(filas['Glottocode'], lambda v: URIRef(GLOTTO[v])),
+                          predicado,
+                          _columna_nt(filas['Parameter_ID'], lambda v: URIRef(GRAMBANK[v])))
+
+    descripciones = datos[['Glottocode', 'Description_Value']].dropna(subset=['Description_Value']).drop_duplicates()
+    escritor.escribir(_columna_nt(descripciones['Glottocode'], lambda v: URIRef(GLOTTO[v])),
+                      LING.featureValueDescription,
+                      _columna_nt(descripciones['Description_Value'], Literal))
+
+def construir_vectorizado(ruta_salida="grambank_sudamerica.ttl"):
+    """
+    Genera los mismos triples que main() (salvo el nombre de los nodos en
+    blanco) en una pasada vectorizada por tipo de entidad, escribiéndolos
+    directamente a disco en sintaxis N-Triples.
+    """
+    inicio = time.perf_counter()
+    escritor = EscritorNTriples(ruta_salida)
+    try:
+        print("Procesando familias lingüísticas...")
+        _familias_vectorizado(escritor)
+        print("Procesando lenguas...")
+        _lenguas_vectorizado(escritor)
+        print("Procesando rasgos...")
+        _rasgos_vectorizado(escritor)
+        print("Creando relaciones entre lenguas y rasgos...")
+        _valores_vectorizado(escritor)
+    finally:
+        escritor.cerrar()
+    duracion = max(time.perf_counter() - inicio, 1e-9)
+    print(f"✅ KG generado! Triples totales: {escritor.triples:,}")
+    print(f"⏱️ {duracion:.2f} s — {len(datos) / duracion:,.0f} filas/s, "
+          f"{escritor.triples / duracion:,.0f} triples/s")
+    return escritor.triples
+
 # Ejecutar proceso
 def main():
+    parser = argparse.ArgumentParser(description="Genera el KG de Grambank a partir de DATOS.csv")
+    parser.add_argument("--vectorizado", action="store_true",
+                        help="Construcción vectorizada con escritura en streaming (N-Triples)")
+    parser.add_argument("--salida", default="grambank_sudamerica.ttl")
+    args = parser.parse_args()
+
+    if args.vectorizado:
+        construir_vectorizado(args.salida)
+        # Almacén binario para wikidata.py, leído del N-Triples sin el parser de rdflib
+        TripleTable.from_ntriples(args.salida).save(store_path(args.salida), source_hash=file_hash(args.salida))
+        return
+
     procesar_familias()
     procesar_lenguas()
     procesar_rasgos()
     procesar_valores()
     print("\nGuardando grafo...")
-    g.serialize("grambank_sudamerica.ttl", format="turtle")
+    write_graph(g, args.salida)  # Turtle y su almacén binario .gstore
     print(f"✅ KG generado! Triples totales: {len(g):,}")
 
 if __name__ == "__main__":
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Caché de embeddings de preguntas para inference.py.
+
+LRU acotada en memoria, con caducidad por TTL y un almacén opcional en
+SQLite para que las entradas calientes sobrevivan a un reinicio.
+"""
+
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+def normalize_question(text):
+    """
+    Normaliza una pregunta para usarla como clave: Unicode NFC, minúsculas,
+    espacios colapsados y sin signos de interrogación/exclamación en los bordes.
+    """
+    text = unicodedata.normalize("NFC", text).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.strip("¿?¡!.,;: ")
+
+class QueryEmbeddingCache:
+    """
+    Caché LRU de embeddings indexada por la pregunta normalizada.
+
+    - max_size: número máximo de entradas en memoria (y en disco).
+    - ttl: segundos de vida de una entrada; None para no caducar.
+    - path: archivo SQLite opcional para persistir las entradas.
+    """
+
+    def __init__(self, max_size=1024, ttl=None, path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # clave -> (instante de creación, embedding)
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, created REAL, dtype TEXT, vector BLOB)"
+            )
+            self._db.commit()
+            self._load_from_disk()
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def _load_from_disk(self):
+        # Solo se cargan las entradas más recientes que caben en memoria
+        now = time.time()
+        rows = self._db.execute(
+            "SELECT key, created, dtype, vector FROM embeddings ORDER BY created DESC LIMIT ?",
+            (self.max_size,),
+        ).fetchall()
+        for key, created, dtype, vector in reversed(rows):
+            if not self._expired(created, now):
+                self._entries[key] = (created, np.frombuffer(vector, dtype=dtype))
+        self._db.execute("DELETE FROM embeddings WHERE key NOT IN (SELECT key FROM embeddings "
+                         "ORDER BY created DESC LIMIT ?)", (self.max_size,))
+        self._db.commit()
+
+    def get(self, question):
+        key = normalize_question(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, embedding = entry
+                if not self._expired(created, time.time()):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return embedding
+                self._evict(key)
+            self.misses += 1
+            return None
+
+    def put(self, question, embedding):
+        key = normalize_question(question)
+        embedding = np.asarray(embedding)
+        created = time.time()
+        with self._lock:
+            self._entries[key] = (created, embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._evict(next(iter(self._entries)))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)",
+                    (key, created, embedding.dtype.str, embedding.tobytes()),
+                )
+                self._db.commit()
+
+    def _evict(self, key):
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM embeddings WHERE key = ?", (key,))
+            self._db.commit()
+
+    def get_or_compute(self, question, compute):
+        """
+        Devuelve el embedding en caché o lo calcula con compute(question) y lo guarda.
+        """
+        embedding = self.get(question)
+        if embedding is None:
+            embedding = compute(question)
+            self.put(question, embedding)
+        return embedding
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+        }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Codificación de descripciones en paralelo, por longitud y con checkpoints.
+
+- Las descripciones se ordenan por número de tokens, de modo que cada lote
+  agrupa textos de longitud parecida y se desperdicia menos padding.
+- El orden resultante se corta en shards que se reparten en un pool de
+  procesos; cada proceso fija su número de hilos de torch para no
+  sobresuscribir la CPU.
+- Cada shard terminado se guarda en disco con un hash de su contenido: si la
+  ejecución se interrumpe, la siguiente reutiliza los shards ya calculados.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+CHECKPOINT_DIR = "embedding_shards"
+
+_worker_model = None
+
+def _init_worker(model_name, threads):
+    global _worker_model
+    import torch
+    from sentence_transformers import SentenceTransformer
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    _worker_model = SentenceTransformer(model_name)
+
+def _encode_shard(texts, batch_size):
+    return np.ascontiguousarray(_worker_model.encode(texts, batch_size=batch_size), dtype="float32")
+
+def token_lengths(descriptions, model_name):
+    """
+    Longitud en tokens de cada descripción (truncada como la trunca el modelo).
+    Si el tokenizador no está disponible se aproxima con el número de palabras.
+    """
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        encoded = tokenizer(descriptions, add_special_tokens=True, truncation=True,
+                            max_length=tokenizer.model_max_length if tokenizer.model_max_length < 10**6 else 512)
+        return np.asarray([len(ids) for ids in encoded["input_ids"]])
+    except (ImportError, OSError):
+        return np.asarray([len(text.split()) for text in descriptions])
+
+def _shard_key(model_name, texts):
+    digest = hashlib.sha256(model_name.encode("utf-8"))
+    for text in texts:
+        digest.update(b"\0" + text.encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+def _save_shard(path, embeddings):
+    tmp_path = f"{path}.tmp.npy"
+    np.save(tmp_path, embeddings)
+    os.replace(tmp_path, path)
+
+def encode_parallel(descriptions, model_name, processes=None, threads_per_process=None, batch_size=32,
+                    shard_size=512, checkpoint_dir=CHECKPOINT_DIR):
+    """
+    Codifica `descriptions` y devuelve una matriz float32 en el mismo orden.
+    """
+    start = time.perf_counter()
+    n = len(descriptions)
+    cpus = os.cpu_count() or 1
+    processes = max(1, processes or cpus)
+    threads = max(1, threads_per_process or cpus // processes)
+
+    order = np.argsort(token_lengths(descriptions, model_name), kind="stable")
+    shards = [order[i:i + shard_size] for i in range(0, n, shard_size)]
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    results, pending = {}, []
+    for number, rows in enumerate(shards):
+        texts = [descriptions[i] for i in rows]
+        path = os.path.join(checkpoint_dir, f"shard_{number:05d}_{_shard_key(model_name, texts)}.npy")
+        if os.path.exists(path):
+            results[number] = np.load(path)
+        else:
+            pending.append((number, texts, path))
+    print(f"Shards: {len(shards)} ({len(results)} reanudados desde '{checkpoint_dir}', "
+          f"{len(pending)} por codificar) con {processes} procesos × {threads} hilos")
+
+    done = sum(len(shards[number]) for number in results)
+    if pending:
+        if processes == 1:
+            _init_worker(model_name, threads)
+            for number, texts, path in pending:
+                results[number] = _encode_shard(texts, batch_size)
+                _save_shard(path, results[number])
+                done += len(texts)
+        else:
+            # "spawn": torch no es seguro tras fork con hilos ya iniciados
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_worker,
+                                     initargs=(model_name, threads)) as executor:
+                futures = {executor.submit(_encode_shard, texts, batch_size): (number, path, len(texts))
+                           for number, texts, path in pending}
+                for future in as_completed(futures):
+                    number, path, count = futures[future]
+                    results[number] = future.result()
+                    _save_shard(path, results[number])
+                    done += count
+                    elapsed = time.perf_counter() - start
+                    print(f"  {done}/{n} entidades ({done / elapsed:,.1f} entidades/s)")
+
+    # Los shards de ejecuciones con otros datos ya no sirven para reanudar
+    current = {f"shard_{number:05d}_{_shard_key(model_name, [descriptions[i] for i in rows])}.npy"
+               for number, rows in enumerate(shards)}
+    for name in os.listdir(checkpoint_dir):
+        if name.startswith("shard_") and name not in current:
+            os.remove(os.path.join(checkpoint_dir, name))
+
+    dimension = next(iter(results.values())).shape[1] if results else 0
+    embeddings = np.empty((n, dimension), dtype="float32")
+    for number, rows in enumerate(shards):
+        embeddings[rows] = results[number]
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    encoded = sum(len(texts) for _, texts, _ in pending)
+    stats = {"entities": n, "encoded": encoded, "resumed": n - encoded, "seconds": round(elapsed, 3),
+             "entities_per_s": round(encoded / elapsed, 2)}
+    with open(os.path.join(checkpoint_dir, "last_run.json"), "w", encoding="utf-8") as f:
+        json.dump(stats, f, indent=2)
+    print(f"✅ {encoded} entidades codificadas en {elapsed:.1f} s ({stats['entities_per_s']:,} entidades/s)")
+    return embeddings
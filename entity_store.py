@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Almacén binario compacto de las propiedades de las entidades.
+
+Sustituye en tiempo de servicio a all_entities_properties.json: todas las
+cadenas (URIs, nombres de predicados, literales) se guardan una sola vez en
+una tabla internada y las entidades se codifican como pares enteros
+(predicado, objeto). El archivo se abre con mmap y se decodifica bajo demanda,
+así que la carga no depende del número de entidades.
+
+Formato (little-endian, secciones alineadas a 8 bytes):
+    cabecera   MAGIC + 4 × uint64 (n_strings, blob_len, n_entities, n_pairs)
+    strings    uint64[n_strings + 1]  desplazamientos en el blob UTF-8
+    blob       bytes[blob_len]
+    entities   uint32[n_entities]     id de cadena de la URI, ordenado por URI
+    order      uint32[n_entities]     posición original (orden del JSON) de cada entidad
+    offsets    uint64[n_entities + 1] rango de pares de cada entidad
+    predicates uint32[n_pairs]
+    objects    uint32[n_pairs]
+"""
+
+import json
+import mmap
+import struct
+import sys
+from collections.abc import Mapping
+from functools import lru_cache
+
+import numpy as np
+
+MAGIC = b"GBSTORE1"
+HEADER = struct.Struct("<8s4Q")
+STORE_PATH = "all_entities_properties.bin"
+
+def _align(n):
+    return (n + 7) & ~7
+
+def write_store(all_entities_properties, path=STORE_PATH):
+    """
+    Serializa un diccionario {uri: {predicado: [valores]}} al formato compacto.
+    También acepta un iterable de pares (uri, propiedades), que se consume
+    una sola vez (p. ej. el exportador en streaming).
+    """
+    items = all_entities_properties.items() if isinstance(all_entities_properties, Mapping) \
+        else all_entities_properties
+    string_ids = {}
+
+    def intern(text):
+        string_id = string_ids.get(text)
+        if string_id is None:
+            string_id = string_ids[text] = len(string_ids)
+        return string_id
+
+    uri_ids, offsets, predicates, objects = [], [0], [], []
+    for uri, properties in items:
+        uri_ids.append(intern(uri))
+        for prop, values in properties.items():
+            prop_id = intern(prop)
+            for value in values:
+                predicates.append(prop_id)
+                objects.append(intern(value))
+        offsets.append(len(predicates))
+
+    encoded = [text.encode("utf-8") for text in string_ids]
+    string_offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    np.cumsum([len(b) for b in encoded], out=string_offsets[1:])
+    blob = b"".join(encoded)
+
+    # Las entidades se ordenan por los bytes de su URI para buscarlas por bisección
+    by_uri = sorted(range(len(uri_ids)), key=lambda i: encoded[uri_ids[i]])
+    order = np.asarray(by_uri, dtype="<u4")
+    offsets = np.asarray(offsets, dtype="<u8")
+    starts, ends = offsets[:-1][by_uri], offsets[1:][by_uri]
+    pairs = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)]) if len(by_uri) else np.empty(0, dtype="int64")
+    sorted_offsets = np.zeros(len(by_uri) + 1, dtype="<u8")
+    np.cumsum(ends - starts, out=sorted_offsets[1:])
+
+    sections = [
+        string_offsets,
+        np.frombuffer(blob, dtype="u1"),
+        np.asarray(uri_ids, dtype="<u4")[by_uri],
+        order,
+        sorted_offsets,
+        np.asarray(predicates, dtype="<u4")[pairs.astype("int64")],
+        np.asarray(objects, dtype="<u4")[pairs.astype("int64")],
+    ]
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(encoded), len(blob), len(uri_ids), len(predicates)))
+        for section in sections:
+            data = section.tobytes()
+            f.write(data)
+            f.write(b"\0" * (_align(len(data)) - len(data)))
+
+class EntityStore(Mapping):
+    """
+    Vista de solo lectura sobre un archivo de write_store() con la misma
+    interfaz que el diccionario de all_entities_properties.json:
+    store.get(uri) devuelve {predicado: [valores]}.
+    """
+
+    def __init__(self, path=STORE_PATH):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_strings, blob_len, n_entities, n_pairs = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} no es un almacén de entidades válido")
+
+        position = HEADER.size
+
+        def section(dtype, count):
+            nonlocal position
+            array = np.frombuffer(self._mmap, dtype=dtype, count=count, offset=position)
+            position += _align(array.nbytes)
+            return array
+
+        self._string_offsets = section("<u8", n_strings + 1)
+        self._blob_start = position
+        position += _align(blob_len)
+        self._entities = section("<u4", n_entities)
+        self._order = section("<u4", n_entities)
+        self._offsets = section("<u8", n_entities + 1)
+        self._predicates = section("<u4", n_pairs)
+        self._objects = section("<u4", n_pairs)
+        self._string = lru_cache(maxsize=65536)(self._decode)
+        self._original_order = None
+
+    def _raw(self, string_id):
+        start = self._blob_start + int(self._string_offsets[string_id])
+        end = self._blob_start + int(self._string_offsets[string_id + 1])
+        return self._mmap[start:end]
+
+    def _decode(self, string_id):
+        return self._raw(string_id).decode("utf-8")
+
+    def _find(self, uri):
+        # Búsqueda binaria sobre las URIs ordenadas por bytes
+        target = uri.encode("utf-8")
+        lo, hi = 0, len(self._entities)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._raw(int(self._entities[mid])) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._entities) and self._raw(int(self._entities[lo])) == target:
+            return lo
+        return None
+
+    def _properties(self, position):
+        start, end = int(self._offsets[position]), int(self._offsets[position + 1])
+        properties = {}
+        for prop_id, obj_id in zip(self._predicates[start:end].tolist(), self._objects[start:end].tolist()):
+            properties.setdefault(self._string(prop_id), []).append(self._string(obj_id))
+        return properties
+
+    def __getitem__(self, uri):
+        if not isinstance(uri, str):
+            raise KeyError(uri)
+        position = self._find(uri)
+        if position is None:
+            raise KeyError(uri)
+        return self._properties(position)
+
+    def __contains__(self, uri):
+        return isinstance(uri, str) and self._find(uri) is not None
+
+    def __len__(self):
+        return len(self._entities)
+
+    def __iter__(self):
+        # Mismo orden que el diccionario original
+        if self._original_order is None:
+            self._original_order = np.argsort(self._order, kind="stable")
+        for position in self._original_order.tolist():
+            yield self._string(int(self._entities[position]))
+
+def load_entities(store_path=STORE_PATH, json_path="all_entities_properties.json"):
+    """
+    Abre el almacén binario si existe; si no, carga el JSON original.
+    """
+    try:
+        return EntityStore(store_path)
+    except FileNotFoundError:
+        with open(json_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+if __name__ == "__main__":
+    # Conversión directa desde un JSON ya exportado:
+    #   python entity_store.py all_entities_properties.json all_entities_properties.bin
+    json_path = sys.argv[1] if len(sys.argv) > 1 else "all_entities_properties.json"
+    store_path = sys.argv[2] if len(sys.argv) > 2 else STORE_PATH
+    with open(json_path, "r", encoding="utf-8") as f:
+        write_store(json.load(f), store_path)
+    print(f"✅ Almacén compacto guardado en '{store_path}'")
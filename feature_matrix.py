@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Matriz lengua × rasgo empaquetada en bits para consultas tipológicas exactas.
+
+Se construye al exportar las entidades a partir de hasFeaturePresent /
+hasFeatureAbsent. Cada rasgo es una fila de bits sobre las lenguas en tres
+planos (presente, ausente, desconocido), de modo que un filtro conjuntivo o
+disyuntivo es un AND/OR de filas y un conteo es un popcount.
+"""
+
+import re
+import sys
+import json
+import numpy as np
+
+MATRIX_PATH = "feature_matrix.npz"
+PLANES = ("present", "absent", "unknown")
+
+class FeatureMatrix:
+    """
+    Planos de bits de forma (n_rasgos, ceil(n_lenguas / 8)) y pertenencia a
+    familias de forma (n_familias, ceil(n_lenguas / 8)).
+    """
+
+    def __init__(self, languages, features, families, present, absent, family_members):
+        self.languages = list(languages)
+        self.features = list(features)
+        self.families = list(families)
+        self.present = present
+        self.absent = absent
+        self._valid = np.packbits(np.ones(len(self.languages), dtype=bool))
+        self.unknown = ~(present | absent) & self._valid
+        self.family_members = family_members
+        self._feature_index = {feature: i for i, feature in enumerate(self.features)}
+        # También se aceptan identificadores cortos (GB020) además de la URI
+        self._feature_index.update({feature.rsplit("/", 1)[-1]: i for i, feature in enumerate(self.features)})
+
+    @classmethod
+    def build(cls, all_entities_properties):
+        languages = [uri for uri, props in all_entities_properties.items() if "Language" in props.get("type", [])]
+        features = sorted({uri for uri, props in all_entities_properties.items()
+                           if "GrammaticalFeature" in props.get("type", [])}
+                          | {f for uri in languages for prop in ("hasFeaturePresent", "hasFeatureAbsent")
+                             for f in all_entities_properties[uri].get(prop, [])})
+        families = sorted({f for uri in languages for f in all_entities_properties[uri].get("languageFamily", [])})
+        feature_index = {f: i for i, f in enumerate(features)}
+        family_index = {f: i for i, f in enumerate(families)}
+
+        present = np.zeros((len(features), len(languages)), dtype=bool)
+        absent = np.zeros((len(features), len(languages)), dtype=bool)
+        members = np.zeros((len(families), len(languages)), dtype=bool)
+        for j, uri in enumerate(languages):
+            props = all_entities_properties[uri]
+            present[[feature_index[f] for f in props.get("hasFeaturePresent", [])], j] = True
+            absent[[feature_index[f] for f in props.get("hasFeatureAbsent", [])], j] = True
+            members[[family_index[f] for f in props.get("languageFamily", [])], j] = True
+        return cls(languages, features, families,
+                   np.packbits(present, axis=1), np.packbits(absent, axis=1), np.packbits(members, axis=1))
+
+    def save(self, path=MATRIX_PATH):
+        np.savez(path, languages=np.asarray(self.languages), features=np.asarray(self.features),
+                 families=np.asarray(self.families), present=self.present, absent=self.absent,
+                 family_members=self.family_members)
+
+    @classmethod
+    def load(cls, path=MATRIX_PATH):
+        data = np.load(path)
+        return cls(data["languages"].tolist(), data["features"].tolist(), data["families"].tolist(),
+                   data["present"], data["absent"], data["family_members"])
+
+    def __contains__(self, feature):
+        return feature in self._feature_index
+
+    def _row(self, feature, plane):
+        return getattr(self, plane)[self._feature_index[feature]]
+
+    def _decode(self, bits):
+        positions = np.flatnonzero(np.unpackbits(bits, count=len(self.languages)))
+        return [self.languages[i] for i in positions]
+
+    def mask(self, present=(), absent=(), unknown=(), mode="all"):
+        """
+        Fila de bits de las lenguas que cumplen las condiciones. Con mode="all"
+        se exigen todas (AND); con mode="any", al menos una (OR).
+        """
+        conditions = [(f, "present") for f in present] + [(f, "absent") for f in absent] \
+            + [(f, "unknown") for f in unknown]
+        if not conditions:
+            return self._valid.copy()
+        rows = np.stack([self._row(feature, plane) for feature, plane in conditions])
+        reduce = np.bitwise_and if mode == "all" else np.bitwise_or
+        return reduce.reduce(rows, axis=0)
+
+    def select(self, present=(), absent=(), unknown=(), mode="all"):
+        """
+        URIs de las lenguas que cumplen el filtro, p. ej. select(absent=["GB020"], present=["GB165"]).
+        """
+        return self._decode(self.mask(present, absent, unknown, mode))
+
+    def count(self, present=(), absent=(), unknown=(), mode="all"):
+        return int(np.bitwise_count(self.mask(present, absent, unknown, mode)).sum())
+
+    def feature_counts(self, feature):
+        """
+        Número de lenguas con el rasgo presente, ausente o sin dato.
+        """
+        return {plane: int(np.bitwise_count(self._row(feature, plane)).sum()) for plane in PLANES}
+
+    def family_counts(self, feature, plane="present"):
+        """
+        Para cada familia, cuántas de sus lenguas tienen el rasgo en el plano indicado.
+        """
+        counts = np.bitwise_count(self.family_members & self._row(feature, plane)).sum(axis=1)
+        return dict(zip(self.families, counts.tolist()))
+
+    def family_mask_counts(self, bits):
+        """
+        Agrega por familia una fila de bits arbitraria (p. ej. el resultado de mask()).
+        """
+        counts = np.bitwise_count(self.family_members & bits).sum(axis=1)
+        return dict(zip(self.families, counts.tolist()))
+
+# ---------------------------------------------------------------------------
+# Reconocimiento de preguntas estructuradas para el camino rápido de inference.py
+# ---------------------------------------------------------------------------
+
+FEATURE_ID = re.compile(r"\bGB\d{3}\b", re.IGNORECASE)
+NEGATION = re.compile(r"\b(no|ni|sin|carecen?|ausentes?|lacks?|without|not|nor|absent)\b", re.IGNORECASE)
+DISJUNCTION = re.compile(r"\b(o|u|or)\b", re.IGNORECASE)
+# Solo en plural: "¿la lengua X tiene GB020?" pregunta por una lengua concreta
+LANGUAGE_QUESTION = re.compile(r"\b(lenguas|idiomas|languages)\b", re.IGNORECASE)
+COUNT_QUESTION = re.compile(r"\b(cu[aá]ntas?|how many|n[uú]mero de)\b", re.IGNORECASE)
+FAMILY_QUESTION = re.compile(r"\b(por familia|per family|by family)\b", re.IGNORECASE)
+
+def parse_feature_query(question):
+    """
+    Interpreta preguntas como "¿qué lenguas no tienen GB020 y tienen GB165?".
+    Devuelve un dict con present/absent/mode/count/by_family o None si la
+    pregunta no es un filtro de rasgos.
+    """
+    matches = list(FEATURE_ID.finditer(question))
+    if not matches or not LANGUAGE_QUESTION.search(question):
+        return None
+    present, absent, mode = [], [], "all"
+    previous_end, negated = 0, False
+    for match in matches:
+        segment = question[previous_end:match.start()]
+        if previous_end and DISJUNCTION.search(segment):
+            mode = "any"
+        # En una enumeración ("sin GB020, GB021") se mantiene la polaridad anterior
+        if segment.strip(" ,"):
+            negated = bool(NEGATION.search(segment))
+        (absent if negated else present).append(match.group(0).upper())
+        previous_end = match.end()
+    return {
+        "present": present,
+        "absent": absent,
+        "mode": mode,
+        "count": bool(COUNT_QUESTION.search(question)),
+        "by_family": bool(FAMILY_QUESTION.search(question)),
+    }
+
+if __name__ == "__main__":
+    # Construcción directa desde un JSON ya exportado
+    json_path = sys.argv[1] if len(sys.argv) > 1 else "all_entities_properties.json"
+    with open(json_path, "r", encoding="utf-8") as f:
+        matrix = FeatureMatrix.build(json.load(f))
+    matrix.save()
+    print(f"✅ Matriz de rasgos guardada en '{MATRIX_PATH}' "
+          f"({len(matrix.languages)} lenguas × {len(matrix.features)} rasgos)")
@@ -5,17 +5,24 @@ Created on Tue Mar 18 17:07:17 2025
 @author: jveraz
 """
 
+import argparse
+import hashlib
 import json
-from sentence_transformers import SentenceTransformer
+import os
+import time
 import faiss
 import numpy as np
+from index_backends import BACKENDS, REMOVABLE_BACKENDS, build_index
+from encode_pipeline import CHECKPOINT_DIR, encode_parallel
+from index_store import publish_index, stale_sources
+from runtime import export_paths
 
-# Cargar el archivo JSON con las propiedades de las entidades
-with open("all_entities_properties.json", "r", encoding="utf-8") as f:
-    all_entities_properties = json.load(f)
-
-# Verificar la carga
-print(f"Se cargaron {len(all_entities_properties)} entidades.")
+MODEL_NAME = "sentence-transformers/multi-qa-mpnet-base-dot-v1"
+INDEX_PATH = "grambank_entity_index.faiss"
+URIS_PATH = "entity_uris.txt"
+MANIFEST_PATH = "entity_manifest.json"
+# Backend del índice: flat (exacto, por defecto), hnsw, ivf_flat, ivf_pq, sq_fp16, sq_int8
+INDEX_BACKEND = os.getenv("INDEX_BACKEND", "flat")
 
 # Función para generar descripciones textuales
 def generate_entity_description(properties):
@@ -33,7 +40,7 @@ def generate_structural_description(entity_uri, properties, all_entities_propert
     Convierte la estructura del grafo en una descripción textual.
     """
     structural_description = []
-    
+
     # Relaciones con países
     if "spokenInCountry" in properties:
         country_uris = properties["spokenInCountry"]
@@ -44,7 +51,7 @@ def generate_structural_description(entity_uri, properties, all_entities_propert
                 countries.append(country_label)
         if countries:
             structural_description.append(f"Se habla en: {', '.join(countries)}")
-    
+
     # Relaciones con familias lingüísticas
     if "languageFamily" in properties:
         family_uris = properties["languageFamily"]
@@ -55,54 +62,222 @@ def generate_structural_description(entity_uri, properties, all_entities_propert
                 families.append(family_label)
         if families:
             structural_description.append(f"Pertenece a la familia lingüística: {', '.join(families)}")
-    
+
     # Relaciones con rasgos gramaticales
     if "hasFeaturePresent" in properties:
         features = properties["hasFeaturePresent"]
         structural_description.append(f"Tiene los siguientes rasgos gramaticales: {', '.join(features)}")
-    
+
     if "hasFeatureAbsent" in properties:
         features = properties["hasFeatureAbsent"]
         structural_description.append(f"No tiene los siguientes rasgos gramaticales: {', '.join(features)}")
-    
+
     return ". ".join(structural_description)
 
-# Generar descripciones textuales y estructurales para todas las entidades
-entity_descriptions = []
-entity_uris = list(all_entities_properties.keys())
-for entity_uri in entity_uris:
-    properties = all_entities_properties[entity_uri]
-    
-    # Descripción textual de las propiedades
-    text_description = generate_entity_description(properties)
-    
-    # Descripción estructural del grafo
-    structural_description = generate_structural_description(entity_uri, properties, all_entities_properties)
-    
-    # Combinar ambas descripciones
-    full_description = f"{text_description}. {structural_description}"
-    entity_descriptions.append(full_description)
-
-# Inicializar el modelo de embeddings
-model = SentenceTransformer("sentence-transformers/multi-qa-mpnet-base-dot-v1")
-
-# Generar embeddings
-entity_embeddings = model.encode(entity_descriptions)
-
-# Crear índice FAISS
-dimension = entity_embeddings.shape[1]  # Dimensión de los embeddings
-index = faiss.IndexFlatIP(dimension)  # Índice para similitud de coseno
-index.add(entity_embeddings)  # Añadir embeddings al índice
-
-# Guardar el índice para uso futuro
-faiss.write_index(index, "grambank_entity_index.faiss")
-
-# Guardar los URIs de las entidades para referencia
-with open("entity_uris.txt", "w", encoding="utf-8") as f:
-    for uri in entity_uris:
-        f.write(f"{uri}\n")
-
-print("✅ Embeddings generados y guardados en 'grambank_entity_index.faiss' y 'entity_uris.txt'.")
-
-# Verificar la dimensión del índice FAISS
-print("Dimensión del índice FAISS:", index.d)
\ No newline at end of file
+def build_descriptions(all_entities_properties, uris=None):
+    """
+    Genera la descripción textual + estructural de cada entidad, en el orden
+    de las claves del diccionario (o solo de `uris`, p. ej. las de un shard,
+    resolviendo los nombres de países y familias en el diccionario completo).
+    """
+    descriptions = {}
+    for entity_uri in (all_entities_properties if uris is None else uris):
+        properties = all_entities_properties[entity_uri]
+        # Descripción textual de las propiedades
+        text_description = generate_entity_description(properties)
+        # Descripción estructural del grafo
+        structural_description = generate_structural_description(entity_uri, properties, all_entities_properties)
+        # Combinar ambas descripciones
+        descriptions[entity_uri] = f"{text_description}. {structural_description}"
+    return descriptions
+
+def description_hash(description):
+    """
+    Hash de contenido de una descripción; decide si una entidad debe recodificarse.
+    """
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+def load_model():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(MODEL_NAME)
+
+def encode_descriptions(model, descriptions):
+    """
+    Codifica una lista de descripciones como float32 contiguo (lo que espera FAISS).
+    """
+    embeddings = model.encode(descriptions)
+    return np.ascontiguousarray(embeddings, dtype="float32")
+
+def write_uris(uris_by_id, path=URIS_PATH):
+    """
+    Escribe el archivo de URIs de forma que la línea i corresponda al ID i del
+    índice. Los IDs liberados quedan como líneas vacías para no desplazar al resto.
+    """
+    size = max(uris_by_id, default=-1) + 1
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(size):
+            f.write(f"{uris_by_id.get(i, '')}\n")
+
+def load_manifest(path=MANIFEST_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    # Escritura atómica: el manifiesto y el índice deben quedar consistentes
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def model_encoder(model=None):
+    """
+    Codificador en proceso con un único SentenceTransformer (cargado al primer uso).
+    """
+    def encode(descriptions):
+        nonlocal model
+        model = model or load_model()
+        return encode_descriptions(model, descriptions)
+    return encode
+
+def full_rebuild(all_entities_properties, model=None, backend=INDEX_BACKEND, encode=None, sources=()):
+    """
+    Reconstrucción completa: codifica todas las entidades y reescribe el índice.
+    encode(descriptions) permite sustituir el codificador (p. ej. encode_parallel);
+    sources son los archivos de la exportación de la que salen las entidades.
+    """
+    descriptions = build_descriptions(all_entities_properties)
+    entity_uris = list(descriptions.keys())
+    encode = encode or model_encoder(model)
+
+    # Generar embeddings
+    entity_embeddings = encode(list(descriptions.values()))
+
+    # Crear índice FAISS (IndexFlatIP con el backend "flat")
+    index = build_index(entity_embeddings, backend)
+
+    # Guardar el índice y los URIs de las entidades (los servicios en marcha pueden recargarlos)
+    publish_index(index, dict(enumerate(entity_uris)), INDEX_PATH, URIS_PATH, sources)
+    return index
+
+def incremental_rebuild(all_entities_properties, model=None, backend=INDEX_BACKEND, encode=None, sources=()):
+    """
+    Reconstrucción incremental: compara el hash de la descripción de cada
+    entidad con el manifiesto de la ejecución anterior y solo recodifica las
+    entidades nuevas o modificadas. Las eliminadas se borran del índice.
+    El índice es un IndexIDMap2, de modo que el ID de cada URI es estable
+    entre ejecuciones.
+    """
+    if backend not in REMOVABLE_BACKENDS:
+        raise ValueError(f"El backend {backend!r} no admite borrado; use una reconstrucción completa.")
+    descriptions = build_descriptions(all_entities_properties)
+    manifest = load_manifest()
+
+    if manifest is None or not os.path.exists(INDEX_PATH):
+        print("No hay manifiesto previo: se construye el índice incremental desde cero.")
+        manifest = {"next_id": 0, "entities": {}}
+        index = None
+    elif manifest.get("backend", "flat") != backend:
+        print(f"El backend cambió ({manifest.get('backend', 'flat')} → {backend}): se reconstruye desde cero.")
+        manifest = {"next_id": 0, "entities": {}}
+        index = None
+    else:
+        index = faiss.read_index(INDEX_PATH)
+        if not isinstance(index, faiss.IndexIDMap2):
+            # Un índice plano de una reconstrucción completa no tiene IDs explícitos
+            print("El índice existente no tiene IDs explícitos: se reconstruye desde cero.")
+            manifest = {"next_id": 0, "entities": {}}
+            index = None
+
+    entities = manifest["entities"]
+    changed = []
+    for uri, description in descriptions.items():
+        entry = entities.get(uri)
+        if entry is None or entry["hash"] != description_hash(description):
+            changed.append(uri)
+    removed = [uri for uri in entities if uri not in descriptions]
+
+    print(f"Entidades nuevas o modificadas: {len(changed)}, eliminadas: {len(removed)}, "
+          f"sin cambios: {len(descriptions) - len(changed)}")
+
+    # Las entidades modificadas conservan su ID: se borra el vector antiguo y se reinserta
+    stale_ids = [entities[uri]["id"] for uri in removed + changed if uri in entities]
+    if index is not None and stale_ids:
+        index.remove_ids(np.asarray(stale_ids, dtype="int64"))
+    for uri in removed:
+        del entities[uri]
+
+    if changed:
+        encode = encode or model_encoder(model)
+        embeddings = encode([descriptions[uri] for uri in changed])
+        ids = []
+        for uri in changed:
+            if uri not in entities:
+                entities[uri] = {"id": manifest["next_id"]}
+                manifest["next_id"] += 1
+            entities[uri]["hash"] = description_hash(descriptions[uri])
+            ids.append(entities[uri]["id"])
+        if index is None:
+            # Los backends entrenables se entrenan con el primer lote completo
+            index = build_index(embeddings, backend, ids=ids)
+        else:
+            index.add_with_ids(embeddings, np.asarray(ids, dtype="int64"))
+
+    if index is None:
+        print("⚠️ No hay entidades que indexar.")
+        return None
+
+    # Se republica también si solo cambió la exportación, para que el marcador la registre
+    if changed or removed or manifest.get("backend") != backend or stale_sources(INDEX_PATH):
+        publish_index(index, {entry["id"]: uri for uri, entry in entities.items()}, INDEX_PATH, URIS_PATH, sources)
+    manifest["backend"] = backend
+    save_manifest(manifest)
+    return index
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera los embeddings y el índice FAISS de las entidades")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Recodifica solo las entidades cuya descripción cambió desde la última ejecución")
+    parser.add_argument("--backend", default=INDEX_BACKEND, choices=sorted(BACKENDS),
+                        help="Tipo de índice FAISS (por defecto: $INDEX_BACKEND o 'flat')")
+    parser.add_argument("--procesos", type=int, default=0,
+                        help="Codificar en paralelo, por longitud y con checkpoints, con N procesos")
+    parser.add_argument("--hilos", type=int, default=None, help="Hilos de torch por proceso")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--shard-size", type=int, default=512)
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR)
+    args = parser.parse_args()
+
+    encode = None
+    if args.procesos:
+        def encode(descriptions):
+            return encode_parallel(descriptions, MODEL_NAME, processes=args.procesos,
+                                   threads_per_process=args.hilos, batch_size=args.batch_size,
+                                   shard_size=args.shard_size, checkpoint_dir=args.checkpoint_dir)
+
+    # Cargar el archivo JSON con las propiedades de las entidades
+    with open("all_entities_properties.json", "r", encoding="utf-8") as f:
+        all_entities_properties = json.load(f)
+
+    # Verificar la carga
+    print(f"Se cargaron {len(all_entities_properties)} entidades.")
+
+    start = time.perf_counter()
+    if args.incremental:
+        index = incremental_rebuild(all_entities_properties, backend=args.backend, encode=encode,
+                                    sources=export_paths())
+    else:
+        index = full_rebuild(all_entities_properties, backend=args.backend, encode=encode,
+                             sources=export_paths())
+    if index is None:
+        return
+
+    print(f"✅ Embeddings generados y guardados en '{INDEX_PATH}' y '{URIS_PATH}' "
+          f"({time.perf_counter() - start:.1f} s).")
+
+    # Verificar la dimensión del índice FAISS
+    print("Dimensión del índice FAISS:", index.d)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Interfaz de generadores de texto para inference.py y server.py.
+
+Un generador transforma un prompt en texto, de una vez (generate) o token a
+token (stream / astream). HuggingFaceGenerator envuelve el InferenceClient
+remoto; StubGenerator es un generador local y determinista para pruebas de
+carga sin red.
+"""
+
+import asyncio
+import hashlib
+import threading
+import time
+
+class Generator:
+    """
+    Clase base. Las subclases implementan al menos stream(); astream() por
+    defecto consume stream() en un hilo de `executor` (el del bucle si es None)
+    para no bloquear el bucle de asyncio. Un executor acotado limita también
+    los hilos que quedan bloqueados en el servicio remoto tras un tiempo límite.
+    """
+
+    def generate(self, prompt, max_new_tokens=200):
+        return "".join(self.stream(prompt, max_new_tokens=max_new_tokens))
+
+    def stream(self, prompt, max_new_tokens=200):
+        raise NotImplementedError
+
+    async def astream(self, prompt, max_new_tokens=200, executor=None):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+        cancelled = threading.Event()
+
+        def produce():
+            if cancelled.is_set():
+                # El consumidor se rindió (tiempo límite) mientras esperaba un hilo libre
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+                return
+            try:
+                for token in self.stream(prompt, max_new_tokens=max_new_tokens):
+                    if cancelled.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, token)
+            except Exception as exc:  # se propaga al consumidor
+                loop.call_soon_threadsafe(queue.put_nowait, exc)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        loop.run_in_executor(executor, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            cancelled.set()
+
+class HuggingFaceGenerator(Generator):
+    """
+    Generador remoto a través de huggingface_hub.InferenceClient.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def generate(self, prompt, max_new_tokens=200):
+        return self.client.text_generation(prompt, max_new_tokens=max_new_tokens)
+
+    def stream(self, prompt, max_new_tokens=200):
+        yield from self.client.text_generation(prompt, max_new_tokens=max_new_tokens, stream=True)
+
+class StubGenerator(Generator):
+    """
+    Generador local determinista: la misma pregunta produce siempre los
+    mismos tokens. token_delay simula la latencia por token de un modelo real.
+    """
+
+    WORDS = ("La", "lengua", "pertenece", "a", "la", "familia", "y", "se", "habla", "en",
+             "la", "región", "según", "los", "datos", "de", "Grambank", ".")
+
+    def __init__(self, token_delay=0.0, tokens=32):
+        self.token_delay = token_delay
+        self.tokens = tokens
+
+    def _tokens(self, prompt, max_new_tokens):
+        seed = int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:4], "little")
+        for i in range(min(self.tokens, max_new_tokens)):
+            yield self.WORDS[(seed + i) % len(self.WORDS)] + " "
+
+    def stream(self, prompt, max_new_tokens=200):
+        for token in self._tokens(prompt, max_new_tokens):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            yield token
+
+    async def astream(self, prompt, max_new_tokens=200, executor=None):
+        # Implementación nativa: no ocupa hilos mientras "espera" al modelo
+        for token in self._tokens(prompt, max_new_tokens):
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield token
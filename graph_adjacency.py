@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Adyacencia tipada del grafo en formato CSR, con identificadores enteros.
+
+Cada relación (languageFamily, spokenInCountry, hasLanguage, rasgos...) se
+guarda como un par (indptr, indices), junto con su inversa "^relación"
+(p. ej. "^languageFamily": familia -> lenguas). Los valores que no son
+entidades del almacén (códigos de estado, literales) también reciben un
+nodo, de modo que "lenguas con el mismo estado UNESCO" es un salto
+relación -> ^relación.
+
+Las expansiones se hacen con operaciones vectorizadas de numpy sobre
+lotes de nodos y con un límite de nodos por salto:
+
+    adjacency.expand([uri], ["languageFamily", "^languageFamily"])  # lenguas de la misma familia
+    adjacency.shared_features(uri, min_shared=100)                 # lenguas con ≥100 rasgos en común
+"""
+
+import numpy as np
+
+ADJACENCY_PATH = "graph_adjacency.npz"
+RELATIONS = ("languageFamily", "spokenInCountry", "hasLanguage", "unescoLanguageStatus",
+             "hasFeaturePresent", "hasFeatureAbsent", "location")
+
+def _csr(sources, targets, n):
+    order = np.lexsort((targets, sources))
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=n), out=indptr[1:])
+    return indptr, targets[order].astype(np.int32)
+
+def _gather(indptr, indices, rows):
+    """
+    Concatenación de los vecinos de varias filas, sin bucle en Python.
+    """
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    total = int(lengths.sum())
+    if not total:
+        return np.empty(0, dtype=indices.dtype)
+    offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+    return indices[np.arange(total) + offsets]
+
+class GraphAdjacency:
+    def __init__(self, uris, relations):
+        self.uris = np.asarray(uris, dtype=object)
+        self.ids = {uri: i for i, uri in enumerate(self.uris)}
+        self.relations = relations  # nombre -> (indptr, indices)
+
+    @classmethod
+    def build(cls, all_entities_properties, relations=RELATIONS):
+        uris = list(all_entities_properties.keys())
+        ids = {uri: i for i, uri in enumerate(uris)}
+        edges = {}
+        for relation in relations:
+            sources, targets = [], []
+            for uri, properties in all_entities_properties.items():
+                for value in properties.get(relation, []):
+                    if value not in ids:
+                        ids[value] = len(uris)
+                        uris.append(value)
+                    sources.append(ids[uri])
+                    targets.append(ids[value])
+            edges[relation] = (np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64))
+
+        n = len(uris)
+        csr = {}
+        for relation, (sources, targets) in edges.items():
+            csr[relation] = _csr(sources, targets, n)
+            csr["^" + relation] = _csr(targets, sources, n)
+        return cls(uris, csr)
+
+    def save(self, path=ADJACENCY_PATH):
+        arrays = {"uris": self.uris.astype(str)}
+        for relation, (indptr, indices) in self.relations.items():
+            arrays[f"{relation}.indptr"] = indptr
+            arrays[f"{relation}.indices"] = indices
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path=ADJACENCY_PATH):
+        with np.load(path) as data:
+            names = {key.rsplit(".", 1)[0] for key in data.files if key != "uris"}
+            relations = {name: (data[f"{name}.indptr"], data[f"{name}.indices"]) for name in names}
+            return cls(data["uris"].tolist(), relations)
+
+    def __len__(self):
+        return len(self.uris)
+
+    def to_ids(self, uris):
+        return np.asarray([self.ids[uri] for uri in uris if uri in self.ids], dtype=np.int64)
+
+    def degree(self, relation, ids):
+        indptr = self.relations[relation][0]
+        return indptr[ids + 1] - indptr[ids]
+
+    def neighbors(self, ids, relation):
+        """
+        Vecinos (con repeticiones) de un lote de nodos por una relación.
+        """
+        indptr, indices = self.relations[relation]
+        return _gather(indptr, indices, np.asarray(ids, dtype=np.int64))
+
+    def expand_ids(self, seeds, path, max_fanout=None):
+        """
+        Recorre `path` (una relación por salto) desde `seeds`. Si un salto
+        alcanza más de max_fanout nodos se conservan los alcanzados desde más
+        nodos del salto anterior (y, a igualdad, los de menor id).
+        """
+        frontier = np.unique(np.asarray(seeds, dtype=np.int64))
+        for relation in path:
+            reached, counts = np.unique(self.neighbors(frontier, relation), return_counts=True)
+            if max_fanout is not None and len(reached) > max_fanout:
+                reached = reached[np.argsort(-counts, kind="stable")[:max_fanout]]
+            frontier = reached
+        return frontier
+
+    def expand(self, uris, path, max_fanout=None, exclude_seeds=True):
+        """
+        Igual que expand_ids, con URIs de entrada y de salida.
+        """
+        seeds = self.to_ids(uris)
+        reached = self.expand_ids(seeds, path, max_fanout)
+        if exclude_seeds:
+            reached = reached[~np.isin(reached, seeds)]
+        return self.uris[reached].tolist()
+
+    def shared_features(self, uri, min_shared=1, relation="hasFeaturePresent", top=None):
+        """
+        Entidades que comparten al menos min_shared valores de `relation` con
+        `uri` (por defecto, rasgos presentes), ordenadas por número de valores
+        compartidos. Devuelve [(uri, compartidos), ...].
+        """
+        if uri not in self.ids:
+            return []
+        source = self.ids[uri]
+        values = self.neighbors([source], relation)
+        counts = np.bincount(self.neighbors(values, "^" + relation), minlength=len(self))
+        counts[source] = 0
+        matches = np.flatnonzero(counts >= max(min_shared, 1))
+        matches = matches[np.argsort(-counts[matches], kind="stable")]
+        if top is not None:
+            matches = matches[:top]
+        return [(self.uris[i], int(counts[i])) for i in matches]
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Almacén binario del grafo compartido entre las etapas del pipeline.
+
+Parsear el Turtle con rdflib es la parte lenta de wikidata.py y de
+all_entities_properties.py. TripleTable guarda los triples como un
+diccionario sujeto -> predicado -> objetos (cada término RDF una sola vez) y
+se persiste con pickle junto al Turtle ("grambank_sudamerica.gstore" al lado
+de "grambank_sudamerica.ttl"). Implementa la parte de la API de
+rdflib.Graph que usan las etapas (add, subjects, objects, value,
+predicate_objects, triples, len, iteración).
+
+- read_graph(ruta) usa el .gstore si corresponde al hash de contenido del
+  Turtle; si no, parsea el Turtle (o N-Triples) y deja el .gstore listo para
+  la siguiente etapa.
+- write_graph(g, ruta) escribe el RDF y su .gstore a la vez.
+"""
+
+import hashlib
+import os
+import pickle
+import re
+
+from rdflib import BNode, Graph, Literal, URIRef
+
+GRAPH_SUFFIX = ".gstore"
+FORMAT_VERSION = 1
+
+def store_path(path):
+    return os.path.splitext(path)[0] + GRAPH_SUFFIX
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# -- Términos N-Triples -----------------------------------------------------------
+
+NT_TERM = r'<[^>]*>|_:\S+|"(?:[^"\\]|\\.)*"(?:@[A-Za-z0-9-]+|\^\^<[^>]*>)?'
+NT_LINE = re.compile(rf"\s*({NT_TERM})\s+({NT_TERM})\s+({NT_TERM})\s*\.\s*$")
+NT_ESCAPE = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+NT_ESCAPES = {"t": "\t", "b": "\b", "n": "\n", "r": "\r", "f": "\f", '"': '"', "'": "'", "\\": "\\"}
+
+def unescape(text):
+    return NT_ESCAPE.sub(lambda m: chr(int(m.group(1) or m.group(2), 16)) if (m.group(1) or m.group(2))
+                         else NT_ESCAPES[m.group(3)], text)
+
+def from_nt(term):
+    """
+    Término rdflib a partir de su forma N-Triples.
+    """
+    if term.startswith("<"):
+        return URIRef(unescape(term[1:-1]))
+    if term.startswith("_:"):
+        return BNode(term[2:])
+    body, _, suffix = term[1:].rpartition('"')
+    lexical = unescape(body)
+    if suffix.startswith("@"):
+        return Literal(lexical, lang=suffix[1:])
+    if suffix.startswith("^^"):
+        return Literal(lexical, datatype=URIRef(suffix[3:-1]))
+    return Literal(lexical)
+
+def to_nt(term):
+    if isinstance(term, Literal):
+        text = str(term).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"').replace("\r", "\\r")
+        if term.language:
+            return f'"{text}"@{term.language}'
+        if term.datatype:
+            return f'"{text}"^^<{term.datatype}>'
+        return f'"{text}"'
+    return term.n3()
+
+# -- Tabla de triples ---------------------------------------------------------------
+
+class TripleTable:
+    """
+    Triples en memoria como {sujeto: {predicado: {objeto: None}}} (conjuntos
+    ordenados por inserción), con los términos internados, y el índice
+    predicado -> objeto -> sujetos. Los recorridos siguen el mismo orden que
+    rdflib.Graph (el de lectura), así que las etapas producen la misma salida.
+    """
+
+    def __init__(self):
+        self._spo = {}
+        self._pos = {}
+        self._terms = {}
+        self._len = 0
+        self.source_hash = None
+
+    def _intern(self, term):
+        return self._terms.setdefault(term, term)
+
+    @classmethod
+    def from_graph(cls, graph):
+        # Un Graph se recorre en orden arbitrario; para conservar el de lectura, parse_rdf
+        table = cls()
+        for triple in graph:
+            table.add(triple)
+        return table
+
+    @classmethod
+    def parse_rdf(cls, path, format="turtle"):
+        table = cls()
+        _TableSink(table).parse(path, format=format)
+        return table
+
+    @classmethod
+    def from_ntriples(cls, path):
+        # Sin pasar por el parser de rdflib: un término se convierte una sola vez
+        table = cls()
+        converted = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip() or line.lstrip().startswith("#"):
+                    continue
+                match = NT_LINE.match(line)
+                if match is None:
+                    raise ValueError(f"Línea N-Triples no válida: {line[:200]!r}")
+                table.add(tuple(converted[t] if t in converted else converted.setdefault(t, from_nt(t))
+                                for t in match.groups()))
+        return table
+
+    def add(self, triple):
+        s, p, o = triple
+        s, p, o = self._intern(s), self._intern(p), self._intern(o)
+        objects = self._spo.setdefault(s, {}).setdefault(p, {})
+        if o not in objects:
+            objects[o] = None
+            self._pos.setdefault(p, {}).setdefault(o, {})[s] = None
+            self._len += 1
+        return self
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for s, predicates in self._spo.items():
+            for p, objects in predicates.items():
+                for o in objects:
+                    yield s, p, o
+
+    def __contains__(self, triple):
+        s, p, o = triple
+        return o in self._spo.get(s, {}).get(p, ())
+
+    def triples(self, pattern):
+        s, p, o = pattern
+        if s is None and p is not None:
+            objects = self._pos.get(p, {})
+            for obj in (objects if o is None else [o]):
+                for subject in objects.get(obj, ()):
+                    yield subject, p, obj
+            return
+        subjects = self._spo.items() if s is None else [(s, self._spo.get(s, {}))]
+        for subject, predicates in subjects:
+            pairs = predicates.items() if p is None else [(p, predicates.get(p, {}))]
+            for predicate, objects in pairs:
+                if o is None:
+                    for obj in objects:
+                        yield subject, predicate, obj
+                elif o in objects:
+                    yield subject, predicate, o
+
+    def subjects(self, predicate=None, object=None):
+        # Como rdflib: un sujeto por triple que coincide
+        for s, _, _ in self.triples((None, predicate, object)):
+            yield s
+
+    def objects(self, subject=None, predicate=None):
+        for _, _, o in self.triples((subject, predicate, None)):
+            yield o
+
+    def predicate_objects(self, subject=None):
+        for _, p, o in self.triples((subject, None, None)):
+            yield p, o
+
+    def value(self, subject=None, predicate=None, default=None):
+        return next(self.objects(subject, predicate), default)
+
+    def to_graph(self):
+        graph = Graph()
+        graph.addN((s, p, o, graph) for s, p, o in self)
+        return graph
+
+    def write_ntriples(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for s, p, o in self:
+                f.write(f"{to_nt(s)} {to_nt(p)} {to_nt(o)} .\n")
+
+    def save(self, path, source_hash=None):
+        # Cabecera y cuerpo por separado: read_graph valida sin cargar los triples
+        self.source_hash = source_hash if source_hash is not None else self.source_hash
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"format": FORMAT_VERSION, "source_hash": self.source_hash, "triples": self._len},
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump((self._spo, self._pos), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def read_header(path):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    @classmethod
+    def load(cls, path):
+        table = cls()
+        with open(path, "rb") as f:
+            header = pickle.load(f)
+            if header.get("format") != FORMAT_VERSION:
+                raise ValueError(f"Formato de almacén de grafo no soportado en '{path}'")
+            table._spo, table._pos = pickle.load(f)
+        table._len = header["triples"]
+        table.source_hash = header["source_hash"]
+        # pickle ya comparte los términos repetidos; se reconstruye la tabla de internado
+        for s, p, o in table:
+            table._terms.setdefault(s, s)
+            table._terms.setdefault(p, p)
+            table._terms.setdefault(o, o)
+        return table
+
+class _TableSink(Graph):
+    """
+    Destino del parser de rdflib que pasa cada triple a la tabla, en orden
+    de lectura, sin construir el grafo en memoria.
+    """
+
+    def __init__(self, table):
+        super().__init__()
+        self.table = table
+
+    def add(self, triple):
+        self.table.add(triple)
+        return self
+
+def read_graph(path):
+    """
+    Grafo de `path` (Turtle, N-Triples o .gstore) como TripleTable, desde el
+    .gstore si está al día con el contenido del archivo RDF.
+    """
+    if path.endswith(GRAPH_SUFFIX):
+        return TripleTable.load(path)
+    cache = store_path(path)
+    digest = file_hash(path)
+    if os.path.exists(cache):
+        try:
+            header = TripleTable.read_header(cache)
+        except (pickle.UnpicklingError, EOFError):
+            header = {}
+        if header.get("format") == FORMAT_VERSION and header.get("source_hash") == digest:
+            return TripleTable.load(cache)
+    if path.endswith(".nt"):
+        table = TripleTable.from_ntriples(path)
+    else:
+        table = TripleTable.parse_rdf(path)
+    table.save(cache, source_hash=digest)
+    return table
+
+def write_graph(graph, path):
+    """
+    Escribe el grafo (TripleTable o rdflib.Graph) en `path` (Turtle, o
+    N-Triples si termina en .nt; solo el almacén si termina en .gstore) y
+    actualiza su .gstore.
+    """
+    table = graph if isinstance(graph, TripleTable) else TripleTable.from_graph(graph)
+    if path.endswith(GRAPH_SUFFIX):
+        table.save(path)
+        return table
+    if path.endswith(".nt"):
+        table.write_ntriples(path)
+    else:
+        (graph if isinstance(graph, Graph) else table.to_graph()).serialize(path, format="turtle")
+    table.save(store_path(path), source_hash=file_hash(path))
+    return table
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Backends de índice FAISS seleccionables por configuración.
+
+Todos usan producto interno (el modelo multi-qa-mpnet-base-dot-v1 está
+entrenado para similitud por producto punto), igual que el IndexFlatIP original.
+"""
+
+import math
+import faiss
+import numpy as np
+
+# Parámetros por defecto de cada backend; se pueden sobrescribir con build_index(..., **params)
+BACKENDS = {
+    "flat": {},
+    "hnsw": {"m": 32, "ef_construction": 200, "ef_search": 64},
+    "ivf_flat": {"nlist": None, "nprobe": 8},
+    "ivf_pq": {"nlist": None, "nprobe": 8, "pq_m": 48, "pq_nbits": 8},
+    "sq_fp16": {},
+    "sq_int8": {},
+}
+
+# Backends que admiten remove_ids (necesario para la reconstrucción incremental)
+REMOVABLE_BACKENDS = {"flat", "ivf_flat", "ivf_pq", "sq_fp16", "sq_int8"}
+
+def _default_nlist(n):
+    # Regla habitual: ~4·sqrt(n) listas, con al menos ~39 puntos de entrenamiento por lista
+    return max(1, min(int(4 * math.sqrt(n)), n // 39 or 1))
+
+def factory_string(backend, n, dimension, **overrides):
+    """
+    Traduce un backend y sus parámetros a una cadena de faiss.index_factory.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend desconocido: {backend!r}. Opciones: {', '.join(BACKENDS)}")
+    params = {**BACKENDS[backend], **overrides}
+
+    if backend == "flat":
+        return "Flat", params
+    if backend == "hnsw":
+        return f"HNSW{params['m']}", params
+    if backend in ("ivf_flat", "ivf_pq"):
+        nlist = params["nlist"] or _default_nlist(n)
+        params["nlist"] = nlist
+        if backend == "ivf_flat":
+            return f"IVF{nlist},Flat", params
+        pq_m = params["pq_m"]
+        if dimension % pq_m:
+            raise ValueError(f"pq_m={pq_m} debe dividir la dimensión {dimension}")
+        # Con pocos vectores no hay suficientes puntos (~39 por centroide) para 2^8 centroides
+        nbits = max(1, min(params["pq_nbits"], int(math.log2(max(n // 39, 2)))))
+        params["pq_nbits"] = nbits
+        return f"IVF{nlist},PQ{pq_m}x{nbits}", params
+    if backend == "sq_fp16":
+        return "SQfp16", params
+    return "SQ8", params
+
+def build_index(embeddings, backend="flat", ids=None, train_embeddings=None, **overrides):
+    """
+    Construye (entrena si hace falta) y llena un índice del backend indicado.
+    Si se pasan ids, el índice se envuelve en un IndexIDMap2.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    n, dimension = embeddings.shape
+    description, params = factory_string(backend, n, dimension, **overrides)
+    if ids is not None:
+        description = f"IDMap2,{description}"
+    index = faiss.index_factory(dimension, description, faiss.METRIC_INNER_PRODUCT)
+
+    if not index.is_trained:
+        train = embeddings if train_embeddings is None else np.ascontiguousarray(train_embeddings, dtype="float32")
+        index.train(train)
+    configure_search(index, backend, **params)
+
+    if ids is None:
+        index.add(embeddings)
+    else:
+        index.add_with_ids(embeddings, np.asarray(ids, dtype="int64"))
+    return index
+
+def configure_search(index, backend, **params):
+    """
+    Ajusta los parámetros de búsqueda (se serializan junto con el índice).
+    """
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if backend == "hnsw":
+        inner.hnsw.efConstruction = params.get("ef_construction", BACKENDS["hnsw"]["ef_construction"])
+        inner.hnsw.efSearch = params.get("ef_search", BACKENDS["hnsw"]["ef_search"])
+    elif backend in ("ivf_flat", "ivf_pq"):
+        inner.nprobe = min(params.get("nprobe", 8), inner.nlist)
+
+def index_vectors(index):
+    """
+    Recupera (ids, vectores) de un índice plano, con o sin IDMap, para usarlos
+    como referencia exacta.
+    """
+    if isinstance(index, faiss.IndexIDMap):
+        ids = faiss.vector_to_array(index.id_map).astype("int64")
+        inner = faiss.downcast_index(index.index)
+        return ids, inner.reconstruct_n(0, inner.ntotal)
+    return np.arange(index.ntotal, dtype="int64"), index.reconstruct_n(0, index.ntotal)
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Índice FAISS y tabla de URIs de solo lectura, mapeados en memoria y
+recargables en caliente.
+
+- read_index(ruta, mmap=True) abre el índice con IO_FLAG_MMAP | IO_FLAG_READ_ONLY:
+  las listas invertidas de los backends IVF (y, desde faiss 1.11 con
+  IO_FLAG_MMAP_IFC, los códigos de los índices planos) quedan en la caché de
+  páginas del sistema, una sola copia para todos los procesos del host.
+- UriTable lee entity_uris.txt con mmap a través de un archivo de
+  desplazamientos (entity_uris.idx, uint64[n + 1]): la línea i es el ID i y
+  no se crea una lista de cadenas por proceso.
+- publish_index escribe índice, URIs y desplazamientos en archivos temporales,
+  los renombra y por último escribe el marcador de versión
+  (grambank_entity_index.faiss.version). Los procesos que tienen abierta la
+  versión anterior la siguen usando hasta soltarla; load_dense_index solo
+  acepta un conjunto de archivos que coincide con su marcador.
+- El marcador guarda también el tamaño y la fecha de los archivos de los que
+  salió el índice (la exportación de entidades); stale_sources indica cuáles
+  cambiaron desde entonces, para no recargar un índice junto con entidades de
+  otra exportación.
+"""
+
+import json
+import mmap
+import os
+import time
+from collections.abc import Sequence
+
+import numpy as np
+
+class IndexNotReady(RuntimeError):
+    """
+    Los archivos del índice no coinciden con su marcador (publicación en curso).
+    """
+
+def offsets_path(uris_path):
+    return os.path.splitext(uris_path)[0] + ".idx"
+
+def version_path(index_path):
+    return f"{index_path}.version"
+
+def _line_offsets(data):
+    # Inicio de cada línea y fin de la última (posición tras su salto de línea)
+    newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord("\n")) + 1
+    offsets = np.concatenate(([0], newlines)).astype(np.uint64)
+    if len(data) and data[-1:] != b"\n":
+        offsets = np.append(offsets, np.uint64(len(data)))
+    return offsets
+
+def write_uri_offsets(uris_path, path=None):
+    path = path or offsets_path(uris_path)
+    with open(uris_path, "rb") as f:
+        offsets = _line_offsets(f.read())
+    with open(f"{path}.tmp", "wb") as f:
+        np.save(f, offsets)
+    os.replace(f"{path}.tmp", path)
+    return path
+
+class UriTable(Sequence):
+    """
+    uris[i] -> URI del ID i ("" si el ID está libre), leída del archivo mapeado.
+    Si falta el archivo de desplazamientos (o no corresponde al de URIs) se
+    calculan en memoria.
+    """
+
+    def __init__(self, uris_path, offsets=None):
+        with open(uris_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        offsets = offsets or offsets_path(uris_path)
+        self._offsets = np.load(offsets, mmap_mode="r") if os.path.exists(offsets) else None
+        if self._offsets is None or int(self._offsets[-1]) != size:
+            self._offsets = _line_offsets(self._data)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._data[int(self._offsets[i]):int(self._offsets[i + 1])].decode("utf-8").rstrip("\r\n")
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+def read_index(path, mmap=True):
+    import faiss
+    if not mmap:
+        return faiss.read_index(path)
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    return faiss.read_index(path, flags)
+
+def _stats(paths):
+    stats = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stats[path] = [stat.st_size, stat.st_mtime_ns]
+        except FileNotFoundError:
+            stats[path] = None
+    return stats
+
+def publish_index(index, uris_by_id, index_path, uris_path, sources=()):
+    """
+    Publica una nueva versión del índice y de sus URIs (ver el docstring del
+    módulo). `sources`: archivos de los que se generó el índice.
+    """
+    import faiss
+    from generate_embeddings import write_uris
+    write_uris(uris_by_id, f"{uris_path}.tmp")
+    write_uri_offsets(f"{uris_path}.tmp", f"{offsets_path(uris_path)}.new")
+    faiss.write_index(index, f"{index_path}.tmp")
+    os.replace(f"{uris_path}.tmp", uris_path)
+    os.replace(f"{offsets_path(uris_path)}.new", offsets_path(uris_path))
+    os.replace(f"{index_path}.tmp", index_path)
+
+    marker = {"version": f"{time.time_ns():x}",
+              "files": _stats([index_path, uris_path, offsets_path(uris_path)]),
+              "sources": _stats(sources)}
+    with open(f"{version_path(index_path)}.tmp", "w", encoding="utf-8") as f:
+        json.dump(marker, f)
+    os.replace(f"{version_path(index_path)}.tmp", version_path(index_path))
+    return marker["version"]
+
+def _read_marker(index_path):
+    try:
+        with open(version_path(index_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def stale_sources(index_path):
+    """
+    Archivos de origen de la versión publicada que cambiaron (o se están
+    reescribiendo) desde que se generó el índice; [] si coinciden o si el
+    marcador no los registra.
+    """
+    sources = (_read_marker(index_path) or {}).get("sources", {})
+    current = _stats(sources)
+    return [path for path in sources if current[path] != sources[path]]
+
+def index_version(index_path, uris_path):
+    """
+    Versión publicada (la del marcador) o, sin marcador, el tamaño y la fecha
+    de los archivos.
+    """
+    try:
+        with open(version_path(index_path), "r", encoding="utf-8") as f:
+            return json.load(f)["version"]
+    except (FileNotFoundError, ValueError, KeyError):
+        return json.dumps(_stats([index_path, uris_path]))
+
+class DenseIndex:
+    """
+    Una versión del índice con sus URIs. Se sustituye entera al recargar, así
+    que una búsqueda nunca mezcla el índice de una versión con las URIs de otra.
+    """
+
+    __slots__ = ("index", "uris", "version")
+
+    def __init__(self, index, uris, version):
+        self.index = index
+        self.uris = uris
+        self.version = version
+
+def load_dense_index(index_path, uris_path, mmap=True, strict=True):
+    """
+    Carga la versión publicada. Con strict=False (primera carga del servicio)
+    se aceptan también archivos que no coinciden con el marcador, p. ej. un
+    índice escrito a mano.
+    """
+    try:
+        with open(version_path(index_path), "r", encoding="utf-8") as f:
+            marker = json.load(f)
+    except FileNotFoundError:
+        marker = None
+    if marker is not None and _stats(marker["files"]) != marker["files"]:
+        if not strict:
+            return DenseIndex(read_index(index_path, mmap), UriTable(uris_path),
+                              json.dumps(_stats([index_path, uris_path])))
+        raise IndexNotReady(f"'{index_path}' no coincide con su marcador de versión")
+
+    version = marker["version"] if marker is not None else index_version(index_path, uris_path)
+    dense = DenseIndex(read_index(index_path, mmap), UriTable(uris_path), version)
+    # Si se publicó otra versión mientras se cargaba, se descarta esta carga
+    if marker is not None and _stats(marker["files"]) != marker["files"]:
+        raise IndexNotReady(f"'{index_path}' cambió durante la carga")
+    return dense
@@ -1,32 +1,30 @@
-import faiss
-import numpy as np
-from sentence_transformers import SentenceTransformer
-from huggingface_hub import InferenceClient
-from dotenv import load_dotenv
 import os
-import json
+import time
 
-# Cargar la API Key de Hugging Face desde .env
-load_dotenv()
-HUGGINGFACE_API_KEY = os.getenv("HF_API_TOKEN")
+import numpy as np
 
-# Cargar el índice FAISS y los URIs de las entidades
-index = faiss.read_index("grambank_entity_index.faiss")
-with open("entity_uris.txt", "r", encoding="utf-8") as f:
-    entity_uris = [line.strip() for line in f.readlines()]
+from feature_matrix import parse_feature_query
+from lexical_index import reciprocal_rank_fusion
+from metrics import instrumentation
+from query_analysis import QueryFeatures, QueryMatcher
+from runtime import Runtime
 
-# Cargar el archivo JSON con las propiedades de las entidades
-with open("all_entities_properties.json", "r", encoding="utf-8") as f:
-    all_entities_properties = json.load(f)
+# Los recursos pesados (índice FAISS, entidades, modelo de embeddings, cliente
+# de Hugging Face) se cargan la primera vez que se usan; runtime.warmup() los
+# carga por adelantado.
+runtime = Runtime()
 
-# Inicializar el modelo de embeddings local
-model = SentenceTransformer("multi-qa-mpnet-base-dot-v1")  
+def warmup(probe=True):
+    """
+    Carga todos los recursos compartibles antes de atender preguntas.
+    """
+    return runtime.warmup(probe=probe)
 
-# Inicializar el generador (usando la API de Hugging Face)
-generator_client = InferenceClient(
-    model="mistralai/Mixtral-8x7B-Instruct-v0.1",  # Modelo para generación de texto
-    token=HUGGINGFACE_API_KEY
-)
+def __getattr__(name):
+    # Compatibilidad: inference.index, inference.model, etc. siguen disponibles
+    if name in Runtime.SHAREABLE + Runtime.PER_PROCESS + ("index", "entity_uris"):
+        return getattr(runtime, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Diccionario keyword_to_property
 keyword_to_property = {
@@ -97,104 +95,214 @@ countries = {
     # Agregar más países según sea necesario
 }
 
+# Compilar las tablas de keywords y países una sola vez
+query_matcher = QueryMatcher(keyword_to_property, countries)
+
+def analyze_question(question):
+    """
+    Analiza la pregunta una vez; el resultado se comparte entre la
+    recuperación y el filtrado de propiedades.
+    """
+    if isinstance(question, QueryFeatures):
+        return question
+    return query_matcher.analyze(question)
+
 def get_embedding(text):
     """
     Obtiene el embedding de un texto usando un modelo local.
+    Las preguntas repetidas se sirven desde la caché.
     """
-    return model.encode(text)  # Generar embedding localmente
+    misses = []
+
+    def encode(text):
+        misses.append(text)
+        return runtime.query_encoder.encode(text)  # Generar embedding localmente
 
-def retrieve_entities(question, top_k=5):
+    with instrumentation.span("embedding"):
+        embedding = runtime.embedding_cache.get_or_compute(text, encode)
+    instrumentation.count("embedding_cache_misses" if misses else "embedding_cache_hits")
+    return embedding
+
+# Imprimir el contexto de cada pregunta solo si se pide (RAG_DEBUG=1)
+DEBUG = os.getenv("RAG_DEBUG", "") not in ("", "0")
+
+# "hybrid" (léxico + denso con RRF), "dense" (solo FAISS) o "lexical" (solo BM25)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+
+# Con shards (SHARD_MANIFEST), buscar solo en los de los países o familias mencionados
+SHARD_ROUTING = os.getenv("SHARD_ROUTING", "1") != "0"
+
+def dense_search(features, top_k):
+    # Convertir la pregunta en un embedding usando el modelo local
+    question_embedding = get_embedding(features.question).reshape(1, -1)  # Asegurar que sea 2D
+    if runtime.shards is not None:
+        shards = runtime.shards.route(features.folded) if SHARD_ROUTING else None
+        instrumentation.observe("shards_searched", len(shards or runtime.shards.names))
+        with instrumentation.span("faiss_search"):
+            return [uri for _, uri in runtime.shards.search(question_embedding, top_k, shards)]
+    # Buscar en FAISS (índice y URIs de la misma versión, aunque haya una recarga en curso)
+    dense = runtime.dense_index
+    with instrumentation.span("faiss_search"):
+        distances, indices = dense.index.search(question_embedding, top_k)
+    return [dense.uris[i] for i in indices[0] if i >= 0]
+
+def dense_search_batch(features_list, top_k):
+    """
+    dense_search para muchas preguntas: una sola codificación por lotes y una
+    sola búsqueda FAISS (por shard enrutado, con shards). Los embeddings
+    quedan en la caché de embeddings para la caché de respuestas.
+    """
+    if not features_list:
+        return []
+    questions = [features.question for features in features_list]
+    start = time.perf_counter()
+    embeddings = runtime.model.encode(questions, batch_size=min(len(questions), 256))
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    instrumentation.add_span("batch_embedding", time.perf_counter() - start)
+    for question, embedding in zip(questions, embeddings):
+        runtime.embedding_cache.put(question, embedding)
+
+    start = time.perf_counter()
+    if runtime.shards is not None:
+        rankings = []
+        for features, embedding in zip(features_list, embeddings):
+            shards = runtime.shards.route(features.folded) if SHARD_ROUTING else None
+            rankings.append([uri for _, uri in runtime.shards.search(embedding, top_k, shards)])
+    else:
+        dense = runtime.dense_index
+        _, indices = dense.index.search(embeddings, top_k)
+        rankings = [[dense.uris[i] for i in row if i >= 0] for row in indices]
+    instrumentation.add_span("batch_faiss_search", time.perf_counter() - start)
+    return rankings
+
+# Máximo de entidades que añade cada salto de la expansión por el grafo
+GRAPH_EXPANSION_FANOUT = int(os.getenv("GRAPH_EXPANSION_FANOUT", "50"))
+
+def expand_neighborhood(features, exact, max_fanout=GRAPH_EXPANSION_FANOUT):
+    """
+    Expansión por la adyacencia CSR del grafo:
+    - países mencionados (tabla fija o nombre de un país del grafo) y
+      familias nombradas -> sus lenguas;
+    - lengua nombrada y pregunta por la familia -> su familia y las demás
+      lenguas de esa familia.
+    """
+    adjacency = runtime.adjacency
+    all_entities_properties = runtime.all_entities_properties
+    kinds = lambda uri: all_entities_properties.get(uri, {}).get("type", [])
+
+    groups = [uri for _, uri in features.countries]
+    groups += [uri for uri in exact if {"Country", "LanguageFamily"} & set(kinds(uri))]
+    expanded = adjacency.expand(groups, ["hasLanguage"], max_fanout=max_fanout)
+
+    if "ling:languageFamily" in features.properties:
+        languages = [uri for uri in exact if "Language" in kinds(uri)]
+        expanded += adjacency.expand(languages, ["languageFamily"], max_fanout=max_fanout)
+        expanded += adjacency.expand(languages, ["languageFamily", "^languageFamily"], max_fanout=max_fanout)
+    return expanded
+
+def retrieve_entities(question, top_k=5, mode=None, timings=None, dense_ranking=None):
     """
     Recupera las entidades más relevantes para una pregunta dada.
-    Si la pregunta menciona un país, recupera las lenguas asociadas a ese país.
+    Si la pregunta nombra entidades exactamente (nombre, glottocode, ISO,
+    rasgo GBxxx), se devuelven sin codificar la pregunta; si no, se fusiona
+    el ranking BM25 con el de FAISS. Si la pregunta menciona un país o una
+    familia, recupera sus lenguas (expand_neighborhood).
+    Acepta la pregunta como texto o ya analizada (QueryFeatures); `timings`
+    (dict) recibe el recuperador usado y la latencia de cada etapa;
+    `dense_ranking` es un ranking FAISS ya calculado (dense_search_batch).
     """
-    # Convertir la pregunta en un embedding usando el modelo local
-    question_embedding = get_embedding(question).reshape(1, -1)  # Asegurar que sea 2D
-    
-    # Buscar en FAISS
-    distances, indices = index.search(question_embedding, top_k)
-    
-    # Recuperar las entidades más relevantes
-    retrieved_entities = [entity_uris[i] for i in indices[0]]
-    
-    # Identificar el país mencionado en la pregunta
-    mentioned_country = None
-    for country_name, country_uri in countries.items():
-        if country_name.lower() in question.lower():
-            mentioned_country = country_uri
-            break
-    
-    # Si se menciona un país, recuperar las lenguas asociadas
-    if mentioned_country and mentioned_country in all_entities_properties:
-        # Recuperar las lenguas asociadas al país
-        if "hasLanguage" in all_entities_properties[mentioned_country]:
-            retrieved_entities.extend(all_entities_properties[mentioned_country]["hasLanguage"])
-    
+    with instrumentation.record({} if timings is None else timings) as timings:
+        return _retrieve_entities(analyze_question(question), top_k, mode or RETRIEVAL_MODE, timings,
+                                  dense_ranking)
+
+def _retrieve_entities(features, top_k, mode, timings, dense_ranking=None):
+    lexical = runtime.lexical_index
+
+    retrieved_entities, lexical_ranking, exact = None, [], []
+    if mode != "dense":
+        with instrumentation.span("lexical_search"):
+            exact = lexical.exact_matches(features.folded)
+            if exact:
+                retrieved_entities = exact
+            else:
+                lexical_ranking = lexical.search(features.folded, top_k * 2)
+    timings["retriever"] = "exact" if exact else mode
+    instrumentation.count(f"retriever_{timings['retriever']}")
+
+    if retrieved_entities is None:
+        if mode == "lexical":
+            retrieved_entities = lexical_ranking[:top_k]
+        else:
+            dense_k = top_k * 2 if mode == "hybrid" else top_k
+            dense = dense_search(features, dense_k) if dense_ranking is None else dense_ranking[:dense_k]
+            if mode == "hybrid":
+                retrieved_entities = reciprocal_rank_fusion([lexical_ranking, dense])[:top_k]
+            else:
+                retrieved_entities = dense
+    retrieved_entities = list(retrieved_entities)
+
+    with instrumentation.span("graph_expansion"):
+        retrieved_entities.extend(expand_neighborhood(features, exact))
+
+    retrieved_entities = list(dict.fromkeys(retrieved_entities))
+    instrumentation.count("entities_retrieved", len(retrieved_entities))
+    instrumentation.observe("entities_per_request", len(retrieved_entities))
     return retrieved_entities
 
-def filter_properties_by_keywords(properties, question):
-    """
-    Filtra las propiedades de una entidad basándose en las keywords de la pregunta.
-    Asegura que el nombre de la lengua (label) siempre esté presente.
-    """
-    filtered_props = {}
-    question_lower = question.lower()  # Convertir la pregunta a minúsculas
-    
-    # Asegurarse de que el nombre de la lengua esté presente
-    if "label" in properties:
-        filtered_props["label"] = properties["label"]
-    
-    # Capturar el país si la pregunta menciona un país específico
-    for country_name in countries.keys():
-        if country_name.lower() in question_lower and "http://purl.org/dc/terms/spatial" in properties:
-            filtered_props["http://purl.org/dc/terms/spatial"] = properties["http://purl.org/dc/terms/spatial"]
-            break  # Solo necesitamos capturar un país
-    
-    # Capturar otras propiedades relevantes
-    for keyword, prop in keyword_to_property.items():
-        if keyword in question_lower and prop in properties:
-            filtered_props[prop] = properties[prop]
-    
-    return filtered_props
-
-def generate_response(question):
+# Entidades que acotan un filtro de rasgos (ver answer_feature_query)
+SCOPE_KINDS = {"Language", "LanguageFamily", "Country"}
+
+def _label(uri):
+    return runtime.all_entities_properties.get(uri, {}).get("label", [uri])[0]
+
+def feature_query(question):
     """
-    Genera una respuesta basada en las entidades recuperadas.
+    Filtro de rasgos de la pregunta (parse_feature_query) si el camino rápido
+    puede responderla: rasgos conocidos y sin lengua, familia ni país que acote
+    el filtro ("¿qué lenguas de Perú tienen GB020?" sigue por la recuperación,
+    porque la respuesta global sería incorrecta). Si no, None.
     """
-    # Recuperar entidades relevantes
-    entities = retrieve_entities(question)
-    
-    # Construir el contexto con información filtrada
-    context = []
-    for entity_uri in entities:
-        properties = all_entities_properties.get(entity_uri, {})
-        
-        # Filtrar propiedades basadas en las keywords de la pregunta
-        filtered_props = filter_properties_by_keywords(properties, question)
-        
-        if filtered_props:  # Solo incluir entidades con propiedades relevantes
-            description = f"Entidad: {filtered_props.get('label', 'Nombre no disponible')}\n"
-            description += "Propiedades relevantes:\n"
-            for prop, values in filtered_props.items():
-                if prop != "label":  # Evitar repetir el nombre de la entidad
-                    description += f"- {prop}: {', '.join(values)}\n"
-            context.append(description)
-        else:
-            # Si no hay propiedades relevantes, incluir un contexto mínimo
-            description = f"Entidad: {properties.get('label', 'Nombre no disponible')}\n"
-            description += "Propiedades relevantes:\n"
-            description += "- Información adicional no disponible\n"
-            context.append(description)
-    
-    context = "\n".join(context)
-    print("Contexto generado:\n", context)  # Imprimir el contexto para depuración
-    
-    # Generar la respuesta usando la API con un prompt más específico
-    if "Información adicional no disponible" in context:
-        # Si no hay información relevante, generar una respuesta que lo indique
-        response = "No se encontró información específica sobre las lenguas mencionadas en la base de datos."
-    else:
-        prompt = f"""
+    feature_matrix = runtime.feature_matrix
+    if feature_matrix is None:
+        return None
+    query = parse_feature_query(question)
+    if query is None or not all(f in feature_matrix for f in query["present"] + query["absent"]):
+        return None
+    features = analyze_question(question)
+    if features.countries or runtime.lexical_index.exact_matches(features.folded, kinds=SCOPE_KINDS):
+        return None
+    return query
+
+def answer_feature_query(question):
+    """
+    Camino rápido: si la pregunta es un filtro exacto de rasgos de Grambank
+    ("¿qué lenguas no tienen GB020 y tienen GB165?"), se responde con la matriz
+    de bits sin recuperación densa ni llamada al generador. Devuelve None si
+    la pregunta no es de ese tipo (ver feature_query).
+    """
+    query = feature_query(question)
+    if query is None:
+        return None
+    feature_matrix = runtime.feature_matrix
+
+    bits = feature_matrix.mask(present=query["present"], absent=query["absent"], mode=query["mode"])
+    conditions = [f"{f} presente" for f in query["present"]] + [f"{f} ausente" for f in query["absent"]]
+    connector = " o " if query["mode"] == "any" else " y "
+    languages = feature_matrix.select(present=query["present"], absent=query["absent"], mode=query["mode"])
+    response = f"Lenguas con {connector.join(conditions)}: {len(languages)}."
+
+    if query["by_family"]:
+        counts = [(n, family) for family, n in feature_matrix.family_mask_counts(bits).items() if n]
+        lines = [f"- {_label(family)}: {n}" for n, family in sorted(counts, reverse=True)]
+        response += "\nPor familia:\n" + "\n".join(lines)
+    elif not query["count"] and languages:
+        response += "\n" + ", ".join(sorted(_label(uri) for uri in languages))
+    return response
+
+NO_INFORMATION_RESPONSE = "No se encontró información específica sobre las lenguas mencionadas en la base de datos."
+
+def build_prompt(question, context):
+    return f"""
         A continuación se proporciona información relevante sobre algunas entidades:
         {context}
 
@@ -205,12 +313,114 @@ def generate_response(question):
 
         Respuesta:
         """
-        response = generator_client.text_generation(prompt, max_new_tokens=200)
-    
+
+def prepare_prompt(question, stats=None, dense_ranking=None):
+    """
+    Ejecuta toda la parte local del pipeline (CPU): camino rápido estructurado,
+    recuperación y construcción del contexto. Devuelve (prompt, respuesta_directa);
+    exactamente uno de los dos es None. Si se pasa `stats` (dict), se completa
+    con las entidades recuperadas, la duración de cada etapa, los contadores y
+    los tokens del contexto y del prompt. `dense_ranking` evita la búsqueda
+    FAISS individual (batch_qa.py la hace por lotes).
+    """
+    with instrumentation.record({} if stats is None else stats) as stats:
+        stats.setdefault("question", question)
+        return _prepare_prompt(question, stats, dense_ranking)
+
+def _prepare_prompt(question, stats, dense_ranking=None):
+    # Las preguntas de filtrado exacto por rasgos no necesitan al generador
+    with instrumentation.span("feature_query"):
+        structured = answer_feature_query(question)
+    if structured is not None:
+        stats["path"] = "feature_query"
+        return None, structured
+
+    # Analizar la pregunta una sola vez y recuperar entidades relevantes
+    with instrumentation.span("analyze"):
+        features = analyze_question(question)
+    with instrumentation.span("retrieve"):
+        entities = retrieve_entities(features, timings=stats, dense_ranking=dense_ranking)
+    stats["entities"] = entities
+    # Fragmentos precalculados, ordenados por relevancia y bajo presupuesto de tokens
+    builder = runtime.context_builder
+    with instrumentation.span("context"):
+        context, context_stats = builder.build(features, entities)
+    stats.update(context_stats)
+    if DEBUG:
+        print("Contexto generado:\n", context)  # Imprimir el contexto para depuración
+
+    if not context:
+        # Si no hay información relevante, generar una respuesta que lo indique
+        stats["path"] = "no_information"
+        return None, NO_INFORMATION_RESPONSE
+    with instrumentation.span("prompt"):
+        prompt = build_prompt(question, context)
+        stats["prompt_tokens"] = builder.count_tokens(prompt)
+    instrumentation.observe("prompt_tokens", stats["prompt_tokens"])
+    stats["path"] = "generate"
+    return prompt, None
+
+def _answer_namespace(generator, max_new_tokens):
+    # Respuestas de generadores o longitudes distintas no se mezclan
+    return f"{type(generator).__name__}:{max_new_tokens}"
+
+def cached_answer(question, stats, generator, max_new_tokens=200):
+    """
+    Respuesta de la caché semántica para una pregunta ya preparada con
+    prepare_prompt (mismas entidades recuperadas y pregunta casi idéntica), o None.
+    """
+    cache = runtime.answer_cache
+    if cache is None or not stats.get("entities"):
+        return None
+    with instrumentation.record(stats):
+        with instrumentation.span("answer_cache"):
+            answer, similarity = cache.lookup(stats["entities"], lambda: get_embedding(question),
+                                              _answer_namespace(generator, max_new_tokens))
+        instrumentation.count("answer_cache_hits" if answer is not None else "answer_cache_misses")
+    if answer is not None:
+        stats["path"] = "answer_cache"
+        stats["answer_similarity"] = similarity
+    return answer
+
+def store_answer(question, stats, generator, answer, max_new_tokens=200):
+    """
+    Guarda una respuesta generada en la caché semántica.
+    """
+    cache = runtime.answer_cache
+    if cache is not None and stats.get("entities") and answer:
+        cache.store(stats["entities"], question, lambda: get_embedding(question), answer,
+                    _answer_namespace(generator, max_new_tokens))
+
+def generate_response(question, generator=None, stats=None):
+    """
+    Genera una respuesta basada en las entidades recuperadas.
+    Las preguntas casi idénticas sobre las mismas entidades se sirven de la
+    caché semántica sin llamar al generador.
+    """
+    generator = generator or runtime.default_generator
+    with instrumentation.record({} if stats is None else stats) as stats:
+        start = time.perf_counter()
+        prompt, response = prepare_prompt(question, stats)
+        if prompt is not None:
+            response = cached_answer(question, stats, generator)
+        if response is None:
+            # Generar la respuesta usando la API con un prompt más específico
+            with instrumentation.span("generate"):
+                response = generator.generate(prompt, max_new_tokens=200)
+            store_answer(question, stats, generator, response)
+        instrumentation.add_span("total", time.perf_counter() - start)
+        instrumentation.count(f"requests_{stats['path']}")
+    runtime.record_answer()
+    instrumentation.emit(stats)
     return response
 
 # Ejemplo de uso
 if __name__ == "__main__":
     question = "Describe el mapudungun"
-    response = generate_response(question)
-    print("Respuesta generada:", response)
\ No newline at end of file
+    stats = {}
+    response = generate_response(question, stats=stats)
+    print("Respuesta generada:", response)
+    print(f"Tokens del prompt: {stats.get('prompt_tokens', 0)} "
+          f"(contexto {stats.get('context_tokens', 0)} de {stats.get('candidate_tokens', 0)} candidatos)")
+    print(f"Importación → primera respuesta: {runtime.metrics['import_to_first_answer_s']:.2f} s "
+          f"(carga de recursos: {', '.join(f'{k}={v:.2f}s' for k, v in runtime.load_times.items())})")
\ No newline at end of file
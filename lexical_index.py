@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Índice léxico invertido sobre nombres, glottocodes, códigos ISO, familias e
+identificadores de rasgos de Grambank.
+
+- exact_matches(): si la pregunta nombra una entidad tal cual ("mapudungun",
+  "arau1255", "GB020", "ISO arn"), devuelve esas entidades sin pasar por el
+  codificador denso.
+- search(): ranking BM25 para fusionarlo con los resultados de FAISS mediante
+  reciprocal_rank_fusion().
+
+Se construye en el paso de exportación (all_entities_properties.py) y se
+guarda en lexical_index.json.
+"""
+
+import json
+import math
+import os
+import re
+from collections import Counter
+
+from query_analysis import fold
+
+LEXICAL_PATH = "lexical_index.json"
+
+TOKEN = re.compile(r"\w+")
+FEATURE_ID = re.compile(r"^gb\d+[a-z]?$")
+MAX_NAME_TOKENS = 8
+# Palabras vacías: no cuentan en BM25 ni pueden ser un nombre exacto
+# (varios códigos ISO coinciden con palabras comunes: "con", "des", "que"...)
+STOPWORDS = frozenset("""
+a al ante como con cual cuales cuantas cuantos de del desde donde el en entre es esta este estos
+esas ese eso hay la las le lo los mas me no o para por que se sin sobre son su sus tiene tienen
+un una uno unos y describe dime lengua lenguas idioma idiomas nan the of is are there and in
+""".split())
+
+def tokenize(text):
+    return TOKEN.findall(fold(text))
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fusiona varias listas ordenadas: score(d) = Σ 1 / (k + rango).
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda item: -scores[item])
+
+class LexicalIndex:
+    def __init__(self, uris, kinds, lengths, postings, names, iso_codes, k1=1.2, b=0.75):
+        self.uris = uris
+        self.kinds = kinds              # tipo de cada entidad (Language, Country...)
+        self.lengths = lengths
+        self.postings = postings        # término -> [[doc, tf], ...]
+        self.names = names              # nombre normalizado -> [doc, ...]
+        self.iso_codes = iso_codes      # código ISO -> [doc, ...]
+        self.k1 = k1
+        self.b = b
+        self.avg_length = sum(lengths) / max(len(lengths), 1)
+        n = len(uris)
+        self.idf = {term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                    for term, docs in postings.items()}
+
+    @classmethod
+    def build(cls, all_entities_properties):
+        uris, kinds, lengths, postings, names, iso_codes = [], [], [], {}, {}, {}
+
+        def label_of(uri):
+            return all_entities_properties.get(uri, {}).get("label", [""])[0]
+
+        for uri, properties in all_entities_properties.items():
+            label = properties.get("label", [""])[0]
+            if not label or label == "nan":
+                continue
+            doc = len(uris)
+            uris.append(uri)
+            kinds.append(properties.get("type", [""])[0])
+
+            keys = [label] + properties.get("glottocode", [])
+            fid = uri.rstrip("/").rsplit("/", 1)[-1]
+            if FEATURE_ID.match(fid.lower()):
+                keys.append(fid)
+            for key in keys:
+                name = " ".join(tokenize(key))
+                if name and name != "nan" and name not in STOPWORDS:
+                    names.setdefault(name, []).append(doc)
+            for code in properties.get("isoCode", []):
+                iso_codes.setdefault(code.lower(), []).append(doc)
+
+            # Texto del documento: nombres, códigos y nombres de familia/país
+            text = keys + properties.get("isoCode", [])
+            text += [label_of(v) for p in ("languageFamily", "spokenInCountry") for v in properties.get(p, [])]
+            text += properties.get("mainDomain", []) + properties.get("finerGrouping", [])
+            counts = Counter(t for t in tokenize(" ".join(text)) if t not in STOPWORDS)
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append([doc, tf])
+        return cls(uris, kinds, lengths, postings, names, iso_codes)
+
+    def save(self, path=LEXICAL_PATH):
+        data = {"uris": self.uris, "kinds": self.kinds, "lengths": self.lengths, "postings": self.postings,
+                "names": self.names, "iso_codes": self.iso_codes}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=LEXICAL_PATH):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["uris"], data["kinds"], data["lengths"], data["postings"], data["names"],
+                   data["iso_codes"])
+
+    def exact_matches(self, question, kinds=None):
+        """
+        Entidades nombradas literalmente en la pregunta, en orden de aparición.
+        Gana el nombre más largo ("mosetén chimané" antes que "mosetén").
+        """
+        tokens = tokenize(question)
+        iso_context = "iso" in tokens
+        found, i = [], 0
+        while i < len(tokens):
+            for n in range(min(MAX_NAME_TOKENS, len(tokens) - i), 0, -1):
+                docs = self.names.get(" ".join(tokens[i:i + n]))
+                if docs:
+                    found.extend(docs)
+                    i += n
+                    break
+            else:
+                if iso_context and tokens[i] in self.iso_codes and tokens[i] not in STOPWORDS:
+                    found.extend(self.iso_codes[tokens[i]])
+                i += 1
+        return [self.uris[d] for d in dict.fromkeys(found) if kinds is None or self.kinds[d] in kinds]
+
+    def search(self, question, top_k=10):
+        """
+        Ranking BM25 de las entidades para la pregunta.
+        """
+        scores = {}
+        for term in set(tokenize(question)) - STOPWORDS:
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc] / self.avg_length)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        best = sorted(scores, key=lambda doc: -scores[doc])[:top_k]
+        return [self.uris[doc] for doc in best]
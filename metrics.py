@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentación ligera del pipeline de inferencia.
+
+- span("embedding"): mide la duración de una etapa, la acumula en un
+  histograma del proceso y la anota en el registro de la petición en curso
+  (stats["stages"]).
+- count("embedding_cache_hits") y observe("prompt_tokens", n): contadores e
+  histogramas de tamaños.
+- Cada petición es un dict (el mismo `stats` de prepare_prompt) que se
+  entrega a los sinks al terminar: JsonLogSink escribe una línea JSON por
+  petición y PrometheusSink expone los agregados en formato de texto de
+  Prometheus (ruta /metrics de server.py).
+
+Configuración por entorno: METRICS_LOG=ruta (o "-" para stderr) activa el
+log JSON por petición.
+"""
+
+import bisect
+import contextlib
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2000, 4000, 8000)
+
+_current = contextvars.ContextVar("metrics_record", default=None)
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class JsonLogSink:
+    """
+    Una línea JSON por petición, en un archivo o flujo. Las listas largas
+    (las URIs recuperadas) se reducen a su longitud.
+    """
+
+    def __init__(self, stream=None, path=None, summarize=("entities",)):
+        self.summarize = summarize
+        self._file = open(path, "a", encoding="utf-8") if path else None
+        self.stream = self._file or stream or sys.stderr
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        record = {key: len(value) if key in self.summarize else value for key, value in record.items()}
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+class PrometheusSink:
+    """
+    Exposición de los agregados en el formato de texto de Prometheus. No
+    hace nada por petición: Prometheus lee render() desde /metrics.
+    """
+
+    def __init__(self, instrumentation, prefix="rag"):
+        self.instrumentation = instrumentation
+        self.prefix = prefix
+
+    def emit(self, record):
+        pass
+
+    def _histogram(self, name, label, histograms):
+        lines = [f"# TYPE {name} histogram"]
+        for key, histogram in sorted(histograms.items()):
+            labels = f'{label}="{key}",' if label else ""
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{name}_bucket{{{labels}le="{le}"}} {cumulative}')
+            suffix = f"{{{labels[:-1]}}}" if labels else ""
+            lines.append(f"{name}_sum{suffix} {histogram.sum!r}")
+            lines.append(f"{name}_count{suffix} {histogram.count}")
+        return lines
+
+    def render(self):
+        spans, counters, sizes = self.instrumentation.snapshot()
+        lines = self._histogram(f"{self.prefix}_stage_seconds", "stage", spans)
+        for name, histogram in sorted(sizes.items()):
+            lines += self._histogram(f"{self.prefix}_{name}", None, {name: histogram})
+        for name, value in sorted(counters.items()):
+            lines += [f"# TYPE {self.prefix}_{name}_total counter", f"{self.prefix}_{name}_total {value}"]
+        return "\n".join(lines) + "\n"
+
+class Instrumentation:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans = {}
+        self.sizes = {}
+        self.counters = {}
+        self.sinks = []
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+        return sink
+
+    # -- Registro de la petición en curso ------------------------------------
+
+    @contextlib.contextmanager
+    def record(self, stats):
+        """
+        Asocia `stats` a la petición en curso (en este hilo o tarea), para que
+        las etapas anidadas anoten en él sus tiempos y contadores.
+        """
+        if _current.get() is stats:
+            yield stats
+            return
+        token = _current.set(stats)
+        try:
+            yield stats
+        finally:
+            _current.reset(token)
+
+    def emit(self, stats):
+        stats.setdefault("timestamp", time.time())
+        for sink in self.sinks:
+            sink.emit(stats)
+
+    # -- Medidas ---------------------------------------------------------------
+
+    def add_span(self, name, seconds, stats=None):
+        with self._lock:
+            histogram = self.spans.get(name)
+            if histogram is None:
+                histogram = self.spans[name] = Histogram(SECONDS_BUCKETS)
+            histogram.observe(seconds)
+        stats = _current.get() if stats is None else stats
+        if stats is not None:
+            stages = stats.setdefault("stages", {})
+            stages[name] = stages.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, time.perf_counter() - start)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        stats = _current.get()
+        if stats is not None:
+            counters = stats.setdefault("counters", {})
+            counters[name] = counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self.sizes.get(name)
+            if histogram is None:
+                histogram = self.sizes[name] = Histogram(SIZE_BUCKETS)
+            histogram.observe(value)
+
+    def snapshot(self):
+        with self._lock:
+            copy = lambda hs: {k: _copy_histogram(h) for k, h in hs.items()}
+            return copy(self.spans), dict(self.counters), copy(self.sizes)
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self.sizes.clear()
+            self.counters.clear()
+
+def _copy_histogram(histogram):
+    copy = Histogram(histogram.buckets)
+    copy.counts, copy.sum, copy.count = list(histogram.counts), histogram.sum, histogram.count
+    return copy
+
+instrumentation = Instrumentation()
+prometheus = instrumentation.add_sink(PrometheusSink(instrumentation))
+if os.getenv("METRICS_LOG"):
+    instrumentation.add_sink(JsonLogSink(path=None if os.getenv("METRICS_LOG") == "-" else os.getenv("METRICS_LOG")))
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Driver del pipeline de datos: CSV -> KG -> Wikidata -> exportación de
+entidades -> embeddings, modelado como un DAG de etapas.
+
+Cada etapa declara sus entradas (datos y scripts de los que depende) y sus
+salidas; las dependencias entre etapas se deducen de qué etapa produce cada
+entrada. Una etapa se omite si el hash de contenido de todas sus entradas y
+salidas coincide con el de su última ejecución (.pipeline_state.json), así
+que una etapa que se reejecuta pero produce lo mismo no invalida las
+siguientes.
+
+Uso:
+    python pipeline.py                   # todo lo que esté desactualizado
+    python pipeline.py entidades         # hasta esa etapa (con sus dependencias)
+    python pipeline.py --simular         # qué se ejecutaría
+    python pipeline.py --forzar wikidata # p. ej. para refrescar los datos de Wikidata
+    python pipeline.py --marcar          # adoptar los archivos actuales como al día
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from graphlib import TopologicalSorter
+
+from graph_store import file_hash
+
+STATE_PATH = ".pipeline_state.json"
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    command: tuple
+    inputs: tuple
+    outputs: tuple
+
+STAGES = (
+    Stage("kg", ("datos_ttl.py",),
+          inputs=("DATOS.csv", "datos_ttl.py", "graph_store.py"),
+          outputs=("grambank_sudamerica.ttl",)),
+    Stage("wikidata", ("wikidata.py",),
+          inputs=("grambank_sudamerica.ttl", "wikidata.py", "graph_store.py"),
+          outputs=("grambank_sudamerica_actualizado.ttl",)),
+    Stage("entidades", ("all_entities_properties.py",),
+          inputs=("grambank_sudamerica_actualizado.ttl", "all_entities_properties.py", "graph_store.py",
+                  "entity_store.py", "feature_matrix.py", "context_builder.py", "lexical_index.py",
+                  "graph_adjacency.py"),
+          outputs=("all_entities_properties.json", "all_entities_properties.bin", "feature_matrix.npz",
+                   "context_snippets.json", "lexical_index.json", "graph_adjacency.npz")),
+    Stage("embeddings", ("generate_embeddings.py", "--incremental"),
+          inputs=("all_entities_properties.json", "generate_embeddings.py", "index_backends.py", "index_store.py"),
+          outputs=("grambank_entity_index.faiss", "entity_uris.txt", "entity_uris.idx", "entity_manifest.json")),
+)
+
+def dependency_graph(stages):
+    producers = {output: stage.name for stage in stages for output in stage.outputs}
+    return {stage.name: {producers[i] for i in stage.inputs if i in producers} for stage in stages}
+
+def load_state(path=STATE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_state(state, path=STATE_PATH):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def hashes(paths):
+    return {path: file_hash(path) if os.path.exists(path) else None for path in paths}
+
+def stage_status(stage, state):
+    """
+    (al_día, motivo). Una salida editada a mano también cuenta como cambio.
+    """
+    previous = state.get(stage.name)
+    if previous is None:
+        return False, "sin ejecuciones previas"
+    if previous["command"] != list(stage.command):
+        return False, "cambió el comando"
+    missing = [path for path in stage.outputs if not os.path.exists(path)]
+    if missing:
+        return False, f"falta {missing[0]}"
+    for key, kind, paths in (("inputs", "entrada", stage.inputs), ("outputs", "salida", stage.outputs)):
+        current = hashes(paths)
+        changed = [path for path in paths if current[path] != previous[key].get(path)]
+        if changed:
+            return False, f"cambió la {kind} {changed[0]}"
+    return True, "al día"
+
+def record(stage, state, seconds=None):
+    state[stage.name] = {
+        "command": list(stage.command),
+        "inputs": hashes(stage.inputs),
+        "outputs": hashes(stage.outputs),
+        "finished": time.time(),
+        "seconds": seconds,
+    }
+
+def plan(stages, target=None):
+    """
+    Etapas en orden topológico (solo las necesarias para `target`).
+    """
+    graph = dependency_graph(stages)
+    order = list(TopologicalSorter(graph).static_order())
+    if target is None:
+        return order
+    needed, pending = set(), [target]
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(graph[name])
+    return [name for name in order if name in needed]
+
+def run(stages=STAGES, target=None, force=(), dry_run=False, mark=False, state_path=STATE_PATH):
+    by_name = {stage.name: stage for stage in stages}
+    state = load_state(state_path)
+    graph = dependency_graph(stages)
+    rerun = set()
+    for name in plan(stages, target):
+        stage = by_name[name]
+        up_to_date, reason = stage_status(stage, state)
+        if name in force:
+            up_to_date, reason = False, "forzada"
+        elif dry_run and graph[name] & rerun:
+            # Sin ejecutar no se sabe si la entrada cambiará; se asume que sí
+            up_to_date, reason = False, f"depende de {', '.join(sorted(graph[name] & rerun))}"
+
+        missing_inputs = [path for path in stage.inputs if not os.path.exists(path)]
+        if mark:
+            record(stage, state)
+            print(f"✔ {name:<12} marcada como al día")
+            continue
+        if up_to_date:
+            print(f"✔ {name:<12} al día")
+            continue
+        if missing_inputs and all(os.path.exists(path) for path in stage.outputs) and name not in force:
+            # P. ej. DATOS.csv no se distribuye: se usan las salidas ya generadas
+            print(f"⚠️ {name:<12} falta {missing_inputs[0]}; se conservan las salidas existentes")
+            continue
+        if missing_inputs:
+            raise SystemExit(f"❌ {name}: falta la entrada {missing_inputs[0]}")
+        if dry_run:
+            print(f"▶ {name:<12} se ejecutaría ({reason})")
+            rerun.add(name)
+            continue
+
+        print(f"▶ {name:<12} {reason}: {' '.join(stage.command)}")
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *stage.command], check=True)
+        record(stage, state, time.perf_counter() - start)
+        save_state(state, state_path)
+        rerun.add(name)
+        print(f"✅ {name} ({time.perf_counter() - start:.1f} s)")
+    if mark:
+        save_state(state, state_path)
+
+def main():
+    names = [stage.name for stage in STAGES]
+    parser = argparse.ArgumentParser(description="Ejecuta las etapas desactualizadas del pipeline de datos")
+    parser.add_argument("objetivo", nargs="?", choices=names, help="Última etapa a ejecutar")
+    parser.add_argument("--forzar", nargs="+", default=(), choices=names, help="Ejecutar aunque estén al día")
+    parser.add_argument("--simular", action="store_true", help="Mostrar el plan sin ejecutar nada")
+    parser.add_argument("--marcar", action="store_true",
+                        help="Registrar los archivos actuales como al día sin ejecutar nada")
+    args = parser.parse_args()
+    run(target=args.objetivo, force=set(args.forzar), dry_run=args.simular, mark=args.marcar)
+
+if __name__ == "__main__":
+    main()
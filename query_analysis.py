@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Análisis de preguntas compartido por la recuperación y el filtrado.
+
+Las tablas de keywords y de países se compilan una sola vez en una única
+expresión regular (insensible a tildes y mayúsculas, con límites de palabra y
+plurales simples). Cada pregunta se analiza una vez en un QueryFeatures que
+reutilizan retrieve_entities y ContextBuilder.build (que prioriza los
+fragmentos de las propiedades pedidas), en lugar de volver a recorrer las
+tablas por cada entidad recuperada.
+"""
+
+import re
+import unicodedata
+from dataclasses import dataclass
+
+def fold(text):
+    """
+    Minúsculas y sin tildes: "Perú" -> "peru", "Lingüística" -> "linguistica".
+    """
+    decomposed = unicodedata.normalize("NFD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+@dataclass(frozen=True)
+class QueryFeatures:
+    question: str
+    folded: str
+    properties: tuple      # propiedades pedidas, en el orden de keyword_to_property
+    countries: tuple       # (nombre, uri) de los países mencionados, en el orden de la tabla
+
+    @property
+    def country_uri(self):
+        return self.countries[0][1] if self.countries else None
+
+class QueryMatcher:
+    def __init__(self, keyword_to_property, countries):
+        # Cada patrón normalizado apunta a las entradas de tabla que lo originan
+        self._targets = {}
+        for rank, (keyword, prop) in enumerate(keyword_to_property.items()):
+            self._targets.setdefault(fold(keyword), []).append(("property", rank, prop))
+        for rank, (name, uri) in enumerate(countries.items()):
+            self._targets.setdefault(fold(name), []).append(("country", rank, (name, uri)))
+
+        # Los patrones más largos primero, para que "familia lingüística" gane a "familia".
+        # El lookahead permite coincidencias solapadas ("estado de la lengua" y "lengua").
+        alternatives = "|".join(re.escape(p) for p in sorted(self._targets, key=len, reverse=True))
+        self._pattern = re.compile(rf"(?<!\w)(?=({alternatives})(?:e?s)?(?!\w))")
+
+    def analyze(self, question):
+        folded = fold(question)
+        found = {"property": {}, "country": {}}
+        for match in self._pattern.finditer(folded):
+            for kind, rank, value in self._targets[match.group(1)]:
+                found[kind].setdefault(rank, value)
+        properties = tuple(dict.fromkeys(found["property"][r] for r in sorted(found["property"])))
+        countries = tuple(found["country"][r] for r in sorted(found["country"]))
+        return QueryFeatures(question, folded, properties, countries)
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Codificador de preguntas optimizado para CPU.
+
+- Modo "int8": cuantización dinámica int8 de las capas lineales del
+  transformer (torch.ao.quantization.quantize_dynamic).
+- max_seq_length recortado: las preguntas son cortas y el coste de la
+  atención crece con la longitud de secuencia.
+- Hilos: TORCH_THREADS fija los intra-op; con TORCH_THREADS o en modo int8 se
+  usa un solo hilo inter-op. En fp32 sin TORCH_THREADS torch queda como estaba.
+- MicroBatcher: agrupa preguntas concurrentes en una sola pasada del modelo.
+
+Como script, comprueba la precisión del modo optimizado frente a fp32: solapamiento
+del top-k sobre el índice FAISS actual, similitud coseno y latencia.
+
+Uso:
+    python query_encoder.py -k 5 --max-seq-length 64 --hilos 4 --json check.json
+"""
+
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from metrics import instrumentation
+
+QUERY_MAX_SEQ_LENGTH = 64
+
+def configure_threads(threads, mode="fp32"):
+    if not threads and mode != "int8":
+        return
+    import torch
+    if threads:
+        torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # solo puede fijarse antes del primer trabajo en paralelo
+
+def load_query_model(model_name, mode="fp32", max_seq_length=None, threads=None):
+    """
+    SentenceTransformer en CPU para codificar preguntas. mode="int8" cuantiza
+    las capas lineales; max_seq_length recorta las entradas (por defecto 64
+    tokens en modo int8, el valor del modelo en fp32).
+    """
+    from sentence_transformers import SentenceTransformer
+    configure_threads(threads, mode)
+    model = SentenceTransformer(model_name, device="cpu")
+    if mode == "int8":
+        import torch
+        from torch.ao.quantization import quantize_dynamic
+        model = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        max_seq_length = max_seq_length or QUERY_MAX_SEQ_LENGTH
+    elif mode != "fp32":
+        raise ValueError(f"Modo de codificador desconocido: {mode!r} (fp32 o int8)")
+    if max_seq_length:
+        model.max_seq_length = max_seq_length
+    model.eval()
+    return model
+
+class MicroBatcher:
+    """
+    Cola que agrupa las preguntas que llegan casi a la vez (hasta max_batch o
+    max_wait segundos) y las codifica en una sola llamada a encode_batch.
+    encode(text) tiene la misma forma que model.encode(text).
+    """
+
+    def __init__(self, encode_batch, max_batch=32, max_wait=0.002):
+        self.encode_batch = encode_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+        self._thread.start()
+
+    def encode(self, text):
+        future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # se procesa el lote y luego se cierra
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = self._collect(item)
+            try:
+                vectors = self.encode_batch([text for text, _ in batch])
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+            except Exception as exc:
+                for _, future in batch:
+                    future.set_exception(exc)
+            self.batches += 1
+            self.items += len(batch)
+            instrumentation.observe("encoder_batch_size", len(batch))
+
+    def stats(self):
+        return {"batches": self.batches, "items": self.items,
+                "mean_batch": self.items / self.batches if self.batches else 0.0}
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+def _load_questions(path):
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    return [json.loads(line)["question"] if line.startswith("{") else line for line in lines]
+
+def _encode_timed(model, questions):
+    # Una pregunta por llamada, como en get_embedding
+    latencies, vectors = [], []
+    for question in questions:
+        start = time.perf_counter()
+        vectors.append(model.encode(question))
+        latencies.append(time.perf_counter() - start)
+    return np.ascontiguousarray(vectors, dtype="float32"), np.asarray(latencies) * 1e3
+
+def check_accuracy(model_name, index_path, questions, k=5, max_seq_length=None, threads=None):
+    """
+    Compara el codificador int8 (y max_seq_length recortado) con el fp32 de
+    referencia sobre el índice actual.
+    """
+    import faiss
+    index = faiss.read_index(index_path)
+    reference = load_query_model(model_name, "fp32", threads=threads)
+    optimized = load_query_model(model_name, "int8", max_seq_length=max_seq_length, threads=threads)
+    reference.encode(questions[:1])
+    optimized.encode(questions[:1])
+
+    ref_vectors, ref_ms = _encode_timed(reference, questions)
+    opt_vectors, opt_ms = _encode_timed(optimized, questions)
+    _, ref_ids = index.search(ref_vectors, k)
+    _, opt_ids = index.search(opt_vectors, k)
+
+    overlaps = np.asarray([len(set(a) & set(b)) / k for a, b in zip(ref_ids.tolist(), opt_ids.tolist())])
+    cosines = np.sum(ref_vectors * opt_vectors, axis=1) / (
+        np.linalg.norm(ref_vectors, axis=1) * np.linalg.norm(opt_vectors, axis=1))
+    return {
+        "questions": len(questions),
+        "k": k,
+        "max_seq_length": optimized.max_seq_length,
+        "overlap_at_k_mean": round(float(overlaps.mean()), 4),
+        "overlap_at_k_min": round(float(overlaps.min()), 4),
+        "top1_agreement": round(float(np.mean(ref_ids[:, 0] == opt_ids[:, 0])), 4),
+        "cosine_mean": round(float(cosines.mean()), 4),
+        "cosine_min": round(float(cosines.min()), 4),
+        "fp32_p50_ms": round(float(np.percentile(ref_ms, 50)), 3),
+        "int8_p50_ms": round(float(np.percentile(opt_ms, 50)), 3),
+        "speedup_p50": round(float(np.percentile(ref_ms, 50) / np.percentile(opt_ms, 50)), 2),
+    }
+
+def main():
+    from runtime import EMBEDDING_MODEL, INDEX_PATH
+    parser = argparse.ArgumentParser(description="Precisión y latencia del codificador int8 frente a fp32")
+    parser.add_argument("--index", default=INDEX_PATH)
+    parser.add_argument("--preguntas", default="benchmark_questions.jsonl",
+                        help="JSONL con {\"question\": ...} o una pregunta por línea")
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--max-seq-length", type=int, default=QUERY_MAX_SEQ_LENGTH)
+    parser.add_argument("--hilos", type=int, default=None, help="Hilos intra-op de torch")
+    parser.add_argument("--json", help="Guardar el reporte en este archivo")
+    args = parser.parse_args()
+
+    report = check_accuracy(EMBEDDING_MODEL, args.index, _load_questions(args.preguntas), args.k,
+                            args.max_seq_length, args.hilos)
+    for key, value in report.items():
+        print(f"{key:<20} {value}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
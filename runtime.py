@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+Recursos pesados del pipeline de inferencia, cargados bajo demanda.
+
+Importar inference.py ya no carga el índice FAISS, el almacén de entidades,
+el modelo de embeddings ni el cliente de Hugging Face: cada recurso se
+inicializa la primera vez que se usa (o todos juntos con warmup()), y se
+registra cuánto tardó su carga.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+# Instante de importación del proceso, para la métrica "importación → primera respuesta"
+IMPORT_TIME = time.perf_counter()
+
+INDEX_PATH = "grambank_entity_index.faiss"
+URIS_PATH = "entity_uris.txt"
+EMBEDDING_MODEL = "multi-qa-mpnet-base-dot-v1"
+GENERATOR_MODEL = "mistralai/Mixtral-8x7B-Instruct-v0.1"
+# Índice y URIs mapeados en memoria (una copia en la caché de páginas para todos los procesos)
+INDEX_MMAP = os.getenv("INDEX_MMAP", "1") != "0"
+# Manifiesto de índices por shard (shards.py); si se define, sustituye al índice único
+SHARD_MANIFEST = os.getenv("SHARD_MANIFEST")
+
+def export_paths():
+    """
+    Archivos de la exportación de entidades (all_entities_properties.py) de
+    los que se cargan los recursos del runtime.
+    """
+    from context_builder import CONTEXT_PATH
+    from entity_store import STORE_PATH
+    from feature_matrix import MATRIX_PATH
+    from graph_adjacency import ADJACENCY_PATH
+    from lexical_index import LEXICAL_PATH
+    return [STORE_PATH, "all_entities_properties.json", MATRIX_PATH, CONTEXT_PATH, LEXICAL_PATH, ADJACENCY_PATH]
+
+class lazy_resource:
+    """
+    Descriptor que carga un recurso una sola vez (con bloqueo, seguro entre
+    hilos) y guarda el tiempo de carga en runtime.load_times.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.name = loader.__name__
+
+    def __get__(self, runtime, owner=None):
+        if runtime is None:
+            return self
+        try:
+            return runtime.__dict__[self.name]
+        except KeyError:
+            pass
+        with runtime._lock:
+            if self.name not in runtime.__dict__:
+                start = time.perf_counter()
+                runtime.__dict__[self.name] = self.loader(runtime)
+                runtime.load_times[self.name] = time.perf_counter() - start
+            return runtime.__dict__[self.name]
+
+    def __set__(self, runtime, value):
+        runtime.__dict__[self.name] = value
+
+class Runtime:
+    """
+    Contenedor de los recursos de inference.py.
+    """
+
+    # Recursos que un proceso padre puede cargar y compartir con sus hijos (prefork)
+    SHAREABLE = ("dense_index", "shards", "all_entities_properties", "feature_matrix", "lexical_index", "adjacency", "context_builder",
+                 "model")
+    # Recursos con conexiones o hilos propios: cada proceso abre los suyos
+    PER_PROCESS = ("query_encoder", "embedding_cache", "answer_cache", "generator_client", "default_generator")
+    # Recursos que salen de la exportación de entidades: se recargan junto con el índice
+    EXPORTED = ("all_entities_properties", "feature_matrix", "lexical_index", "adjacency", "context_builder")
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.load_times = {}
+        self.metrics = {}
+
+    @lazy_resource
+    def dense_index(self):
+        # Índice FAISS + tabla de URIs de una misma versión; reload_index() la sustituye
+        from index_store import load_dense_index
+        return load_dense_index(INDEX_PATH, URIS_PATH, mmap=INDEX_MMAP, strict=False)
+
+    @property
+    def index(self):
+        return self.dense_index.index
+
+    @property
+    def entity_uris(self):
+        return self.dense_index.uris
+
+    @lazy_resource
+    def shards(self):
+        if not SHARD_MANIFEST:
+            return None
+        from shards import ShardedIndex
+        return ShardedIndex(SHARD_MANIFEST, mmap=INDEX_MMAP)
+
+    @lazy_resource
+    def all_entities_properties(self):
+        # Con shards, la unión de sus almacenes; si no, el almacén binario compacto o el JSON
+        if self.shards is not None:
+            return self.shards.entities()
+        from entity_store import load_entities
+        return load_entities()
+
+    def _exported(self, path):
+        # Con shards, los artefactos de la exportación única no cubren las
+        # entidades de todos los shards (p. ej. una macro-área añadida con
+        # shards.py --por ninguno): se construyen a partir de sus almacenes
+        return self.shards is None and os.path.exists(path)
+
+    @lazy_resource
+    def feature_matrix(self):
+        from feature_matrix import FeatureMatrix, MATRIX_PATH
+        if self._exported(MATRIX_PATH):
+            return FeatureMatrix.load(MATRIX_PATH)
+        return FeatureMatrix.build(self.all_entities_properties) if self.shards is not None else None
+
+    @lazy_resource
+    def lexical_index(self):
+        # Índice léxico precalculado en la exportación, o construido aquí
+        from lexical_index import LEXICAL_PATH, LexicalIndex
+        if self._exported(LEXICAL_PATH):
+            return LexicalIndex.load(LEXICAL_PATH)
+        return LexicalIndex.build(self.all_entities_properties)
+
+    @lazy_resource
+    def adjacency(self):
+        # Adyacencia CSR precalculada en la exportación, o construida aquí
+        from graph_adjacency import ADJACENCY_PATH, GraphAdjacency
+        if self._exported(ADJACENCY_PATH):
+            return GraphAdjacency.load(ADJACENCY_PATH)
+        return GraphAdjacency.build(self.all_entities_properties)
+
+    @lazy_resource
+    def context_builder(self):
+        # Fragmentos precalculados si existen; si no, se renderizan y cachean al usarse
+        from context_builder import CONTEXT_PATH, DEFAULT_TOKEN_BUDGET, ContextBuilder, estimate_tokens
+        count_tokens = estimate_tokens
+        if os.getenv("CONTEXT_TOKENIZER"):  # p. ej. el tokenizador del modelo generador
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(os.getenv("CONTEXT_TOKENIZER"))
+            count_tokens = lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+        builder = ContextBuilder(self.all_entities_properties,
+                                 token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET)),
+                                 count_tokens=count_tokens)
+        return builder.load(CONTEXT_PATH) if self._exported(CONTEXT_PATH) else builder
+
+    @lazy_resource
+    def model(self):
+        # QUERY_ENCODER=int8 cuantiza el modelo y recorta max_seq_length (query_encoder.py)
+        from query_encoder import load_query_model
+        return load_query_model(
+            EMBEDDING_MODEL,
+            mode=os.getenv("QUERY_ENCODER", "fp32"),
+            max_seq_length=int(os.getenv("QUERY_MAX_SEQ_LENGTH", "0")) or None,
+            threads=int(os.getenv("TORCH_THREADS", "0")) or None,
+        )
+
+    @lazy_resource
+    def query_encoder(self):
+        # Con QUERY_MICROBATCH=1 las preguntas concurrentes se codifican en una sola pasada
+        if os.getenv("QUERY_MICROBATCH", "0") == "0":
+            return self.model
+        from query_encoder import MicroBatcher
+        model = self.model
+        return MicroBatcher(lambda texts: model.encode(texts, batch_size=len(texts)),
+                            max_batch=int(os.getenv("QUERY_MICROBATCH_SIZE", "32")),
+                            max_wait=float(os.getenv("QUERY_MICROBATCH_WAIT_MS", "2")) / 1000)
+
+    @lazy_resource
+    def generator_client(self):
+        from dotenv import load_dotenv
+        from huggingface_hub import InferenceClient
+        # Cargar la API Key de Hugging Face desde .env
+        load_dotenv()
+        return InferenceClient(model=GENERATOR_MODEL, token=os.getenv("HF_API_TOKEN"))
+
+    @lazy_resource
+    def default_generator(self):
+        from generators import HuggingFaceGenerator
+        return HuggingFaceGenerator(self.generator_client)
+
+    @lazy_resource
+    def embedding_cache(self):
+        # Caché de embeddings de preguntas (configurable por variables de entorno)
+        from embedding_cache import QueryEmbeddingCache
+        return QueryEmbeddingCache(
+            max_size=int(os.getenv("EMBEDDING_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("EMBEDDING_CACHE_TTL")) if os.getenv("EMBEDDING_CACHE_TTL") else None,
+            path=os.getenv("EMBEDDING_CACHE_PATH"),  # p. ej. "query_embeddings.sqlite"
+        )
+
+    @lazy_resource
+    def answer_cache(self):
+        # Caché semántica de respuestas; ANSWER_CACHE=0 la desactiva
+        if os.getenv("ANSWER_CACHE", "1") == "0":
+            return None
+        from answer_cache import SemanticAnswerCache
+        return SemanticAnswerCache(
+            threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+            max_size=int(os.getenv("ANSWER_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("ANSWER_CACHE_TTL")) if os.getenv("ANSWER_CACHE_TTL") else None,
+            path=os.getenv("ANSWER_CACHE_PATH"),  # p. ej. "answers.sqlite"
+            version=self.data_version(),
+        )
+
+    def data_version(self):
+        """
+        Huella de los datos de los que dependen las respuestas: almacén de
+        entidades, índice, URIs y modelo generador (tamaño y fecha de cada archivo).
+        """
+        from entity_store import STORE_PATH
+        parts = [GENERATOR_MODEL]
+        for path in (STORE_PATH, "all_entities_properties.json", INDEX_PATH, URIS_PATH, SHARD_MANIFEST or "-"):
+            try:
+                stat = os.stat(path)
+                parts.append(f"{path}:{stat.st_size}:{stat.st_mtime_ns}")
+            except FileNotFoundError:
+                parts.append(f"{path}:-")
+        return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+    def warmup(self, resources=SHAREABLE, probe=True):
+        """
+        Carga los recursos indicados y (con probe=True) ejecuta una codificación
+        y una búsqueda de prueba, para que la primera petición real no pague la
+        inicialización.
+        """
+        start = time.perf_counter()
+        if self.shards is not None:
+            # Con shards no hay índice único que cargar
+            resources = [name for name in resources if name != "dense_index"]
+            self.shards.load_all()
+        for name in resources:
+            getattr(self, name)
+        if probe and "model" in resources:
+            self.probe()
+        self.metrics["warmup_s"] = time.perf_counter() - start
+        return dict(self.load_times)
+
+    def probe(self):
+        """
+        Codificación y búsqueda de prueba. La primera pasada del modelo crea el
+        pool de hilos de torch/OpenMP, que no sobrevive a un fork: en modo
+        prefork se ejecuta en cada hijo, no en el padre.
+        """
+        if self.shards is not None:
+            self.shards.search(self.model.encode("warmup"), 1)
+        else:
+            embedding = self.model.encode("warmup").reshape(1, -1)
+            self.index.search(embedding.astype("float32"), 1)
+
+    def loaded_index_version(self):
+        """
+        Versión del índice en uso: la del manifiesto de shards o la del índice denso.
+        """
+        if self.shards is not None:
+            return self.shards.version
+        return self.dense_index.version
+
+    def reload_index(self, force=False):
+        """
+        Si se publicó una nueva versión del índice (generate_embeddings.py),
+        la carga junto con los recursos de la exportación de entidades ya
+        cargados (EXPORTED) y los sustituye todos de una vez; las peticiones en
+        curso terminan con los anteriores. Devuelve True si hubo recarga; el
+        motivo de no recargar queda en metrics["index_reload_status"].
+
+        No recarga si la exportación cambió después de generar el índice (o se
+        está reescribiendo): índice y entidades serían de versiones distintas.
+        Con shards no hace nada: la recarga en caliente no cubre el manifiesto
+        de shards y hay que reiniciar el servicio.
+        """
+        from index_store import IndexNotReady, index_version, load_dense_index, stale_sources
+        if self.shards is not None:
+            return self._reload_status("shards: sin recarga en caliente, reinicie el servicio")
+        current = self.__dict__.get("dense_index")
+        if current is None:
+            return self._reload_status("sin cargar")  # la primera carga ya leerá la última versión
+        if not force and current.version == index_version(INDEX_PATH, URIS_PATH):
+            return self._reload_status("al día")
+        stale = stale_sources(INDEX_PATH)
+        if stale:
+            self.metrics["index_reloads_refused"] = self.metrics.get("index_reloads_refused", 0) + 1
+            return self._reload_status("exportación distinta de la del índice: " + ", ".join(stale))
+        start = time.perf_counter()
+        try:
+            dense = load_dense_index(INDEX_PATH, URIS_PATH, mmap=INDEX_MMAP)
+        except IndexNotReady:
+            return self._reload_status("publicación en curso")  # se reintenta en la próxima comprobación
+        dense_time = time.perf_counter() - start
+        # Los recursos nuevos se cargan aparte, sin tocar los que están en uso
+        staged = Runtime()
+        for name in self.EXPORTED:
+            if name in self.__dict__:
+                getattr(staged, name)
+        if stale_sources(INDEX_PATH):
+            return self._reload_status("exportación reescrita durante la recarga")
+        with self._lock:
+            self.dense_index = dense
+            for name, value in staged.__dict__.items():
+                if name in self.EXPORTED:
+                    self.__dict__[name] = value
+            self.load_times.update(staged.load_times, dense_index=dense_time)
+            self.metrics["index_version"] = dense.version
+            self.metrics["index_reloads"] = self.metrics.get("index_reloads", 0) + 1
+            self.metrics["index_reload_status"] = "recargado"
+        # Las respuestas en caché se obtuvieron con el índice anterior
+        if self.__dict__.get("answer_cache") is not None:
+            self.answer_cache.set_version(self.data_version())
+        return True
+
+    def _reload_status(self, status):
+        self.metrics["index_reload_status"] = status
+        return False
+
+    def reset_per_process(self):
+        """
+        Descarta los recursos que no deben heredarse tras un fork.
+        """
+        with self._lock:
+            for name in self.PER_PROCESS:
+                self.__dict__.pop(name, None)
+
+    def record_answer(self):
+        """
+        Registra el tiempo desde la importación hasta la primera respuesta.
+        """
+        if "import_to_first_answer_s" not in self.metrics:
+            self.metrics["import_to_first_answer_s"] = time.perf_counter() - IMPORT_TIME
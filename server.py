@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+Servicio HTTP asíncrono alrededor de inference.py.
+
+- Atiende peticiones concurrentes en un único bucle de asyncio.
+- La parte de CPU (embedding, búsqueda FAISS, contexto) se ejecuta en un
+  ThreadPoolExecutor acotado; las llamadas bloqueantes al generador, en otro
+  de max_concurrency hilos (también los que siguen esperando al servicio
+  remoto tras un 504 ocupan un hilo de ese pool, sin crear más).
+- Los tokens generados se envían al cliente a medida que llegan
+  (Transfer-Encoding: chunked).
+- Contrapresión: como máximo max_concurrency peticiones activas y max_queue en
+  espera; el resto recibe 503 de inmediato. Cada petición tiene un tiempo límite (504).
+
+GET /metrics expone latencias por etapa y contadores en formato Prometheus
+(por proceso); METRICS_LOG=ruta escribe además una línea JSON por petición.
+
+Recarga en caliente del índice: con --reload-interval S (o INDEX_RELOAD_INTERVAL)
+cada proceso comprueba cada S segundos si generate_embeddings.py publicó una
+nueva versión y la sustituye, junto con las entidades y los recursos derivados de
+la exportación, sin reiniciar; POST /admin/reload lo hace al momento (en el
+proceso que atiende la petición) y devuelve el motivo si no recargó. Con shards
+(SHARD_MANIFEST) no hay recarga en caliente: hay que reiniciar el servicio.
+
+Con --prefork N el proceso padre carga todos los recursos (índice, entidades,
+modelo) una sola vez y luego crea N procesos hijos que los comparten por
+copy-on-write y aceptan conexiones del mismo socket.
+
+Uso:
+    python server.py --generator stub --port 8000
+    python server.py --generator stub --port 8000 --prefork 4
+    curl -N -X POST localhost:8000/generate -d '{"question": "Describe el mapudungun", "stream": true}'
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import signal
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+import inference
+from generators import StubGenerator
+from metrics import instrumentation, prometheus
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+           504: "Gateway Timeout"}
+MAX_BODY = 64 * 1024
+
+class RagServer:
+    def __init__(self, generator, cpu_workers=4, max_concurrency=16, max_queue=64, timeout=60.0,
+                 max_new_tokens=200, reload_interval=0.0):
+        self.generator = generator
+        self.executor = ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix="rag-cpu")
+        self.generation_executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="rag-gen")
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.max_new_tokens = max_new_tokens
+        self.reload_interval = reload_interval
+        self.in_flight = 0  # peticiones activas + en espera
+
+    # -- HTTP mínimo -------------------------------------------------------
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", "0"))
+        if length > MAX_BODY:
+            raise ValueError(413)
+        body = await reader.readexactly(length) if length else b""
+        return method, path, headers, body
+
+    async def _send(self, writer, status, payload, content_type="application/json; charset=utf-8"):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+
+    async def _start_stream(self, writer, state, prompt_tokens=0):
+        state["headers_sent"] = True
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; charset=utf-8\r\n"
+                     b"X-Prompt-Tokens: %d\r\n"
+                     b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n" % prompt_tokens)
+        await writer.drain()
+
+    async def _send_chunk(self, writer, text):
+        data = text.encode("utf-8")
+        if data:
+            writer.write(f"{len(data):X}\r\n".encode("latin-1") + data + b"\r\n")
+            await writer.drain()  # contrapresión hacia clientes lentos
+
+    async def _end_stream(self, writer):
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    # -- Pipeline ----------------------------------------------------------
+
+    async def answer(self, question, writer, stream, state):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        usage = {}
+        prompt, direct = await loop.run_in_executor(self.executor, inference.prepare_prompt, question, usage)
+        if direct is None:
+            # Caché semántica de respuestas (puede calcular el embedding: va al executor)
+            direct = await loop.run_in_executor(self.executor, inference.cached_answer, question, usage,
+                                                self.generator, self.max_new_tokens)
+        generated = direct is None
+
+        if not stream:
+            if generated:
+                generation_start = loop.time()
+                tokens = self.generator.astream(prompt, self.max_new_tokens, self.generation_executor)
+                direct = "".join([token async for token in tokens])
+                instrumentation.add_span("generate", loop.time() - generation_start, usage)
+            await self._send(writer, 200, {"question": question, "answer": direct,
+                                           "usage": {k: v for k, v in usage.items() if k != "entities"}})
+            state["headers_sent"] = True
+        else:
+            await self._start_stream(writer, state, usage.get("prompt_tokens", 0))
+            if not generated:
+                await self._send_chunk(writer, direct)
+            else:
+                generation_start = loop.time()
+                tokens = []
+                async for token in self.generator.astream(prompt, self.max_new_tokens, self.generation_executor):
+                    tokens.append(token)
+                    await self._send_chunk(writer, token)
+                instrumentation.add_span("generate", loop.time() - generation_start, usage)
+                direct = "".join(tokens)
+            await self._end_stream(writer)
+
+        if generated:
+            await loop.run_in_executor(self.executor, inference.store_answer, question, usage, self.generator,
+                                       direct, self.max_new_tokens)
+        usage.pop("entities", None)
+
+        instrumentation.add_span("total", loop.time() - start, usage)
+        instrumentation.count(f"requests_{usage.get('path', 'unknown')}")
+        inference.runtime.record_answer()
+        instrumentation.emit(usage)
+
+    async def handle(self, reader, writer):
+        state = {"headers_sent": False}
+        try:
+            try:
+                request = await self._read_request(reader)
+            except ValueError as exc:
+                status = exc.args[0] if exc.args and exc.args[0] in REASONS else 400
+                await self._send(writer, status, {"error": REASONS[status]})
+                return
+            if request is None:
+                return
+            method, path, _, body = request
+
+            if path == "/health":
+                await self._send(writer, 200, {"status": "ok", "pid": os.getpid(), "in_flight": self.in_flight,
+                                               **inference.runtime.metrics})
+                return
+            if path == "/admin/reload":
+                if method != "POST":
+                    await self._send(writer, 405, {"error": "Use POST"})
+                    return
+                try:
+                    reloaded = await self._reload_index()
+                except Exception as exc:
+                    instrumentation.count("index_reload_errors")
+                    print(f"[{os.getpid()}] ⚠️ No se pudo recargar el índice: {exc!r}")
+                    await self._send(writer, 500, {"error": f"No se pudo recargar el índice: {exc}"})
+                    return
+                await self._send(writer, 200, {"reloaded": reloaded, "pid": os.getpid(),
+                                               "status": inference.runtime.metrics.get("index_reload_status"),
+                                               "version": inference.runtime.loaded_index_version()})
+                return
+            if path == "/metrics":
+                await self._send(writer, 200, prometheus.render().encode("utf-8"),
+                                 content_type="text/plain; version=0.0.4; charset=utf-8")
+                return
+            if path != "/generate":
+                await self._send(writer, 404, {"error": "Ruta desconocida"})
+                return
+            if method != "POST":
+                await self._send(writer, 405, {"error": "Use POST"})
+                return
+            try:
+                payload = json.loads(body or b"{}")
+                question = payload["question"]
+            except (ValueError, KeyError, TypeError):
+                await self._send(writer, 400, {"error": "Se espera {\"question\": ...}"})
+                return
+
+            # Contrapresión: rechazar en lugar de encolar sin límite
+            if self.in_flight >= self.max_concurrency + self.max_queue:
+                instrumentation.count("requests_rejected")
+                await self._send(writer, 503, {"error": "Servidor saturado, reintente más tarde"})
+                return
+            self.in_flight += 1
+            try:
+                # El tiempo límite incluye la espera por un turno
+                async with asyncio.timeout(self.timeout):
+                    async with self.slots:
+                        await self.answer(question, writer, bool(payload.get("stream")), state)
+            finally:
+                self.in_flight -= 1
+        except TimeoutError:
+            # Si ya se enviaron cabeceras de streaming, solo se puede cortar la conexión
+            instrumentation.count("requests_timed_out")
+            if not state["headers_sent"]:
+                try:
+                    await self._send(writer, 504, {"error": "Tiempo de espera agotado"})
+                except ConnectionError:
+                    pass
+        except ConnectionError:
+            pass
+        except Exception as exc:
+            # Un fallo del pipeline o del generador no debe dejar la conexión sin respuesta
+            instrumentation.count("requests_failed")
+            print(f"[{os.getpid()}] ⚠️ Error al atender la petición: {exc!r}")
+            if not state["headers_sent"]:
+                try:
+                    await self._send(writer, 500, {"error": REASONS[500]})
+                except ConnectionError:
+                    pass
+        finally:
+            writer.close()
+
+    async def _reload_index(self):
+        # La carga (mmap del índice nuevo) se hace fuera del bucle de eventos
+        loop = asyncio.get_running_loop()
+        reloaded = await loop.run_in_executor(self.executor, inference.runtime.reload_index)
+        if reloaded:
+            instrumentation.count("index_reloads")
+            print(f"[{os.getpid()}] Índice recargado: versión {inference.runtime.loaded_index_version()}")
+        return reloaded
+
+    async def _watch_index(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                await self._reload_index()
+            except Exception as exc:  # un índice nuevo defectuoso no debe tumbar el servicio
+                instrumentation.count("index_reload_errors")
+                print(f"[{os.getpid()}] ⚠️ No se pudo recargar el índice: {exc}")
+
+    async def serve(self, host, port, sock=None):
+        if sock is not None:
+            server = await asyncio.start_server(self.handle, sock=sock)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        watcher = asyncio.create_task(self._watch_index()) if self.reload_interval > 0 else None
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+def make_generator(name, token_delay=0.0):
+    if name == "stub":
+        return StubGenerator(token_delay=token_delay)
+    return inference.default_generator
+
+def serve_prefork(make_server, host, port, workers):
+    """
+    Carga los recursos en el padre y atiende desde `workers` procesos hijos
+    que comparten el socket de escucha y la memoria de los recursos.
+    El padre solo carga los pesos del modelo, sin ejecutarlo: una pasada antes
+    del fork crearía el pool de hilos de torch/OpenMP, y los hijos que lo
+    heredan pueden bloquearse. Cada hijo hace su propia pasada de prueba.
+    """
+    load_times = inference.warmup(probe=False)
+    print("Recursos cargados: " + ", ".join(f"{k}={v:.2f}s" for k, v in load_times.items()))
+    sock = socket.create_server((host, port), backlog=1024)
+    # Evita que el recolector de basura toque (y copie) las páginas heredadas
+    gc.freeze()
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            inference.runtime.reset_per_process()
+            try:
+                inference.runtime.probe()
+                asyncio.run(make_server().serve(host, port, sock=sock))
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for child in children:
+            try:
+                os.kill(child, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for child in children:
+        os.waitpid(child, 0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Servicio HTTP del RAG de Grambank")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--generator", choices=["hf", "stub"], default="hf")
+    parser.add_argument("--stub-token-delay", type=float, default=0.0,
+                        help="Latencia simulada por token del generador stub (segundos)")
+    parser.add_argument("--cpu-workers", type=int, default=4)
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--prefork", type=int, default=0, metavar="N",
+                        help="Precargar los recursos y atender con N procesos hijos")
+    parser.add_argument("--warmup", action="store_true", help="Precargar los recursos antes de atender")
+    parser.add_argument("--reload-interval", type=float, default=float(os.getenv("INDEX_RELOAD_INTERVAL", "0")),
+                        help="Segundos entre comprobaciones de una nueva versión del índice (0 = nunca)")
+    args = parser.parse_args()
+
+    def make_server():
+        return RagServer(make_generator(args.generator, args.stub_token_delay), cpu_workers=args.cpu_workers,
+                         max_concurrency=args.max_concurrency, max_queue=args.max_queue, timeout=args.timeout,
+                         reload_interval=args.reload_interval)
+
+    print(f"Sirviendo en http://{args.host}:{args.port} (generador: {args.generator})")
+    if args.prefork:
+        serve_prefork(make_server, args.host, args.port, args.prefork)
+        return
+    if args.warmup:
+        inference.warmup()
+    asyncio.run(make_server().serve(args.host, args.port))
+
+if __name__ == "__main__":
+    main()
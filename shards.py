@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+Índices y almacenes de entidades particionados por región o familia.
+
+Cada shard tiene su propio directorio con un índice FAISS, su archivo de URIs
+y un almacén compacto (entity_store.py); el manifiesto (shards/manifest.json)
+enumera los shards con sus palabras clave de enrutado:
+
+    shards/manifest.json
+    shards/peru/{index.faiss, uris.txt, entities.bin}
+    shards/comun/...                      # rasgos gramaticales, siempre consultado
+
+- assign_shards reparte las entidades: cada lengua va al shard de su (primer)
+  país o de su familia, sus puntos geográficos la acompañan, los países y
+  familias van donde está la mayoría de sus lenguas y el resto (rasgos) a
+  "comun".
+- Cada shard se reconstruye por separado y solo si cambiaron sus
+  descripciones; una exportación de otra macro-área se añade como un shard
+  más (--por ninguno --nombre africa).
+- ShardedIndex busca en paralelo en los shards (FAISS libera el GIL), opcionalmente
+  solo en los que coinciden con la pregunta, y mezcla los top-k por puntuación.
+  Todos los shards usan el mismo modelo y producto interno, así que las
+  puntuaciones son comparables.
+
+Uso:
+    python shards.py --por pais
+    python shards.py --por pais --shards peru chile       # solo esos shards
+    python shards.py --entidades africa.json --por ninguno --nombre africa
+"""
+
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import re
+import time
+from collections import ChainMap, Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from query_analysis import fold
+
+SHARD_DIR = "shards"
+SHARD_MANIFEST = os.path.join(SHARD_DIR, "manifest.json")
+COMMON_SHARD = "comun"
+UNASSIGNED_SHARD = "otros"
+
+def slug(text):
+    return re.sub(r"[^a-z0-9]+", "_", fold(text)).strip("_") or UNASSIGNED_SHARD
+
+def _label(all_entities_properties, uri):
+    properties = all_entities_properties.get(uri)
+    return properties.get("label", [None])[0] if properties else None
+
+KEY_TYPES = {"pais": "Country", "familia": "LanguageFamily"}
+KEY_RELATIONS = {"pais": "spokenInCountry", "familia": "languageFamily"}
+
+def assign_shards(all_entities_properties, by="pais", groups=None):
+    """
+    Devuelve {shard: [uri, ...]}. by="pais" o "familia" decide la clave de
+    cada lengua; `groups` ({etiqueta de país o familia: shard}) permite
+    agrupar varias en una región. by="ninguno" pone todo en un solo shard.
+    """
+    groups = {fold(key): value for key, value in (groups or {}).items()}
+    relation = KEY_RELATIONS[by]
+
+    def shard_of(label):
+        return groups.get(fold(label)) or slug(label)
+
+    assignment = {}
+    for uri, properties in all_entities_properties.items():
+        if "Language" not in properties.get("type", []):
+            continue
+        labels = [_label(all_entities_properties, target) for target in properties.get(relation, [])]
+        labels = [label for label in labels if label]
+        assignment[uri] = shard_of(labels[0]) if labels else UNASSIGNED_SHARD
+        for point in properties.get("location", []):
+            assignment.setdefault(point, assignment[uri])
+
+    # Países y familias: con la mayoría de sus lenguas (o en su propio shard)
+    languages_in = {}
+    for uri, properties in all_entities_properties.items():
+        for target in properties.get("spokenInCountry", []) + properties.get("languageFamily", []):
+            if uri in assignment:
+                languages_in.setdefault(target, Counter())[assignment[uri]] += 1
+    for uri, properties in all_entities_properties.items():
+        if uri in assignment:
+            continue
+        types = properties.get("type", [])
+        if ("Country" in types and by == "pais") or ("LanguageFamily" in types and by == "familia"):
+            assignment[uri] = shard_of(properties.get("label", [uri])[0])
+        elif ("Country" in types or "LanguageFamily" in types) and uri in languages_in:
+            assignment[uri] = languages_in[uri].most_common(1)[0][0]
+        else:
+            assignment[uri] = COMMON_SHARD
+
+    shards = {}
+    for uri in all_entities_properties:
+        shards.setdefault(assignment[uri], []).append(uri)
+    return shards
+
+def shard_keywords(all_entities_properties, uris, by="pais"):
+    """
+    Nombres de los países (o familias, según `by`) de un shard, para el
+    enrutado por pregunta: los de sus entidades de ese tipo y los de todos los
+    países de cada lengua, no solo el primero, que decidió su shard (una lengua
+    de Brasil y Perú está en "brazil", y "Perú" también debe enrutar ahí). Con
+    by="pais" las familias no sirven: sus lenguas pueden estar repartidas en
+    varios shards.
+    """
+    key_type, relation = KEY_TYPES.get(by), KEY_RELATIONS.get(by)
+    keywords = set()
+    for uri in uris:
+        properties = all_entities_properties[uri]
+        types = properties.get("type", [])
+        targets = [uri] if key_type in types else []
+        if relation and "Language" in types:
+            targets += properties.get(relation, [])
+        for target in targets:
+            keywords.update(fold(label) for label in all_entities_properties.get(target, {}).get("label", []))
+    return sorted(keywords)
+
+def load_shard_manifest(path=SHARD_MANIFEST):
+    from generate_embeddings import load_manifest
+    return load_manifest(path) or {"shards": {}}
+
+def build_shard(name, uris, all_entities_properties, manifest, encode, backend, shard_dir=SHARD_DIR,
+                by="pais", source="", force=False, always=False):
+    """
+    Construye (o deja como está, si sus descripciones no cambiaron) un shard
+    y actualiza su entrada en `manifest`. Las descripciones se generan con el
+    diccionario completo, para resolver países y familias de otros shards.
+    """
+    import faiss
+    from entity_store import write_store
+    from generate_embeddings import build_descriptions, description_hash, write_uris
+    from index_backends import build_index
+    from index_store import write_uri_offsets
+
+    directory = os.path.join(shard_dir, name)
+    descriptions = build_descriptions(all_entities_properties, uris)
+    content_hash = description_hash(json.dumps([backend, by, descriptions], ensure_ascii=False))
+    entry = manifest["shards"].get(name)
+    files = {"index": "index.faiss", "uris": "uris.txt", "offsets": "uris.idx", "store": "entities.bin"}
+    if (not force and entry and entry["hash"] == content_hash
+            and all(os.path.exists(os.path.join(directory, f)) for f in files.values())):
+        # Las palabras clave dependen también de entidades de otros shards
+        entry["keywords"] = shard_keywords(all_entities_properties, uris, by)
+        return entry, False
+
+    os.makedirs(directory, exist_ok=True)
+    index = build_index(encode(list(descriptions.values())), backend)
+    # Se escriben a archivos temporales y se renombran: un shard nunca queda a medias
+    faiss.write_index(index, os.path.join(directory, "index.faiss.tmp"))
+    write_uris(dict(enumerate(descriptions)), os.path.join(directory, "uris.txt.tmp"))
+    write_uri_offsets(os.path.join(directory, "uris.txt.tmp"), os.path.join(directory, "uris.idx.tmp"))
+    write_store({uri: all_entities_properties[uri] for uri in uris}, os.path.join(directory, "entities.bin.tmp"))
+    for f in files.values():
+        os.replace(os.path.join(directory, f + ".tmp"), os.path.join(directory, f))
+
+    entry = manifest["shards"][name] = {
+        **{key: os.path.join(name, f) for key, f in files.items()},
+        "entities": len(uris),
+        "keywords": shard_keywords(all_entities_properties, uris, by),
+        "by": by,
+        "always": always,
+        "source": source,
+        "backend": backend,
+        "hash": content_hash,
+        "built": time.time(),
+    }
+    return entry, True
+
+class ShardedIndex:
+    """
+    Índices de los shards del manifiesto, cargados al primer uso.
+
+    search(embedding, top_k, shards=None) -> [(puntuación, uri), ...]
+    """
+
+    def __init__(self, manifest_path=SHARD_MANIFEST, max_workers=None, mmap=True):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.base = os.path.dirname(manifest_path)
+        self.names = sorted(self.manifest["shards"])
+        self.max_workers = max_workers or len(self.names)
+        self.mmap = mmap
+        self._loaded = {}
+        self._executor = None
+        self._pid = None
+        # Enrutado: palabras clave de cada shard, con límites de palabra
+        self._keyword_shard = {}
+        for name, entry in self.manifest["shards"].items():
+            # El nombre del shard también enruta ("andes" con --regiones), salvo los genéricos
+            names = [] if name in (COMMON_SHARD, UNASSIGNED_SHARD) else [fold(name.replace("_", " "))]
+            for keyword in entry["keywords"] + names:
+                self._keyword_shard.setdefault(keyword, set()).add(name)
+        alternatives = "|".join(re.escape(k) for k in sorted(self._keyword_shard, key=len, reverse=True))
+        self._pattern = re.compile(rf"(?<!\w)({alternatives})(?!\w)") if alternatives else None
+        self.always = [name for name in self.names if self.manifest["shards"][name].get("always")]
+        # Versión del conjunto de shards: huella de los hashes de contenido de cada uno
+        self.version = hashlib.sha1("|".join(f"{name}:{self.manifest['shards'][name]['hash']}"
+                                             for name in self.names).encode("utf-8")).hexdigest()
+
+    def _path(self, name, key):
+        return os.path.join(self.base, self.manifest["shards"][name][key])
+
+    def shard(self, name):
+        # (índice, uris); la carga concurrente de un mismo shard solo duplica trabajo
+        if name not in self._loaded:
+            from index_store import UriTable, read_index
+            self._loaded[name] = (read_index(self._path(name, "index"), self.mmap),
+                                  UriTable(self._path(name, "uris")))
+        return self._loaded[name]
+
+    def load_all(self):
+        for name in self.names:
+            self.shard(name)
+        return self
+
+    def entities(self):
+        """
+        Vista única (solo lectura) de los almacenes de todos los shards.
+        """
+        from entity_store import EntityStore
+        return ChainMap(*(EntityStore(self._path(name, "store")) for name in self.names))
+
+    def route(self, folded_question):
+        """
+        Shards cuyos países o familias menciona la pregunta (más los que se
+        consultan siempre); todos si no menciona ninguno.
+        """
+        matched = set()
+        if self._pattern is not None:
+            for match in self._pattern.finditer(folded_question):
+                matched |= self._keyword_shard[match.group(1)]
+        if not matched:
+            return list(self.names)
+        return sorted(matched | set(self.always))
+
+    def _search_shard(self, name, embedding, top_k):
+        index, uris = self.shard(name)
+        distances, indices = index.search(embedding, top_k)
+        return [(float(d), uris[i]) for d, i in zip(distances[0], indices[0]) if i >= 0 and uris[i]]
+
+    def search(self, embedding, top_k, shards=None):
+        embedding = embedding.reshape(1, -1).astype("float32", copy=False)
+        shards = self.names if shards is None else shards
+        if len(shards) == 1:
+            results = [self._search_shard(shards[0], embedding, top_k)]
+        else:
+            # El pool no se hereda tras un fork (prefork): uno por proceso
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="shard-search")
+                self._pid = os.getpid()
+            results = self._executor.map(lambda name: self._search_shard(name, embedding, top_k), shards)
+        return heapq.nlargest(top_k, (hit for hits in results for hit in hits), key=lambda hit: hit[0])
+
+def main():
+    from entity_store import load_entities
+    from generate_embeddings import INDEX_BACKEND, MODEL_NAME, model_encoder, save_manifest
+    from index_backends import BACKENDS
+
+    parser = argparse.ArgumentParser(description="Construye los índices por shard (región, país o familia)")
+    parser.add_argument("--entidades", default=None,
+                        help="Almacén (.bin) o JSON de entidades (por defecto, la exportación actual)")
+    parser.add_argument("--por", default="pais", choices=["pais", "familia", "ninguno"])
+    parser.add_argument("--nombre", help="Nombre del shard con --por ninguno (p. ej. la macro-área)")
+    parser.add_argument("--regiones", help="JSON {país o familia: shard} para agrupar varios en una región")
+    parser.add_argument("--shards", nargs="*", help="Reconstruir solo estos shards")
+    parser.add_argument("--backend", default=INDEX_BACKEND, choices=sorted(BACKENDS))
+    parser.add_argument("--dir", default=SHARD_DIR)
+    parser.add_argument("--forzar", action="store_true", help="Reconstruir aunque no haya cambios")
+    args = parser.parse_args()
+
+    if args.entidades and args.entidades.endswith(".json"):
+        with open(args.entidades, "r", encoding="utf-8") as f:
+            all_entities_properties = json.load(f)
+    elif args.entidades:
+        all_entities_properties = load_entities(args.entidades)
+    else:
+        all_entities_properties = load_entities()
+    source = os.path.abspath(args.entidades or "all_entities_properties")
+
+    if args.por == "ninguno":
+        if not args.nombre:
+            parser.error("--por ninguno necesita --nombre")
+        assignment = {slug(args.nombre): list(all_entities_properties)}
+    else:
+        groups = None
+        if args.regiones:
+            with open(args.regiones, "r", encoding="utf-8") as f:
+                groups = json.load(f)
+        assignment = assign_shards(all_entities_properties, args.por, groups)
+
+    manifest_path = os.path.join(args.dir, "manifest.json")
+    manifest = load_shard_manifest(manifest_path)
+    if manifest.get("model", MODEL_NAME) != MODEL_NAME:
+        raise SystemExit(f"El manifiesto usa otro modelo ({manifest['model']}); los shards no serían comparables")
+    manifest["model"] = MODEL_NAME
+    if args.shards is None:
+        # Reconstrucción completa de esta fuente: se quitan los shards que ya no existen
+        for name in [n for n, e in manifest["shards"].items() if e.get("source") == source and n not in assignment]:
+            del manifest["shards"][name]
+    else:
+        unknown = set(args.shards) - set(assignment)
+        if unknown:
+            raise SystemExit(f"Shards desconocidos: {', '.join(sorted(unknown))}")
+
+    encode = model_encoder()
+    for name, uris in sorted(assignment.items()):
+        if args.shards is not None and name not in args.shards:
+            continue
+        start = time.perf_counter()
+        entry, built = build_shard(name, uris, all_entities_properties, manifest, encode, args.backend,
+                                   shard_dir=args.dir, by=args.por, source=source, force=args.forzar,
+                                   always=name == COMMON_SHARD)
+        status = f"reconstruido en {time.perf_counter() - start:.1f} s" if built else "sin cambios"
+        print(f"{name:<20} {entry['entities']:>6} entidades  {status}")
+        save_manifest(manifest, manifest_path)
+    print(f"✅ {len(manifest['shards'])} shards en '{manifest_path}'")
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,33 @@
-import pandas as pd
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
-from rdflib import Graph, Namespace, Literal, URIRef, BNode
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from rdflib import Namespace, Literal, URIRef, BNode
 from rdflib.namespace import RDF, RDFS, XSD, GEO, DC, DCTERMS, SKOS, OWL
 
+from graph_store import read_graph, write_graph
+
 # Configurar namespaces
 LING = Namespace("http://purl.org/linguistics#")
 GLOTTO = Namespace("https://glottolog.org/resource/languoid/id/")
 GRAMBANK = Namespace("https://grambank.clld.org/parameters/")
 WIKIDATA = Namespace("http://www.wikidata.org/entity/")
 
-# Cargar el grafo RDF existente
-g = Graph()
-g.parse("grambank_sudamerica.ttl", format="turtle")
+WIKIDATA_SPARQL_URL = os.getenv("WIKIDATA_SPARQL_URL", "https://query.wikidata.org/sparql")
+CACHE_DIR = ".cache_wikidata"
+USER_AGENT = "RAG-grambank/1.0 (https://github.com/javiervzpucp/RAG-grambank)"
 
-# SPARQL para obtener información detallada de las lenguas desde Wikidata
+# SPARQL para obtener información detallada de las lenguas desde Wikidata.
+# Solo se consultan los códigos ISO presentes en el grafo (bloque VALUES).
 SPARQL_QUERY = """
 SELECT ?lang ?iso ?wikidata ?country ?countryLabel ?linguisticTypologyLabel ?numSpeakers ?unescoStatus ?unescoStatusLabel WHERE {
+  VALUES ?iso { %s }
   ?lang wdt:P220 ?iso.
   OPTIONAL { ?lang wdt:P17 ?country. ?country rdfs:label ?countryLabel FILTER (lang(?countryLabel) = "en") }
   OPTIONAL { ?lang wdt:P3866 ?linguisticTypology. ?linguisticTypology rdfs:label ?linguisticTypologyLabel FILTER (lang(?linguisticTypologyLabel) = "en") }
@@ -25,16 +37,82 @@ SELECT ?lang ?iso ?wikidata ?country ?countryLabel ?linguisticTypologyLabel ?num
 }
 """
 
-def obtener_datos_wikidata():
-    print("Obteniendo información de Wikidata...")
-    sparql_url = "https://query.wikidata.org/sparql"
-    headers = {"Accept": "application/sparql-results+json"}
-    response = requests.get(sparql_url, params={"query": SPARQL_QUERY, "format": "json"}, headers=headers)
-    
-    if response.status_code == 200:
-        results = response.json()["results"]["bindings"]
-        wikidata_info = {}
-        
+def codigos_iso(g):
+    """
+    Códigos ISO 639-3 de las lenguas del grafo, ordenados.
+    """
+    return sorted({str(iso) for lang_uri in g.subjects(RDF.type, LING.Language)
+                   for iso in g.objects(lang_uri, LING.isoCode)})
+
+def crear_sesion(hilos):
+    """
+    Sesión HTTP con un pool de conexiones por hilo y reintentos con backoff
+    exponencial (respeta Retry-After en respuestas 429/503). Agotados los
+    reintentos se devuelve la última respuesta en lugar de lanzar RetryError.
+    """
+    sesion = requests.Session()
+    reintentos = Retry(total=5, backoff_factor=1.0, status_forcelist=(429, 500, 502, 503, 504),
+                       allowed_methods=("GET",), respect_retry_after_header=True, raise_on_status=False)
+    adaptador = HTTPAdapter(pool_connections=hilos, pool_maxsize=hilos, max_retries=reintentos)
+    sesion.mount("http://", adaptador)
+    sesion.mount("https://", adaptador)
+    sesion.headers.update({"Accept": "application/sparql-results+json", "User-Agent": USER_AGENT})
+    return sesion
+
+def _ruta_cache(cache_dir, endpoint, consulta):
+    clave = hashlib.sha256(f"{endpoint}\n{consulta}".encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, f"{clave}.json")
+
+def consultar_lote(sesion, endpoint, codigos, cache_dir=CACHE_DIR, max_edad=7 * 24 * 3600):
+    """
+    Ejecuta la consulta SPARQL para un lote de códigos ISO. La respuesta se
+    guarda en disco: dentro de max_edad segundos se reutiliza sin red; después
+    se revalida con If-None-Match (ETag) y un 304 renueva la entrada.
+    """
+    consulta = SPARQL_QUERY % " ".join(json.dumps(c) for c in codigos)
+    ruta = _ruta_cache(cache_dir, endpoint, consulta) if cache_dir else None
+    cacheado = None
+    if ruta and os.path.exists(ruta):
+        with open(ruta, "r", encoding="utf-8") as f:
+            cacheado = json.load(f)
+        if time.time() - cacheado["fetched"] < max_edad:
+            return cacheado["bindings"]
+
+    headers = {"If-None-Match": cacheado["etag"]} if cacheado and cacheado.get("etag") else {}
+    try:
+        response = sesion.get(endpoint, params={"query": consulta, "format": "json"}, headers=headers, timeout=120)
+        if response.status_code == 304 and cacheado:
+            bindings = cacheado["bindings"]
+        elif response.status_code == 200:
+            bindings = response.json()["results"]["bindings"]
+        else:
+            raise requests.HTTPError(f"HTTP {response.status_code}", response=response)
+    except requests.RequestException as e:
+        motivo = f"HTTP {e.response.status_code}" if e.response is not None else type(e).__name__
+        print(f"⚠️ Error al obtener datos de Wikidata ({motivo}).")
+        # Una copia vencida es mejor que nada si el servicio falla
+        return cacheado["bindings"] if cacheado else []
+
+    if ruta:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{ruta}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"etag": response.headers.get("ETag") or (cacheado or {}).get("etag"),
+                       "fetched": time.time(), "bindings": bindings}, f, ensure_ascii=False)
+        os.replace(tmp, ruta)
+    return bindings
+
+def obtener_datos_wikidata(codigos, endpoint=WIKIDATA_SPARQL_URL, tamano_lote=200, hilos=4,
+                           cache_dir=CACHE_DIR, max_edad=7 * 24 * 3600):
+    print(f"Obteniendo información de Wikidata para {len(codigos)} códigos ISO...")
+    lotes = [codigos[i:i + tamano_lote] for i in range(0, len(codigos), tamano_lote)]
+    sesion = crear_sesion(hilos)
+    with ThreadPoolExecutor(max_workers=hilos) as executor:
+        resultados = list(executor.map(
+            lambda lote: consultar_lote(sesion, endpoint, lote, cache_dir, max_edad), lotes))
+
+    wikidata_info = {}
+    for results in resultados:
         for item in results:
             iso = item["iso"]["value"]
             wikidata_info[iso] = {
@@ -46,15 +124,10 @@ def obtener_datos_wikidata():
                 "unescoStatus": item.get("unescoStatus", {}).get("value"),
                 "unescoStatusLabel": item.get("unescoStatusLabel", {}).get("value")
             }
-        
-        return wikidata_info
-    else:
-        print("⚠️ Error al obtener datos de Wikidata.")
-        return {}
 
-wikidata_map = obtener_datos_wikidata()
+    return wikidata_info
 
-def actualizar_grafo_con_wikidata():
+def actualizar_grafo_con_wikidata(g, wikidata_map):
     print("Actualizando el grafo con información de Wikidata...")
     for lang_uri in g.subjects(RDF.type, LING.Language):
         iso_code = g.value(lang_uri, LING.isoCode)
@@ -99,9 +172,28 @@ def actualizar_grafo_con_wikidata():
                 g.add((lang_uri, DCTERMS.subject, Literal(data["unescoStatusLabel"], lang="en")))
 
 def main():
-    actualizar_grafo_con_wikidata()
+    parser = argparse.ArgumentParser(description="Enriquece el KG con información de Wikidata")
+    parser.add_argument("--entrada", default="grambank_sudamerica.ttl")
+    parser.add_argument("--salida", default="grambank_sudamerica_actualizado.ttl")
+    parser.add_argument("--endpoint", default=WIKIDATA_SPARQL_URL,
+                        help="Endpoint SPARQL (por defecto $WIKIDATA_SPARQL_URL o el de Wikidata)")
+    parser.add_argument("--tamano-lote", type=int, default=200, help="Códigos ISO por consulta")
+    parser.add_argument("--hilos", type=int, default=4, help="Consultas concurrentes")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="Directorio de caché ('' para desactivarla)")
+    parser.add_argument("--max-edad", type=float, default=7 * 24 * 3600,
+                        help="Segundos durante los que una respuesta en caché se usa sin revalidar")
+    args = parser.parse_args()
+
+    # Cargar el grafo RDF existente (desde su almacén binario .gstore si está al día)
+    g = read_graph(args.entrada)
+
+    wikidata_map = obtener_datos_wikidata(codigos_iso(g), args.endpoint, args.tamano_lote, args.hilos,
+                                          args.cache_dir, args.max_edad)
+    actualizar_grafo_con_wikidata(g, wikidata_map)
     print("\nGuardando grafo actualizado...")
-    g.serialize("grambank_sudamerica_actualizado.ttl", format="turtle")
+    # Con extensión .nt se escribe N-Triples, la entrada del exportador en streaming;
+    # junto al RDF queda su .gstore para all_entities_properties.py
+    write_graph(g, args.salida)
     print(f"✅ KG actualizado! Triples totales: {len(g):,}")
 
 if __name__ == "__main__":